@@ -0,0 +1,281 @@
+"""
+Headless batch mode: answers a set of questions with the agent of the app, without the Streamlit UI, for regression
+question sets and nightly bulk Q&A over an indexed corpus.
+The corpus is loaded from an index saved on disk (--index) or built from PDF files (--pdf, optionally saved with
+--save-index) with the same pipeline as the app (tools.explore_pdf, chunking and the embeddings service), and
+searched by the agents of a batch session of the index registry. The LLM and the embeddings endpoint come from
+the environment, as in the app.
+
+Input: a JSONL file with one question per line, {"id": "...", "question": "..."} ("id" defaults to the line number).
+Output: a JSONL file with one result per line: 'id', 'question', 'answer', 'sources' (tool, query and output of each
+search), 'timings' (rate limit wait, time to first token, total latency, prompt tokens and LLM calls) and 'error'.
+
+Every question gets a new agent, so the answers do not depend on the order of the questions. They run in a bounded
+pool of worker threads, started at most --rate per second; only a few more questions than workers are queued at a
+time. Each result is appended and flushed to the output as soon as it is ready, so the output file is the
+checkpoint: running the same command again skips the questions already answered and retries the failed ones (the
+last line of an id is its current result). Ctrl+C stops starting questions and waits for the running ones.
+
+Usage:
+    python batch_query.py --index indexes/manuales --questions preguntas.jsonl --output respuestas.jsonl
+    python batch_query.py --pdf a.pdf b.pdf --save-index indexes/ab --questions preguntas.jsonl --output r.jsonl --workers 8 --rate 4
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from tools.index_registry import get_index_registry
+from tools.ivf_index import load_index
+from tools.nuevo_agente import nuevo_agente, stream_agent_response
+from tools.search_embedding import reset_query_embeddings_memo
+
+# Sesión del registro de índices con el corpus del lote
+BATCH_SESSION_ID = "batch"
+# Mismo prompt inicial por defecto que la pantalla de configuración de la app
+DEFAULT_SYSTEM_PROMPT = ("Eres un asistente que ayuda. La respuesta siempre la devolverás en el idioma en el que te "
+                         "hablen. Debes de ser breve y conciso en tus respuestas.")
+# Preguntas en cola por cada hilo de trabajo, para no cargar todo el lote en el ejecutor
+QUEUED_PER_WORKER = 2
+
+"""
+Spaces out the start of the queries so that at most `rate` start per second, whatever the number of workers.
+Args:
+    rate (float): The maximum number of queries started per second. 0 disables the limit.
+"""
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    """
+    Waits for the next free start slot.
+    Returns:
+        float: The seconds waited.
+    """
+    def acquire(self):
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return start - now
+
+"""
+Reads the questions of a JSONL file.
+Args:
+    path (str): The JSONL file.
+Returns:
+    list of dict: 'id' and 'question' of every line, in order.
+"""
+def read_questions(path):
+    questions = []
+    with open(path, encoding="utf-8") as questions_file:
+        for line_number, line in enumerate(questions_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                questions.append({"id": str(record.get("id", line_number)), "question": record["question"]})
+            except (ValueError, KeyError, AttributeError) as exception:
+                raise ValueError(f"{path}:{line_number}: línea no válida ({exception})") from exception
+    return questions
+
+"""
+Reads the results already written to the output, to resume an interrupted run. A last line cut by the interruption
+is removed from the file, so the next results are appended after a complete line.
+Args:
+    path (str): The output JSONL file.
+Returns:
+    dict: The last result of every id.
+"""
+def load_checkpoint(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "rb") as output_file:
+        content = output_file.read()
+    complete = content[:content.rfind(b"\n") + 1]
+    if len(complete) < len(content):
+        with open(path, "r+b") as output_file:
+            output_file.truncate(len(complete))
+    results = {}
+    for line in complete.decode("utf-8").splitlines():
+        if line.strip():
+            result = json.loads(line)
+            results[result["id"]] = result
+    return results
+
+def describe_source(tool_output):
+    # Con un solo parámetro, llama_index pasa la consulta como argumento posicional; si la herramienta falla,
+    # raw_input son directamente los argumentos del LLM
+    raw_input = tool_output.raw_input
+    query = raw_input.get("kwargs", {}).get("query") or next(iter(raw_input.get("args") or ()), None) \
+        or raw_input.get("query")
+    return {"tool": tool_output.tool_name, "query": query, "content": tool_output.content,
+            "is_error": tool_output.is_error}
+
+"""
+Answers one question with a new agent.
+Args:
+    question (dict): 'id' and 'question'.
+    system_prompt (str): The system prompt of the agent.
+    rate_limiter (RateLimiter): The limiter shared by the workers.
+Returns:
+    dict: The result (see the module docstring).
+"""
+def answer_question(question, system_prompt, rate_limiter):
+    timings = {"rate_limit_wait": rate_limiter.acquire()}
+    result = {"id": question["id"], "question": question["question"], "answer": None, "sources": [],
+              "timings": timings, "error": None}
+    start = time.perf_counter()
+    try:
+        # La memoización de embeddings de consultas es por hilo: cada pregunta empieza sin ellas
+        reset_query_embeddings_memo()
+        agent = nuevo_agente(system_prompt, session_id=BATCH_SESSION_ID)
+        metrics, sources = {}, []
+        result["answer"] = "".join(stream_agent_response(agent, question["question"], metrics, sources=sources))
+        result["sources"] = [describe_source(source) for source in sources]
+        timings.update(metrics)
+    except Exception as exception:
+        logging.warning("Falló la pregunta %s", question["id"], exc_info=True)
+        result["error"] = f"{type(exception).__name__}: {exception}"
+        timings["total_latency"] = time.perf_counter() - start
+    return result
+
+"""
+Loads or builds the corpus of the batch session.
+Args:
+    args (argparse.Namespace): The command line arguments (index, pdf and save_index).
+Returns:
+    int: The number of documents of the session.
+"""
+def prepare_corpus(args):
+    registry = get_index_registry()
+    if args.index:
+        # La matriz se abre con mmap, sin volver a calcular embeddings
+        registry.set_documents(BATCH_SESSION_ID, load_index(args.index))
+    if args.pdf:
+        sources = []
+        for path in args.pdf:
+            with open(path, "rb") as pdf_file:
+                sources.append((os.path.basename(path), pdf_file.read()))
+        summary = registry.add_documents(BATCH_SESSION_ID, sources,
+                                         on_file=lambda file_name: log(f"Procesando {file_name}..."))
+        log(f"Documentos añadidos: {len(summary['added']) + len(summary['replaced'])}, sin cambios: "
+            f"{len(summary['unchanged'])}, bloques embebidos: {summary['embedded_chunks']}.")
+    if args.save_index:
+        registry.save_session(BATCH_SESSION_ID, args.save_index)
+    return len(registry.list_documents(BATCH_SESSION_ID))
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+def write_result(output_file, result):
+    output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+    output_file.flush()
+    os.fsync(output_file.fileno())
+
+def record_result(output_file, result, stats, total):
+    write_result(output_file, result)
+    if result["error"] is None:
+        stats["answered"] += 1
+        stats["latencies"].append(result["timings"]["total_latency"])
+    else:
+        stats["failed"] += 1
+    done = stats["answered"] + stats["failed"]
+    if done % 10 == 0 or done == total:
+        log(f"{done}/{total} preguntas ({stats['failed']} con error).")
+
+"""
+Runs the batch: answers the pending questions and appends their results to the output.
+Args:
+    args (argparse.Namespace): The command line arguments.
+Returns:
+    dict: 'answered', 'failed', 'skipped' and 'interrupted', and the 'latencies' of the answered questions.
+"""
+def run(args):
+    questions = read_questions(args.questions)
+    previous = load_checkpoint(args.output)
+    pending = [question for question in questions
+               if question["id"] not in previous or previous[question["id"]]["error"] is not None]
+    stats = {"answered": 0, "failed": 0, "skipped": len(questions) - len(pending), "interrupted": False,
+             "latencies": []}
+    if stats["skipped"]:
+        log(f"Reanudando: {stats['skipped']} preguntas ya respondidas en {args.output}.")
+
+    rate_limiter = RateLimiter(args.rate)
+    pending_iter = iter(pending)
+    with open(args.output, "a", encoding="utf-8") as output_file, \
+            ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="batch") as executor:
+        in_flight = set()
+        try:
+            while True:
+                # Solo unas pocas preguntas en cola por hilo: el resto se envía a medida que terminan
+                while len(in_flight) < args.workers * QUEUED_PER_WORKER:
+                    question = next(pending_iter, None)
+                    if question is None:
+                        break
+                    in_flight.add(executor.submit(answer_question, question, args.system_prompt, rate_limiter))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record_result(output_file, future.result(), stats, len(pending))
+        except KeyboardInterrupt:
+            # Las preguntas que no han empezado se quedan para la próxima ejecución; las que están en curso se esperan
+            stats["interrupted"] = True
+            log("Interrumpido: esperando a las preguntas en curso...")
+            for future in in_flight:
+                future.cancel()
+            for future in in_flight:
+                if not future.cancelled():
+                    record_result(output_file, future.result(), stats, len(pending))
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Responde un lote de preguntas con el agente, sin la interfaz.")
+    parser.add_argument("--questions", required=True, help="Fichero JSONL de preguntas ({\"id\": ..., \"question\": ...}).")
+    parser.add_argument("--output", required=True, help="Fichero JSONL de resultados; si existe, se reanuda.")
+    parser.add_argument("--index", default=None, help="Directorio de un índice guardado.")
+    parser.add_argument("--pdf", nargs="+", default=None, help="Archivos PDF con los que construir el índice.")
+    parser.add_argument("--save-index", default=None, help="Directorio donde guardar el índice construido.")
+    parser.add_argument("--system-prompt", default=DEFAULT_SYSTEM_PROMPT, help="Prompt inicial del agente.")
+    parser.add_argument("--workers", type=int, default=4, help="Preguntas respondidas a la vez.")
+    parser.add_argument("--rate", type=float, default=2.0, help="Preguntas iniciadas por segundo como máximo (0: sin límite).")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers debe ser al menos 1")
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    documents = prepare_corpus(args)
+    if not documents:
+        log("Aviso: no hay documentos indexados; las respuestas saldrán de Bing.")
+
+    start = time.perf_counter()
+    # El agente escribe sus trazas por consola; la salida estándar no aporta nada en un lote
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        stats = run(args)
+    elapsed = time.perf_counter() - start
+
+    summary = f"{stats['answered']} respondidas, {stats['failed']} con error, {stats['skipped']} ya respondidas"
+    if stats["latencies"]:
+        latencies = np.asarray(stats["latencies"])
+        summary += (f"; latencia p50={np.percentile(latencies, 50):.2f} s, p95={np.percentile(latencies, 95):.2f} s, "
+                    f"{len(latencies) / elapsed:.2f} preguntas/s")
+    log(summary + ".")
+    if stats["interrupted"]:
+        sys.exit(130)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Offline end-to-end benchmark of the whole pipeline: PDF extraction, tokenization, chunking, embedding, index
+build, search and the agent turn. Azure OpenAI (embeddings and chat) and Bing are replaced by the deterministic
+local stand-ins of tools.fake_endpoints, each with its own injected latency, so no keys or network are needed.
+The fake embeddings are hashes of the texts, so a query equal to a chunk is a hit and any other query falls back to
+Bing; --bing-ratio controls the share of queries of each kind.
+
+The results (throughput and latency of every stage, plus the configuration and the git commit) are written as JSON,
+so two versions can be compared with --baseline.
+
+Usage:
+    python -m benchmarks.bench_end_to_end --files 4 --pages 50 --queries 50 --embedding-latency 0.05 --output e2e.json
+    python -m benchmarks.bench_end_to_end --tokenizer words --output new.json --baseline e2e.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+
+import numpy as np
+from llama_index.llms.azure_openai import AzureOpenAI
+
+from benchmarks.bench_pdf_extraction import WORDS, generate_pdf
+from config.env_loader import chunk_tokenizer_model
+from tools import search_embedding
+from tools.bing_search import BingSearchClient, set_bing_client
+from tools.chunker import iter_token_chunks
+from tools.embedding_service import EmbeddingService, set_embedding_service
+from tools.explore_pdf import iter_pdf_pages
+from tools.resources import get_tokenizer
+from tools.fake_endpoints import WordTokenizer, start_fake_server
+from tools.ingestion import chunk_hash, chunks_to_entries, file_hash
+from tools.nuevo_agente import nuevo_agente, stream_agent_response
+
+def latency_summary(latencies):
+    milliseconds = np.asarray(latencies) * 1000
+    return {"count": len(milliseconds), "mean_ms": float(milliseconds.mean()),
+            "p50_ms": float(np.percentile(milliseconds, 50)), "p95_ms": float(np.percentile(milliseconds, 95)),
+            "p99_ms": float(np.percentile(milliseconds, 99)), "max_ms": float(milliseconds.max())}
+
+def throughput(items, seconds, unit):
+    return {"seconds": seconds, unit: items, f"{unit}_per_second": items / seconds if seconds else None}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    stages = {}
+    tokenizer = WordTokenizer() if args.tokenizer == "words" else get_tokenizer(chunk_tokenizer_model)
+
+    # Un servidor por servicio para poder inyectar una latencia distinta en cada uno
+    embeddings_server, embeddings_url = start_fake_server(latency=args.embedding_latency, dimensions=args.dim)
+    chat_server, chat_url = start_fake_server(latency=args.chat_latency, token_latency=args.token_latency)
+    bing_server, bing_url = start_fake_server(latency=args.bing_latency)
+    try:
+        embedding_service = EmbeddingService(azure_endpoint=embeddings_url, api_key="fake",
+                                             deployment_name="fake-embeddings", max_in_flight=args.in_flight,
+                                             token_counter=lambda text: len(tokenizer.encode(text)))
+        set_embedding_service(embedding_service)
+        set_bing_client(BingSearchClient("fake", endpoint=f"{bing_url}/v7.0/search"))
+
+        sources = [(f"generado_{i}.pdf", generate_pdf(args.pages, args.words, seed=i)) for i in range(args.files)]
+
+        start = time.perf_counter()
+        pages = list(iter_pdf_pages(sources, max_workers=args.workers))
+        stages["extract"] = throughput(len(pages), time.perf_counter() - start, "pages")
+
+        start = time.perf_counter()
+        token_count = sum(len(tokenizer.encode(page["text"])) for page in pages)
+        stages["tokenize"] = throughput(token_count, time.perf_counter() - start, "tokens")
+
+        start = time.perf_counter()
+        hashes = {file_name: file_hash(pdf_bytes) for file_name, pdf_bytes in sources}
+        chunks = list(iter_token_chunks(pages, tokenizer=tokenizer, max_tokens=args.chunk_tokens,
+                                        overlap_tokens=args.overlap_tokens))
+        for chunk in chunks:
+            chunk["file_hash"] = hashes[chunk["file_name"]]
+            chunk["chunk_hash"] = chunk_hash(chunk["text"])
+        stages["chunk"] = throughput(len(chunks), time.perf_counter() - start, "chunks")
+
+        start = time.perf_counter()
+        embeddings = embedding_service.embed_batch([chunk["text"] for chunk in chunks],
+                                                   [chunk["token_size"] for chunk in chunks])
+        stages["embed"] = throughput(len(chunks), time.perf_counter() - start, "chunks")
+        stages["embed"]["tokens"] = sum(chunk["token_size"] for chunk in chunks)
+
+        start = time.perf_counter()
+        search_embedding.update_comparision_data(chunks_to_entries(chunks, embeddings))
+        index = search_embedding.get_comparision_data()
+        stages["index_build"] = throughput(len(index), time.perf_counter() - start, "rows")
+        stages["index_build"]["backend"] = type(index).__name__
+
+        # Consultas: textos de bloques (aciertos en el índice) y frases fuera del corpus (recurren a Bing)
+        rng = random.Random(0)
+        queries = [
+            " ".join(rng.choice(WORDS) for _ in range(8)) if rng.random() < args.bing_ratio else rng.choice(chunks)["text"]
+            for _ in range(args.queries)
+        ]
+        query_embeddings = embedding_service.embed_batch(queries)
+
+        latencies = []
+        for query_embedding in query_embeddings:
+            start = time.perf_counter()
+            index.search(query_embedding, args.k)
+            latencies.append(time.perf_counter() - start)
+        stages["search"] = latency_summary(latencies)
+
+        agent = nuevo_agente("Eres un asistente que responde con la información encontrada.",
+                             llm=AzureOpenAI(engine="fake-chat", model="gpt-4o", azure_endpoint=chat_url,
+                                             api_key="fake", api_version="2024-05-01-preview"),
+                             token_counter=lambda text: len(tokenizer.encode(text)))
+        first_token_latencies, turn_latencies = [], []
+        for query in queries:
+            search_embedding.reset_query_embeddings_memo()
+            metrics = {}
+            # El agente y la herramienta escriben trazas por consola; no deben mezclarse con la salida JSON
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in stream_agent_response(agent, query, metrics):
+                    pass
+            agent.reset()
+            first_token_latencies.append(metrics["time_to_first_token"])
+            turn_latencies.append(metrics["total_latency"])
+        stages["agent_turn"] = latency_summary(turn_latencies)
+        stages["agent_turn"]["bing_requests"] = bing_server.request_count
+        stages["agent_time_to_first_token"] = latency_summary(first_token_latencies)
+    finally:
+        for server in (embeddings_server, chat_server, bing_server):
+            server.shutdown()
+
+    return {
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "stages": stages,
+    }
+
+"""
+Prints the change of every stage against a previous run: throughput ratio (higher is better) for the batch
+stages and p50/p95 latency ratio (lower is better) for the per-query ones.
+"""
+def print_comparison(result, baseline):
+    print(f"Comparación con {baseline.get('git_commit') or 'la referencia'}:")
+    for name, stage in result["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if old is None:
+            continue
+        if "p50_ms" in stage:
+            print(f"{name:>26}: p50 x{stage['p50_ms'] / old['p50_ms']:.2f}  p95 x{stage['p95_ms'] / old['p95_ms']:.2f}")
+        else:
+            key = next(key for key in stage if key.endswith("_per_second"))
+            if stage[key] and old.get(key):
+                print(f"{name:>26}: {key} x{stage[key] / old[key]:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo con servicios simulados.")
+    parser.add_argument("--files", type=int, default=2, help="Número de PDF generados.")
+    parser.add_argument("--pages", type=int, default=50, help="Páginas por PDF.")
+    parser.add_argument("--words", type=int, default=400, help="Palabras por página.")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos de extracción (por defecto, automático).")
+    parser.add_argument("--tokenizer", choices=["tiktoken", "words"], default="tiktoken",
+                        help="tiktoken (CHUNK_TOKENIZER_MODEL) o words (sin descargas, por palabras).")
+    parser.add_argument("--chunk-tokens", type=int, default=None, help="Tokens por bloque (por defecto, CHUNK_MAX_TOKENS).")
+    parser.add_argument("--overlap-tokens", type=int, default=None, help="Tokens de solapamiento.")
+    parser.add_argument("--dim", type=int, default=256, help="Dimensión de los embeddings simulados.")
+    parser.add_argument("--in-flight", type=int, default=4, help="Peticiones de embeddings concurrentes.")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Latencia por petición de embeddings (s).")
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="Latencia por petición al LLM (s).")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Latencia entre tokens del LLM (s).")
+    parser.add_argument("--bing-latency", type=float, default=0.0, help="Latencia por búsqueda en Bing (s).")
+    parser.add_argument("--queries", type=int, default=20, help="Número de consultas (búsqueda y turnos del agente).")
+    parser.add_argument("--bing-ratio", type=float, default=0.3, help="Fracción de consultas que recurren a Bing.")
+    parser.add_argument("--k", type=int, default=1, help="Resultados por búsqueda.")
+    parser.add_argument("--output", default=None, help="Fichero JSON de resultados (por defecto, salida estándar).")
+    parser.add_argument("--baseline", default=None, help="JSON de una ejecución anterior con el que comparar.")
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(result, output_file, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            print_comparison(result, json.load(baseline_file))
+
+if __name__ == "__main__":
+    main()
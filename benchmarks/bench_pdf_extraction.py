@@ -0,0 +1,74 @@
+"""
+Throughput benchmark of the PDF extraction pipeline (tools.explore_pdf.iter_pdf_pages) on generated PDFs.
+It compares the in-process extraction with the process pool and reports pages per second.
+
+Usage:
+    python -m benchmarks.bench_pdf_extraction --files 4 --pages 200 --workers 4
+"""
+import argparse
+import os
+import random
+import time
+
+import fitz  # PyMuPDF
+
+from tools.explore_pdf import iter_pdf_pages
+
+WORDS = (
+    "agente embeddings documento manual búsqueda similitud página índice consulta respuesta modelo texto "
+    "configuración sistema usuario archivo proceso resultado información sección capítulo tabla figura"
+).split()
+
+"""
+Generates a PDF in memory with random text.
+Args:
+    pages (int): The number of pages.
+    words_per_page (int): The number of words written on each page. Defaults to 400.
+    seed (int): The seed of the random generator. Defaults to 0.
+Returns:
+    bytes: The content of the PDF.
+"""
+def generate_pdf(pages, words_per_page=400, seed=0):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        words = [rng.choice(WORDS) for _ in range(words_per_page)]
+        lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+        page.insert_textbox(fitz.Rect(40, 40, 560, 800), f"Página {page_number + 1}\n" + "\n".join(lines), fontsize=8)
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+def measure(sources, **kwargs):
+    start = time.perf_counter()
+    first_page_seconds = None
+    pages = 0
+    for _ in iter_pdf_pages(sources, **kwargs):
+        if first_page_seconds is None:
+            first_page_seconds = time.perf_counter() - start
+        pages += 1
+    seconds = time.perf_counter() - start
+    return {"pages": pages, "seconds": seconds, "pages_per_second": pages / seconds,
+            "first_page_seconds": first_page_seconds}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extracción de PDF (páginas por segundo).")
+    parser.add_argument("--files", type=int, default=4, help="Número de PDF generados.")
+    parser.add_argument("--pages", type=int, default=100, help="Páginas por PDF.")
+    parser.add_argument("--words", type=int, default=400, help="Palabras por página.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos del pool.")
+    args = parser.parse_args()
+
+    sources = [(f"generado_{i}.pdf", generate_pdf(args.pages, args.words, seed=i)) for i in range(args.files)]
+
+    results = {
+        "secuencial": measure(sources, max_workers=1),
+        f"pool ({args.workers} procesos)": measure(sources, max_workers=args.workers, min_pages_for_pool=0),
+    }
+    for name, result in results.items():
+        print(f"{name:>24}: {result['pages']} páginas en {result['seconds']:.2f} s "
+              f"({result['pages_per_second']:.1f} páginas/s, primera página en {result['first_page_seconds']:.3f} s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Memory and recall report of the quantized index (tools.quantized_index.QuantizedIndex) against the exact float32
+VectorIndex, on synthetic clustered embeddings. Every index is saved and loaded back as the app does, so the
+originals are memory-mapped and the reported memory is what stays resident: the codes for the quantized indexes.
+A quantized index built in memory with originals_dir (as build_vector_index does) is reported too.
+For each quantization type it reports recall@k without rescoring (codes only) and with each rescore factor.
+
+Usage:
+    python -m benchmarks.bench_quantization --rows 200000 --dim 1536 --queries 200 --k 5 --rescore-factor 2 4 8
+"""
+import argparse
+import tempfile
+
+import numpy as np
+
+from benchmarks.bench_ann import generate_embeddings, measure_latencies
+from tools.ivf_index import load_index
+from tools.quantized_index import QuantizedIndex
+from tools.vector_index import VectorIndex
+
+def recall(expected, results, k):
+    return float(np.mean([len(expected[i] & {text for text, _ in result}) / k for i, result in enumerate(results)]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria y recall del índice cuantizado frente al exacto.")
+    parser.add_argument("--rows", type=int, default=100000, help="Número de embeddings del corpus.")
+    parser.add_argument("--dim", type=int, default=1536, help="Dimensión de los embeddings.")
+    parser.add_argument("--queries", type=int, default=200, help="Número de consultas.")
+    parser.add_argument("--k", type=int, default=5, help="Resultados por consulta (recall@k).")
+    parser.add_argument("--rescore-factor", type=int, nargs="+", default=[2, 4, 8],
+                        help="Candidatos puntuados de nuevo con los originales, en múltiplos de k.")
+    args = parser.parse_args()
+
+    matrix = generate_embeddings(args.rows, args.dim)
+    texts = [str(i) for i in range(args.rows)]
+    queries = generate_embeddings(args.queries, args.dim, seed=1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        exact = VectorIndex(matrix, texts, normalized=True)
+        exact_results, p50, p99 = measure_latencies(lambda query: exact.search(query, args.k), queries)
+        expected = [{text for text, _ in result} for result in exact_results]
+        print(f"{'float32 (memoria)':>26}: {exact.memory_usage() / 2**20:8.1f} MB  recall@{args.k}=1.000  "
+              f"p50={p50:.2f} ms  p99={p99:.2f} ms")
+
+        for dtype in ("float16", "int8"):
+            QuantizedIndex.from_index(exact, dtype=dtype).save(f"{directory}/{dtype}")
+            index = load_index(f"{directory}/{dtype}")
+            built = QuantizedIndex.from_index(exact, dtype=dtype, originals_dir=f"{directory}/originals")
+            print(f"{dtype + ' (construido)':>26}: {built.memory_usage() / 2**20:8.1f} MB")
+            del built
+            for rescore_factor in [0] + args.rescore_factor:
+                index.rescore_factor = rescore_factor
+                results, p50, p99 = measure_latencies(lambda query: index.search(query, args.k), queries)
+                name = f"{dtype} (sin reordenar)" if rescore_factor == 0 else f"{dtype} (x{rescore_factor})"
+                print(f"{name:>26}: {index.memory_usage() / 2**20:8.1f} MB  recall@{args.k}={recall(expected, results, args.k):.3f}  "
+                      f"p50={p50:.2f} ms  p99={p99:.2f} ms")
+
+if __name__ == "__main__":
+    main()
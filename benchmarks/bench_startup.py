@@ -0,0 +1,78 @@
+"""
+Startup report of the Streamlit app: the import time of each heavy dependency, the first run of main.py in a new
+process (cold start) and the next runs (the reruns Streamlit does on every interaction). Every sample runs in its
+own Python process, with streamlit.testing's AppTest driving main.py headless, so the imports are really cold.
+--eager imports the agent and the PDF/OpenAI dependencies before the first run, as main.py did before they were
+loaded lazily, to compare both startups.
+
+Usage:
+    python -m benchmarks.bench_startup --samples 5 --reruns 10
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+# Dependencias pesadas cuyo tiempo de importación se mide por separado
+HEAVY_MODULES = ["numpy", "fitz", "tiktoken", "httpx", "openai", "streamlit", "llama_index.core",
+                 "llama_index.llms.azure_openai"]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+print(json.dumps({"seconds": time.perf_counter() - start}))
+"""
+
+APP_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+eager, reruns = sys.argv[1] == "1", int(sys.argv[2])
+start = time.perf_counter()
+if eager:
+    import fitz, openai, tiktoken, tools.nuevo_agente
+app = AppTest.from_file("main.py", default_timeout=120)
+app.run()
+cold = time.perf_counter() - start
+loaded = [name for name in %r if name in sys.modules]
+rerun_times = []
+for _ in range(reruns):
+    start = time.perf_counter()
+    app.run()
+    rerun_times.append(time.perf_counter() - start)
+print(json.dumps({"cold": cold, "reruns": rerun_times, "loaded": loaded, "exception": bool(app.exception)}))
+""" % HEAVY_MODULES
+
+def run_python(script, *args):
+    output = subprocess.run([sys.executable, "-c", script, *map(str, args)], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def summary(values):
+    return f"p50={np.percentile(values, 50) * 1000:8.1f} ms  p95={np.percentile(values, 95) * 1000:8.1f} ms"
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempos de arranque en frío y de re-ejecución de la app.")
+    parser.add_argument("--samples", type=int, default=3, help="Procesos nuevos por medición.")
+    parser.add_argument("--reruns", type=int, default=5, help="Re-ejecuciones de main.py por proceso.")
+    parser.add_argument("--eager", action="store_true", help="Compara también con la importación anticipada.")
+    args = parser.parse_args()
+
+    print("Importación de dependencias (proceso nuevo):")
+    for module in HEAVY_MODULES:
+        times = [run_python(IMPORT_SCRIPT, module)["seconds"] for _ in range(args.samples)]
+        print(f"{module:>30}: {summary(times)}")
+
+    for eager in ([False, True] if args.eager else [False]):
+        runs = [run_python(APP_SCRIPT, int(eager), args.reruns) for _ in range(args.samples)]
+        name = "importación anticipada" if eager else "importación diferida"
+        print(f"\nmain.py ({name}):")
+        print(f"{'arranque en frío':>30}: {summary([run['cold'] for run in runs])}")
+        print(f"{'re-ejecución':>30}: {summary([value for run in runs for value in run['reruns']])}")
+        print(f"{'cargadas tras la 1ª ejecución':>30}: {', '.join(runs[0]['loaded'])}")
+        if any(run["exception"] for run in runs):
+            print("Aviso: main.py terminó con una excepción en alguna ejecución.")
+
+if __name__ == "__main__":
+    main()
@@ -9,4 +9,79 @@ azure_openai_api_key = os.getenv("AZURE_OPENAI_API_KEY")
 azure_openai_endpoint_embeding = os.getenv("AZURE_OPENAI_ENDPOINT_EMBEDINGS")
 bing_search_api_key = os.getenv("BING_SEARCH_API_KEY")
 azure_openai_embeding_api_key = os.getenv("AZURE_OPENAI_EMBEDINGS_API_KEY")
-azure_openai_embeding_deployment_name = os.getenv("AZURE_OPENAI_EMBEDINGS_DEPLOYMENT_NAME")
\ No newline at end of file
+azure_openai_embeding_deployment_name = os.getenv("AZURE_OPENAI_EMBEDINGS_DEPLOYMENT_NAME")
+
+# Caché persistente de embeddings (compartida por todos los procesos de Streamlit)
+embeddings_cache_path = os.getenv("EMBEDDINGS_CACHE_PATH", ".cache/embeddings.sqlite")
+embeddings_cache_max_entries = int(os.getenv("EMBEDDINGS_CACHE_MAX_ENTRIES", "200000"))
+
+# Directorio donde se guardan los índices de documentos (uno por subdirectorio)
+indexes_dir = os.getenv("INDEXES_DIR", "indexes")
+
+# Troceado de los documentos: modelo cuyo tokenizador se usa, tamaño máximo de cada bloque y solapamiento (en tokens)
+chunk_tokenizer_model = os.getenv("CHUNK_TOKENIZER_MODEL", "gpt-3.5-turbo")
+chunk_max_tokens = int(os.getenv("CHUNK_MAX_TOKENS", "1000"))
+chunk_overlap_tokens = int(os.getenv("CHUNK_OVERLAP_TOKENS", "200"))
+
+# Búsqueda vectorial: "exact", "ivf" (aproximada) o "auto" (ivf a partir de ANN_MIN_ROWS bloques). IVF_N_PROBE 0
+# explora el 10 % de las listas (al menos 8)
+vector_index_backend = os.getenv("VECTOR_INDEX_BACKEND", "exact")
+ann_min_rows = int(os.getenv("ANN_MIN_ROWS", "50000"))
+ivf_n_lists = int(os.getenv("IVF_N_LISTS", "0"))  # 0: raíz cuadrada del número de bloques
+ivf_n_probe = int(os.getenv("IVF_N_PROBE", "0"))
+
+# Búsqueda en Bing: endpoint, tiempos máximos de conexión y respuesta (segundos), caché de resultados y número de resultados
+bing_search_endpoint = os.getenv("BING_SEARCH_ENDPOINT", "https://api.bing.microsoft.com/v7.0/search")
+bing_connect_timeout = float(os.getenv("BING_CONNECT_TIMEOUT", "3"))
+bing_read_timeout = float(os.getenv("BING_READ_TIMEOUT", "10"))
+bing_cache_ttl = float(os.getenv("BING_CACHE_TTL", "3600"))
+bing_cache_max_entries = int(os.getenv("BING_CACHE_MAX_ENTRIES", "1000"))
+bing_result_count = int(os.getenv("BING_RESULT_COUNT", "1"))
+
+# Métricas: duraciones recientes usadas para los percentiles, fichero Prometheus (vacío: no se escribe) y puerto
+# del endpoint /metrics (0: desactivado)
+metrics_window = int(os.getenv("METRICS_WINDOW", "1000"))
+metrics_prometheus_file = os.getenv("METRICS_PROMETHEUS_FILE", "")
+metrics_port = int(os.getenv("METRICS_PORT", "0"))
+
+# Registro de índices por sesión: memoria máxima de los documentos cargados (MB), directorio donde se vuelcan los
+# documentos de las sesiones inactivas cuando se supera y segundos sin uso tras los que se olvida una sesión (0: nunca)
+index_memory_budget_mb = int(os.getenv("INDEX_MEMORY_BUDGET_MB", "2048"))
+index_spill_dir = os.getenv("INDEX_SPILL_DIR", ".cache/documents")
+index_session_ttl = int(os.getenv("INDEX_SESSION_TTL", "43200"))
+
+# Almacenamiento compacto de los embeddings: "none", "float16" o "int8" (con escala por vector). Las consultas se
+# puntúan con los códigos y los QUANTIZED_RESCORE_FACTOR * k mejores candidatos se puntúan de nuevo con los originales
+vector_index_quantization = os.getenv("VECTOR_INDEX_QUANTIZATION", "none")
+quantized_rescore_factor = int(os.getenv("QUANTIZED_RESCORE_FACTOR", "4"))
+
+# Búsqueda léxica (BM25) junto a los embeddings: RETRIEVAL_MODE "vector" o "hybrid" (fusión de ambos rankings) y
+# atajo léxico (desactivado por defecto) para consultas cortas de palabras clave, que se responden con el bloque de la
+# coincidencia léxica sin calcular el embedding de la consulta. Su umbral de relevancia es la puntuación BM25 mínima,
+# que depende del corpus y debe ajustarse
+retrieval_mode = os.getenv("RETRIEVAL_MODE", "vector")
+lexical_fast_path = os.getenv("LEXICAL_FAST_PATH", "false").lower() in ("1", "true", "yes")
+lexical_fast_path_max_terms = int(os.getenv("LEXICAL_FAST_PATH_MAX_TERMS", "6"))
+lexical_fast_path_min_margin = float(os.getenv("LEXICAL_FAST_PATH_MIN_MARGIN", "1.5"))
+lexical_fast_path_min_score = float(os.getenv("LEXICAL_FAST_PATH_MIN_SCORE", "3.0"))
+bm25_k1 = float(os.getenv("BM25_K1", "1.2"))
+bm25_b = float(os.getenv("BM25_B", "0.75"))
+
+# Ingesta en segundo plano: trabajos de ingesta procesados a la vez y trabajos terminados que se recuerdan
+ingestion_workers = int(os.getenv("INGESTION_WORKERS", "2"))
+ingestion_job_history = int(os.getenv("INGESTION_JOB_HISTORY", "100"))
+
+# Caché semántica de respuestas del agente: similitud mínima entre preguntas, segundos de validez y número máximo
+# de respuestas (0 la desactiva)
+answer_cache_threshold = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+answer_cache_ttl = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+answer_cache_max_entries = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+# Memoria de la conversación del agente: tokens máximos del historial enviado al LLM (los turnos antiguos se
+# resumen), tokens máximos del resumen y modelo cuyo tokenizador se usa para contarlos. Cada búsqueda devuelve
+# bloques de hasta CHUNK_MAX_TOKENS tokens, así que el presupuesto por defecto es proporcional: con 6 bloques caben
+# varios turnos recientes con sus salidas de herramientas. Un presupuesto mayor resume menos a menudo pero envía más
+# tokens en cada turno (coste y latencia); uno menor obliga a resumir casi en cada turno
+memory_token_budget = int(os.getenv("MEMORY_TOKEN_BUDGET", str(6 * chunk_max_tokens)))
+memory_summary_max_tokens = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "500"))
+memory_tokenizer_model = os.getenv("MEMORY_TOKENIZER_MODEL", "gpt-4o")
@@ -3,50 +3,149 @@ This script is a Streamlit application for configuring and interacting with an A
 Modules:
     logging: For logging messages.
     streamlit as st: For creating the Streamlit web application.
-    tempfile: For creating temporary files.
     json: For handling JSON data.
-    numpy as np: For numerical operations.
-    tiktoken: For tokenizing text.
-    tools.explore_pdf: Custom module for handling PDF files.
-    tools.search_embedding: Custom module for creating contextual texts and calculating embeddings.
-    tools.nuevo_agente: Custom module for creating a new agent.
+    tools.ingestion_jobs: Custom module that extracts, chunks and embeds PDF files in background jobs.
+    tools.index_registry: Custom module that keeps the documents of every session, shared by content hash.
+    tools.nuevo_agente: Custom module for creating a new agent (imported lazily: llama_index is slow to import).
+    tools.resources: Process-wide heavy resources (tokenizers, LLM, agent factory) and the startup timings.
+    tools.answer_cache: Semantic cache of the agent answers, shared by every session.
 Constants:
     TEXT_INPUT_BANNER: A constant string for the user input prompt in the chat.
 Functions:
-    open_and_read_pdf: Opens and reads the content of a PDF file.
-    get_pages_and_texts: Extracts pages and texts from a PDF file.
-    concatenate_documents: Concatenates documents based on token size.
-    create_contextual_texts_per_pdf: Creates contextual texts with overlap for each PDF.
-    update_comparision_data: Updates comparison data with embeddings.
-    calculate_embeddings: Calculates embeddings for a given text.
+    get_ingestion_queue: Returns the background queue that ingests the uploaded PDFs (submit, status, cancel).
+    get_index_registry: Returns the registry that holds the corpus of each session (isolated between users).
     nuevo_agente: Creates a new agent with a given prompt.
+    stream_agent_response: Streams the answer of the agent and records its latency.
+    telemetry: Shared latency histograms and counters, shown in the sidebar and exported for Prometheus.
 Streamlit App:
     The app has two main screens:
     1. Initial Configuration Screen:
-        - Allows users to upload PDF files and define the initial prompt for the agent.
-        - Processes the uploaded PDF files to extract and tokenize text.
-        - Calculates embeddings for the text blocks.
-        - Saves the embeddings data in session state.
+        - Allows users to upload PDF files (or pick an index saved on disk) and define the initial prompt for the agent.
+        - Queues the uploaded PDF files for ingestion in the background (extraction, token-bounded chunking and
+          embeddings); each document is added to the session as soon as it is embedded and, optionally, the
+          index is saved on disk when the job finishes.
         - Instantiates the agent with the selected prompt.
     2. Main Interaction Screen:
         - Allows users to interact with the agent through a chat interface.
-        - Displays user messages and agent responses in the chat.
+        - Displays user messages and streams the agent responses in the chat, with the progress of the tool calls.
+        - A question similar enough to one already answered with the same prompt, documents and conversation is
+          answered from the answer cache without calling the agent.
+        - The sidebar shows the progress of the ingestion jobs (per file and stage, with cancellation), allows
+          adding or removing documents without rebuilding the index, and shows the latency metrics.
+        - The chat is available as soon as the first document is indexed.
 """
+import time
+
+# Inicio de esta ejecución del script (Streamlit lo vuelve a ejecutar en cada interacción)
+app_run_start = time.perf_counter()
+
 import logging
+import os
+import uuid
 import streamlit as st
-import tempfile
 import json
-import numpy as np
-import tiktoken
 
 # Importar funciones necesarias (asegúrate de que estos módulos estén en tu proyecto)
-from tools.explore_pdf import open_and_read_pdf, get_pages_and_texts, concatenate_documents
-from tools.search_embedding import create_contextual_texts_per_pdf, update_comparision_data, calculate_embeddings
-from tools.nuevo_agente import nuevo_agente
+from tools.ingestion_jobs import get_ingestion_queue, FILE_STAGES
+from tools.index_registry import get_index_registry
+from tools.search_embedding import calculate_query_embeddings, reset_query_embeddings_memo
+from tools.answer_cache import answer_namespace, get_answer_cache
+from tools.embedding_service import get_embedding_service
+from tools.resources import lazy_import, record_app_run, warm_up
+from tools.vector_index import list_saved_indexes
+from tools.ivf_index import load_index
+from tools.telemetry import increment, observe, telemetry, start_metrics_server
+from config.env_loader import indexes_dir, metrics_prometheus_file, metrics_port
+
+# El agente (llama_index) se importa cuando se necesita, no antes de dibujar la primera pantalla
+agents = lazy_import("tools.nuevo_agente")
 
 # Constante para el input de usuario en el chat
 TEXT_INPUT_BANNER = "¿Sobre qué quieres preguntar?"
 
+# Nombre de cada etapa de la ingesta en el panel de progreso
+STAGE_LABELS = {"pending": "en cola", "extract": "extrayendo texto", "chunk": "troceando",
+                "embed": "calculando embeddings", "index": "indexando", "done": "listo"}
+
+# Endpoint /metrics para Prometheus (se arranca una sola vez por proceso)
+if metrics_port:
+    start_metrics_server(metrics_port)
+
+"""
+Shows the latency percentiles of every stage and the hit/fallback counters of the search tool.
+Args:
+    container: The Streamlit container to draw the panel in.
+"""
+def show_metrics_panel(container):
+    snapshot = telemetry.snapshot()
+    container.header("Métricas")
+    if snapshot["stages"]:
+        container.dataframe([
+            {"Etapa": stage, "Llamadas": values["count"],
+             **{f"p{int(quantile * 100)} (ms)": None if value is None else round(value * 1000, 1)
+                for quantile, value in values["quantiles"].items()}}
+            for stage, values in snapshot["stages"].items()
+        ], hide_index=True)
+    registry_stats = get_index_registry().stats()
+    container.caption(f"Índices en memoria: {registry_stats['memory_bytes'] / 2**20:.0f} de "
+                      f"{registry_stats['memory_budget_bytes'] / 2**20:.0f} MB ({registry_stats['loaded_sessions']} de "
+                      f"{registry_stats['sessions']} sesiones, {registry_stats['loaded_documents']} de "
+                      f"{registry_stats['documents']} documentos).")
+    # Las respuestas del atajo léxico también salen de los documentos
+    lexical_hits = snapshot["counters"].get("lexical_hit", 0)
+    hits = snapshot["counters"].get("retrieval_hit", 0) + lexical_hits
+    fallbacks = snapshot["counters"].get("web_fallback", 0)
+    if hits + fallbacks:
+        container.caption(f"Búsquedas resueltas con los documentos: {hits} ({lexical_hits} sin embeddings), "
+                          f"con Bing: {fallbacks} ({100 * hits / (hits + fallbacks):.0f} % en documentos).")
+    cache_hits = snapshot["counters"].get("answer_cache_hit", 0)
+    cache_misses = snapshot["counters"].get("answer_cache_miss", 0)
+    if cache_hits + cache_misses:
+        container.caption(f"Respuestas reutilizadas de la caché: {cache_hits} de {cache_hits + cache_misses} "
+                          f"({100 * cache_hits / (cache_hits + cache_misses):.0f} %, "
+                          f"{len(get_answer_cache())} guardadas).")
+
+"""
+Shows the progress of the ingestion jobs of the session (per file and stage) with a button to cancel each one.
+It is a fragment that refreshes itself every second, so the rest of the page is not redrawn; when a new document
+becomes searchable the whole app is rerun to update the document list and enable the chat.
+"""
+@st.fragment(run_every=1.0)
+def show_ingestion_progress():
+    jobs = get_ingestion_queue().list_jobs(st.session_state.session_id)
+    for job in jobs:
+        if job["state"] in ("queued", "running"):
+            files = job["files"]
+            progress = sum(FILE_STAGES.index(file["stage"]) for file in files) / max(1, len(files) * (len(FILE_STAGES) - 1))
+            st.progress(progress, text=f"Procesando documentos: {job['indexed_files']} de {job['total_files']} "
+                                       f"listos ({job['elapsed']:.0f} s)")
+            for file in files:
+                st.caption(f"{file['file_name']}: {STAGE_LABELS[file['stage']]}")
+            if st.button("Cancelar", key=f"cancel_{job['job_id']}"):
+                get_ingestion_queue().cancel(job["job_id"])
+        elif job["state"] == "failed":
+            st.error(f"Error al procesar los documentos: {job['error']}")
+        elif job["summary"] is not None and job is jobs[-1]:
+            summary = job["summary"]
+            cancelled = " (cancelado)" if job["state"] == "cancelled" else ""
+            st.caption(f"Última carga{cancelled}: {len(summary['added'])} añadidos, {len(summary['replaced'])} "
+                       f"actualizados, {len(summary['unchanged'])} sin cambios ({summary['embedded_chunks']} bloques "
+                       f"embebidos, {summary['reused_chunks']} reutilizados) en {job['elapsed']:.0f} s.")
+            # Mostramos cuánto ha ahorrado la caché persistente de embeddings
+            embeddings_cache = get_embedding_service().cache
+            if embeddings_cache is not None:
+                cache_stats = embeddings_cache.stats()
+                st.caption(f"Caché de embeddings: {cache_stats['hits']} aciertos, {cache_stats['misses']} fallos, "
+                           f"{cache_stats['saved_tokens']} tokens ahorrados.")
+
+    # Cuando cambia el número de documentos buscables se redibuja toda la app (lista de documentos y chat)
+    indexed = len(get_index_registry().list_documents(st.session_state.session_id))
+    finished = sum(job["state"] not in ("queued", "running") for job in jobs)
+    if (indexed, finished) != st.session_state.get("ingestion_seen", (indexed, finished)):
+        st.session_state.ingestion_seen = (indexed, finished)
+        st.rerun()
+    st.session_state.ingestion_seen = (indexed, finished)
+
 # =============================================================================
 # PANTALLA INICIAL DE CONFIGURACIÓN
 # =============================================================================
@@ -55,13 +154,25 @@ TEXT_INPUT_BANNER = "¿Sobre qué quieres preguntar?"
 if "config_done" not in st.session_state:
     st.session_state.config_done = False
 
+# Cada sesión de Streamlit tiene su propio corpus en el registro de índices, aislado del de los demás usuarios
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+index_registry = get_index_registry()
+
 if not st.session_state.config_done:
     st.title("Configuración Inicial del Agente")
     st.write("Sube los archivos PDF y define el prompt inicial del agente.")
     
+    # Se puede reutilizar un índice guardado en disco en lugar de volver a subir y procesar los PDF
+    NO_SAVED_INDEX = "(ninguno, subir PDF)"
+    selected_index = st.selectbox("Usar un índice existente", [NO_SAVED_INDEX] + list_saved_indexes(indexes_dir))
+    
     # Subida de archivos PDF (puede ser múltiple)
     uploaded_files = st.file_uploader("Selecciona archivos PDF", type=["pdf"], accept_multiple_files=True)
     
+    # Nombre con el que se guardará el índice generado a partir de los PDF (vacío para no guardarlo)
+    new_index_name = st.text_input("Nombre para guardar el índice (opcional)", value="")
+    
     # Input para el prompt inicial. Se establece un valor por defecto.
     prompt_inicial = st.text_input(
         "Introduce el prompt inicial",
@@ -77,71 +188,39 @@ if not st.session_state.config_done:
         # -------------------------------
         # Procesamiento de archivos PDF
         # -------------------------------
-        if uploaded_files is not None and len(uploaded_files) > 0:
+        if selected_index != NO_SAVED_INDEX:
+            # Se abre la matriz con mmap, sin copiarla a memoria ni volver a calcular embeddings
+            st.session_state.index_directory = os.path.join(indexes_dir, selected_index)
+            index_registry.set_documents(st.session_state.session_id, load_index(st.session_state.index_directory))
+            st.write(f"Se ha cargado el índice guardado: {selected_index}.")
+        elif uploaded_files is not None and len(uploaded_files) > 0:
             st.write(f"Se han subido {len(uploaded_files)} archivos PDF.")
-            pages_and_texts = []
-            filtered_pages_and_texts = []
-            
-            # Iteramos sobre cada archivo subido
-            for uploaded_file in uploaded_files:
-                st.write(f"Procesando: {uploaded_file.name}")
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                    temp_file.write(uploaded_file.read())
-                    temp_file_path = temp_file.name
-                
-                # Abrimos y leemos el PDF
-                pdf_content = open_and_read_pdf(temp_file_path)
-                pages_and_texts.append(pdf_content)
-                filtered_pages_and_texts.append(get_pages_and_texts(pdf_content))
             
-            # Creamos textos contextuales con solapamiento (overlap) para cada PDF
-            overlap_ratio = 0.2
-            overlapped_texts_per_pdf = create_contextual_texts_per_pdf(filtered_pages_and_texts, overlap_ratio=overlap_ratio)
+            # La extracción, el troceado y los embeddings se hacen en segundo plano: cada documento se puede
+            # consultar en cuanto está embebido (los que ya tenga otra sesión comparten su matriz)
+            pdf_sources = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
             
-            # Calculamos la cantidad de tokens de cada bloque y concatenamos documentos si es necesario
-            tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
-            input_texts_and_tokens = [
-                {
-                    'file_name': text['file_name'],
-                    'text': texto,
-                    'token_size': len(tokenizer.encode(texto))
-                } 
-                for text in overlapped_texts_per_pdf for texto in text['texts']
-            ]
-            max_tokens = 1000
-            concatenated_input_texts_and_tokens = concatenate_documents(input_texts_and_tokens, max_tokens)
-            
-            # Calculamos las embeddings para cada bloque de texto
-            text_and_embeddings = [
-                {
-                    'block_id': block_id,
-                    'text': text['text'],
-                    'embeddings': calculate_embeddings(text['text'])
-                } 
-                for block_id, text in enumerate(concatenated_input_texts_and_tokens)
-            ]
-            
-            # Opcional: guardar las embeddings en session_state o en un archivo
-            st.session_state.embeddings_data = text_and_embeddings
-            
-            # Convertir las embeddings a un formato adecuado (por ejemplo, numpy array) y actualizar los datos de comparación
-            embedings_list = [{
-                "text": entry["text"],
-                "embeddings": np.array(entry["embeddings"])
-            } for entry in text_and_embeddings]
-            update_comparision_data(embedings_list)
+            # El índice se guarda en disco al terminar, para no tener que volver a procesar los PDF en el futuro
+            if new_index_name.strip():
+                st.session_state.index_directory = os.path.join(indexes_dir, new_index_name.strip())
+            get_ingestion_queue().submit(st.session_state.session_id, pdf_sources,
+                                         directory=st.session_state.get("index_directory"))
         else:
             st.write("No se subieron archivos PDF. Puedes continuar sin ellos.")
         
         # ------------------------------------------------------------------------------
         # Instanciar el agente con el prompt seleccionado
         # ------------------------------------------------------------------------------
-        st.session_state.agent = nuevo_agente(st.session_state.system_prompt)
+        st.session_state.agent = agents.nuevo_agente(st.session_state.system_prompt, session_id=st.session_state.session_id)
         
         # Indicamos que la configuración se completó y recargamos la app para mostrar la siguiente pantalla
         st.session_state.config_done = True
         st.success("¡Configuración completada! Ahora puedes interactuar con el agente.")
         st.rerun()
+    
+    # Con la pantalla ya dibujada, el LLM y la factoría de agentes se preparan en segundo plano mientras el
+    # usuario sube los PDF
+    warm_up()
 
 # =============================================================================
 # PANTALLA PRINCIPAL DE INTERACCIÓN CON EL AGENTE
@@ -149,16 +228,63 @@ if not st.session_state.config_done:
 else:
     st.title("Interacción con el Agente")
     
+    # -------------------------------------------------------------------------
+    # Barra lateral: añadir o quitar documentos sin rehacer la configuración
+    # -------------------------------------------------------------------------
+    with st.sidebar:
+        st.header("Documentos")
+        session_id = st.session_state.session_id
+        index_directory = st.session_state.get("index_directory")
+        
+        # El registro olvida las sesiones inactivas (INDEX_SESSION_TTL): si se había guardado el índice, se reabre
+        if index_directory is not None and os.path.isdir(index_directory) and not index_registry.has_session(session_id):
+            index_registry.set_documents(session_id, load_index(index_directory))
+        
+        added_files = st.file_uploader("Añadir archivos PDF", type=["pdf"], accept_multiple_files=True, key="added_files")
+        if st.button("Añadir documentos") and added_files:
+            pdf_sources = [(added_file.name, added_file.getvalue()) for added_file in added_files]
+            # Solo se embeben los bloques nuevos o modificados; los documentos que ya tiene otra sesión se comparten
+            get_ingestion_queue().submit(session_id, pdf_sources, directory=index_directory)
+        
+        # Progreso de la ingesta en segundo plano (se actualiza solo)
+        show_ingestion_progress()
+        
+        documents = index_registry.list_documents(session_id)
+        for document in documents:
+            st.caption(f"{document['file_name']} ({document['chunks']} bloques)")
+        if documents:
+            document_to_remove = st.selectbox("Quitar documento", documents, format_func=lambda document: document["file_name"])
+            if st.button("Quitar"):
+                index_registry.remove_document(session_id, document_to_remove["file_hash"])
+                if index_directory is not None:
+                    index_registry.save_session(session_id, index_directory)
+                st.rerun()
+        
+        # El panel de métricas se rellena al final, para que incluya el turno actual
+        metrics_panel = st.container()
+    
     # Inicializar variable para evitar procesar prompts repetidos
     if "last_user_prompt" not in st.session_state:
         st.session_state.last_user_prompt = None
 
+    # El chat se habilita en cuanto hay algún documento indexado (o si no queda ninguno por procesar)
+    ingesting = any(job["state"] in ("queued", "running") for job in get_ingestion_queue().list_jobs(session_id))
+    waiting_for_documents = ingesting and not documents
+    if waiting_for_documents:
+        st.info("Procesando los documentos. El chat estará disponible en cuanto el primero esté indexado.")
+    
     # Input del usuario a través de la nueva función de chat (disponible en versiones recientes de Streamlit)
-    user_prompt = st.chat_input(TEXT_INPUT_BANNER)
+    user_prompt = st.chat_input(TEXT_INPUT_BANNER, disabled=waiting_for_documents)
     
     if user_prompt and user_prompt != st.session_state.last_user_prompt:
         st.session_state.last_user_prompt = user_prompt  # Guarda el último prompt para evitar duplicados
         
+        # La respuesta depende del prompt, de los documentos y de la conversación previa: todo ello forma la clave
+        # de la caché de respuestas (con otros documentos o en otro punto de la conversación no se reutiliza)
+        answer_cache = get_answer_cache()
+        cache_namespace = answer_namespace(st.session_state.system_prompt, index_registry.corpus_version(session_id),
+                                           st.session_state.chat_history[1:])
+        
         # Mostrar el mensaje del usuario en el chat
         with st.chat_message("user"):
             st.session_state.chat_history.append({"role": "user", "content": user_prompt})
@@ -166,6 +292,49 @@ else:
         
         # Consultar al agente y mostrar la respuesta
         with st.chat_message("assistant"):
-            response = st.session_state.agent.query(user_prompt)
+            # Nuevo turno: se descartan las embeddings de consultas memorizadas en el turno anterior
+            reset_query_embeddings_memo()
+            turn_metrics = {}
+            
+            # Una pregunta equivalente ya respondida en las mismas condiciones se sirve sin llamar al agente; la
+            # embedding queda memorizada, así que la herramienta de búsqueda no la vuelve a pedir
+            query_embedding = calculate_query_embeddings(user_prompt) if answer_cache.enabled else None
+            cached_answer = answer_cache.lookup(cache_namespace, query_embedding) if answer_cache.enabled else None
+            if cached_answer is not None:
+                cache_start = time.perf_counter()
+                response, similarity = cached_answer
+                st.markdown(response)
+                # El agente no ha visto este turno: se añade a su memoria para que las siguientes preguntas lo tengan
+                agents.remember_turn(st.session_state.agent, user_prompt, response)
+                increment("answer_cache_hit")
+                observe("agent_turn_cached", time.perf_counter() - cache_start)
+                st.caption(f"Respuesta reutilizada de una pregunta similar ({similarity:.3f})")
+            else:
+                if answer_cache.enabled:
+                    increment("answer_cache_miss")
+                
+                # Mientras el agente ejecuta herramientas se muestra su progreso; después la respuesta llega en streaming
+                with st.status("Pensando...", expanded=False) as agent_status:
+                    def show_tool_call(tool_name, tool_args):
+                        agent_status.update(label=f"Ejecutando {tool_name}: {tool_args.get('query', '')}")
+                        agent_status.write(f"{tool_name}({tool_args})")
+                    
+                    response_tokens = agents.stream_agent_response(st.session_state.agent, user_prompt, turn_metrics,
+                                                                   on_tool_call=show_tool_call)
+                    agent_status.update(label="Respuesta", state="complete")
+                response = st.write_stream(response_tokens)
+                answer_cache.store(cache_namespace, query_embedding, user_prompt, response)
+                
+                # Tiempo hasta el primer token, latencia total y tamaño del prompt del turno (también van al log)
+                st.session_state.setdefault("turn_metrics", []).append(turn_metrics)
+                st.caption(f"Primer token: {turn_metrics['time_to_first_token']:.2f} s · "
+                           f"Total: {turn_metrics['total_latency']:.2f} s · "
+                           f"Prompt: {turn_metrics['prompt_tokens']} tokens")
             st.session_state.chat_history.append({"role": "assistant", "content": response})
-            st.markdown(response)
\ No newline at end of file
+            if metrics_prometheus_file:
+                telemetry.write_prometheus(metrics_prometheus_file)
+    
+    show_metrics_panel(metrics_panel)
+
+# Duración de esta ejecución: la primera del proceso cuenta como arranque en frío
+record_app_run(app_run_start)
@@ -0,0 +1,47 @@
+"""
+Shared fixtures of the tests. They run offline: the embeddings come from the fake endpoint of tools.fake_endpoints
+and the documents are chunked with its word tokenizer, so neither the Azure services nor the tiktoken encodings
+are needed.
+"""
+import os
+import sys
+
+import pytest
+
+# Los tests importan los módulos del proyecto como lo hace la app, desde la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import chunker
+from tools.embedding_cache import EmbeddingCache
+from tools.embedding_service import EmbeddingService, set_embedding_service
+from tools.fake_endpoints import WordTokenizer, start_fake_server
+
+# Dimensión de los embeddings falsos: pequeña para que los tests sean rápidos
+FAKE_DIMENSIONS = 32
+
+@pytest.fixture
+def word_tokenizer(monkeypatch):
+    tokenizer = WordTokenizer()
+    monkeypatch.setattr(chunker, "get_tokenizer", lambda model=None: tokenizer)
+    return tokenizer
+
+@pytest.fixture
+def fake_server():
+    server, url = start_fake_server(dimensions=FAKE_DIMENSIONS)
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+"""
+Installs an EmbeddingService pointed to the fake endpoint as the process-wide service, with one token per character
+and a cache in the temporary directory of the test.
+"""
+@pytest.fixture
+def embedding_service(fake_server, tmp_path):
+    _, url = fake_server
+    service = EmbeddingService(azure_endpoint=url, api_key="fake", deployment_name="fake", token_counter=len,
+                               backoff_base=0.0, cache=EmbeddingCache(str(tmp_path / "embeddings.sqlite")))
+    set_embedding_service(service)
+    yield service
+    set_embedding_service(None)
+    service.close()
@@ -0,0 +1,70 @@
+import time
+
+import numpy as np
+
+from tools.answer_cache import SemanticAnswerCache, answer_namespace
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def test_similar_question_returns_the_cached_answer():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=60, max_entries=10)
+    namespace = answer_namespace("prompt", "version")
+    cache.store(namespace, unit(1, 0, 0), "¿Qué es X?", "X es...")
+
+    answer, similarity = cache.lookup(namespace, unit(1, 0.1, 0))
+
+    assert answer == "X es..."
+    assert similarity >= 0.9
+    assert cache.lookup(namespace, unit(0, 1, 0)) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_answers_are_not_shared_across_namespaces():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=60, max_entries=10)
+    cache.store(answer_namespace("prompt", "version 1"), unit(1, 0), "pregunta", "respuesta")
+
+    assert cache.lookup(answer_namespace("prompt", "version 2"), unit(1, 0)) is None
+    assert cache.lookup(answer_namespace("otro prompt", "version 1"), unit(1, 0)) is None
+    history = [{"role": "user", "content": "hola"}]
+    assert cache.lookup(answer_namespace("prompt", "version 1", history), unit(1, 0)) is None
+
+def test_answers_expire_after_the_ttl(monkeypatch):
+    cache = SemanticAnswerCache(threshold=0.9, ttl=10, max_entries=10)
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    cache.store("espacio", unit(1, 0), "pregunta", "respuesta")
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+
+    assert cache.lookup("espacio", unit(1, 0)) is None
+    assert len(cache) == 0
+
+def test_least_recently_used_answers_are_evicted():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=60, max_entries=2)
+    cache.store("espacio", unit(1, 0, 0), "a", "respuesta a")
+    cache.store("espacio", unit(0, 1, 0), "b", "respuesta b")
+    cache.lookup("espacio", unit(1, 0, 0))
+
+    cache.store("espacio", unit(0, 0, 1), "c", "respuesta c")
+
+    assert cache.lookup("espacio", unit(0, 1, 0)) is None
+    assert cache.lookup("espacio", unit(1, 0, 0))[0] == "respuesta a"
+    assert cache.lookup("espacio", unit(0, 0, 1))[0] == "respuesta c"
+
+def test_invalidate_drops_a_namespace():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=60, max_entries=10)
+    cache.store("uno", unit(1, 0), "pregunta", "respuesta")
+    cache.store("dos", unit(1, 0), "pregunta", "respuesta")
+
+    cache.invalidate("uno")
+
+    assert cache.lookup("uno", unit(1, 0)) is None
+    assert cache.lookup("dos", unit(1, 0)) is not None
+
+def test_disabled_cache_stores_nothing():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=60, max_entries=0)
+    cache.store("espacio", unit(1, 0), "pregunta", "respuesta")
+
+    assert not cache.enabled
+    assert len(cache) == 0
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+import requests
+
+from tools.bing_search import BingSearchClient, SearchResultCache
+
+@pytest.fixture
+def bing_client(fake_server):
+    server, url = fake_server
+    client = BingSearchClient(api_key="fake", endpoint=url + "/v7.0/search", read_timeout=0.5,
+                              cache=SearchResultCache(ttl=60, max_entries=2))
+    yield server, client
+    client.close()
+
+def test_search_returns_the_requested_number_of_results(bing_client):
+    server, client = bing_client
+
+    results = client.search("plazo de entrega", count=3)
+
+    assert [result["snippet"] for result in results] == [f"Fragmento {i} sobre plazo de entrega." for i in (1, 2, 3)]
+    # El número de resultados forma parte de la clave de la caché
+    assert len(client.search("plazo de entrega", count=1)) == 1
+    assert server.request_count == 2
+
+def test_repeated_queries_are_answered_from_the_cache(bing_client):
+    server, client = bing_client
+    results = client.search("Plazo de  entrega")
+
+    assert client.search("plazo de entrega") == results
+    assert server.request_count == 1
+    assert client.cache.stats()["hits"] == 1
+
+def test_cached_results_expire_after_the_ttl(bing_client, monkeypatch):
+    server, client = bing_client
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    client.search("garantía")
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 59)
+    client.search("garantía")
+    assert server.request_count == 1
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    client.search("garantía")
+    assert server.request_count == 2
+
+def test_cache_keeps_the_most_recently_used_queries(bing_client):
+    server, client = bing_client
+    client.search("contrato")
+    client.search("factura")
+    client.search("contrato")
+
+    # Con dos entradas como máximo, "factura" es la menos usada y sale de la caché
+    client.search("cliente")
+
+    assert len(client.cache) == 2
+    client.search("contrato")
+    assert server.request_count == 3
+    client.search("factura")
+    assert server.request_count == 4
+
+def test_slow_answers_raise_a_timeout(bing_client):
+    server, client = bing_client
+    server.latency = 1.0
+
+    with pytest.raises(requests.exceptions.Timeout):
+        client.search("anexo")
+
+    # El error no se guarda en la caché: la siguiente llamada vuelve a preguntar
+    server.latency = 0.0
+    assert len(client.search("anexo")) == 1
+    assert len(client.cache) == 1
@@ -0,0 +1,41 @@
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.llms import MockLLM
+
+from tools.conversation_memory import SUMMARY_HEADER, TOOL_OUTPUT_KEEP_TOKENS, TRIMMED_MARKER, TokenBudgetMemory
+
+def count_words(text):
+    return len(text.split())
+
+# Un turno con una búsqueda: pregunta, llamada a la herramienta, su salida (un bloque de los documentos) y respuesta
+def search_turn(number, output_words=1000):
+    return [
+        ChatMessage(role=MessageRole.USER, content=f"pregunta {number}"),
+        ChatMessage(role=MessageRole.ASSISTANT, content="", additional_kwargs={"tool_calls": []}),
+        ChatMessage(role=MessageRole.TOOL, content=" ".join(["bloque"] * output_words),
+                    additional_kwargs={"tool_call_id": f"llamada {number}", "name": "search_for_info"}),
+        ChatMessage(role=MessageRole.ASSISTANT, content=f"respuesta {number}"),
+    ]
+
+def test_old_tool_outputs_are_trimmed_before_summarizing():
+    memory = TokenBudgetMemory(llm=MockLLM(), token_limit=2500, summary_max_tokens=500, token_counter=count_words)
+
+    memory.set(search_turn(1) + search_turn(2) + search_turn(3))
+
+    # Las salidas de los turnos anteriores se recortan y el último turno queda entero, sin resumir nada
+    assert memory.summary is None and memory.summarized_turns == 0
+    assert len(memory.messages) == 12
+    tool_outputs = [message for message in memory.messages if message.role == MessageRole.TOOL]
+    assert [count_words(message.content) for message in tool_outputs[:2]] == [TOOL_OUTPUT_KEEP_TOKENS + 1] * 2
+    assert all(message.content.endswith(TRIMMED_MARKER) for message in tool_outputs[:2])
+    assert tool_outputs[0].additional_kwargs["tool_call_id"] == "llamada 1"
+    assert count_words(tool_outputs[2].content) == 1000
+    assert memory.token_count() <= 2500
+
+def test_turns_are_summarized_when_trimming_is_not_enough():
+    memory = TokenBudgetMemory(llm=MockLLM(), token_limit=1500, summary_max_tokens=200, token_counter=count_words)
+
+    memory.set([message for number in range(10) for message in search_turn(number)])
+
+    assert memory.summarized_turns > 0
+    assert memory.get()[0].content.startswith(SUMMARY_HEADER)
+    assert memory.token_count() <= 1500
@@ -0,0 +1,51 @@
+import itertools
+import time
+
+import numpy as np
+
+from tools.embedding_cache import EmbeddingCache, cache_key
+from tools.fake_endpoints import fake_embedding
+
+def test_cached_texts_are_not_sent_again(embedding_service, fake_server):
+    server, _ = fake_server
+    embedding_service.embed_batch(["uno", "dos", "dos"])
+    requests_sent = server.request_count
+
+    embeddings = embedding_service.embed_batch(["uno", "  dos ", "tres"])
+
+    # Solo "tres" es nuevo; "  dos " solo difiere en espacios y comparte la entrada de "dos"
+    assert server.request_count == requests_sent + 1
+    assert embeddings[1] == fake_embedding("dos", server.dimensions)
+    assert embedding_service.cache.stats()["entries"] == 3
+    assert embedding_service.cache.stats()["saved_tokens"] == len("uno") + len("dos")
+
+def test_cache_keys_depend_on_the_deployment():
+    assert cache_key("texto", "a") == cache_key(" texto\n", "a")
+    assert cache_key("texto", "a") != cache_key("texto", "b")
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(time, "time", lambda: next(clock))
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    keys = [cache_key(text, "d") for text in ("a", "b", "c")]
+    cache.put_many([(keys[0], [1.0, 0.0], 1), (keys[1], [0.0, 1.0], 1)])
+    cache.get_many([keys[0]])
+
+    cache.put_many([(keys[2], [1.0, 1.0], 1)])
+    found = cache.get_many(keys)
+    cache.close()
+
+    assert set(found) == {keys[0], keys[2]}
+    np.testing.assert_allclose(found[keys[2]], [1.0, 1.0])
+
+def test_entries_are_shared_through_the_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    key = cache_key("texto", "d")
+    writer = EmbeddingCache(path)
+    writer.put_many([(key, [0.5, 0.5], 3)])
+    reader = EmbeddingCache(path)
+
+    assert reader.get_many([key]) == {key: [0.5, 0.5]}
+    assert reader.stats()["saved_tokens"] == 3
+    writer.close()
+    reader.close()
@@ -0,0 +1,51 @@
+from tools.embedding_service import EmbeddingService
+from tools.fake_endpoints import fake_embedding, start_fake_server
+
+def test_embed_batch_keeps_the_input_order(embedding_service, fake_server):
+    server, _ = fake_server
+    embedding_service.max_items_per_request = 4
+    texts = [f"texto {i}" for i in range(30)]
+
+    embeddings = embedding_service.embed_batch(texts)
+
+    assert embeddings == [fake_embedding(text, server.dimensions) for text in texts]
+    assert server.request_count == 8
+
+def test_pack_batches_respects_the_limits(embedding_service):
+    embedding_service.max_tokens_per_request = 10
+    embedding_service.max_items_per_request = 3
+
+    # Un token por carácter: cinco textos de 2, uno de 25 (más que el límite, va solo) y dos de 2
+    batches = embedding_service.pack_batches(["aa"] * 5 + ["b" * 25] + ["cc"] * 2)
+
+    assert batches == [[0, 1, 2], [3, 4], [5], [6, 7]]
+
+def test_one_pool_serves_every_batch(embedding_service):
+    embedding_service.max_items_per_request = 2
+    embedding_service.embed_batch(["a", "b", "c"])
+    executor = embedding_service._executor
+
+    embedding_service.embed_batch(["d", "e", "f"])
+
+    assert executor is not None and embedding_service._executor is executor
+
+def test_a_single_batch_is_sent_from_the_calling_thread(embedding_service):
+    embeddings = embedding_service.embed_batch(["consulta"])
+
+    assert len(embeddings) == 1
+    assert embedding_service._executor is None
+    assert embedding_service.embed_batch([]) == []
+
+def test_rate_limited_requests_are_retried():
+    server, url = start_fake_server(dimensions=8, rate_limit_every=2)
+    service = EmbeddingService(azure_endpoint=url, api_key="fake", deployment_name="fake", token_counter=len,
+                               max_items_per_request=1, max_in_flight=1, backoff_base=0.0)
+    try:
+        embeddings = service.embed_batch(["a", "b", "c"])
+    finally:
+        service.close()
+        server.shutdown()
+        server.server_close()
+
+    assert embeddings == [fake_embedding(text, 8) for text in "abc"]
+    assert server.request_count > 3
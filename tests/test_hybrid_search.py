@@ -0,0 +1,50 @@
+import numpy as np
+
+from config.env_loader import lexical_fast_path_min_score
+from tools import hybrid_search as hybrid_search_module
+from tools.hybrid_search import hybrid_search, lexical_fast_path
+from tools.vector_index import VectorIndex
+
+def make_index(extra_texts):
+    texts = [f"bloque {i} con texto comun" for i in range(50)] + extra_texts
+    matrix = np.random.default_rng(0).standard_normal((len(texts), 16)).astype(np.float32)
+    return VectorIndex(matrix, texts, [{} for _ in texts])
+
+def test_fast_path_answers_a_clear_keyword_match():
+    index = make_index(["referencia XK-2041 del manual", "manual de uso"])
+
+    results = lexical_fast_path(index, "referencia XK-2041 manual")
+
+    assert [text for text, _ in results] == ["referencia XK-2041 del manual"]
+    # La puntuación es la de BM25, comparada con LEXICAL_FAST_PATH_MIN_SCORE
+    assert results[0][1] >= lexical_fast_path_min_score
+
+def test_fast_path_needs_the_minimum_score(monkeypatch):
+    index = make_index(["referencia XK-2041 del manual", "manual de uso"])
+    monkeypatch.setattr(hybrid_search_module, "lexical_fast_path_min_score", 1000.0)
+
+    assert lexical_fast_path(index, "referencia XK-2041 manual") is None
+
+def test_fast_path_needs_a_second_hit():
+    index = make_index(["referencia XK-2041 del manual"])
+
+    assert lexical_fast_path(index, "XK-2041") is None
+
+def test_fast_path_needs_a_clear_margin():
+    index = make_index(["referencia XK-2041", "otra referencia XK-2041"])
+
+    assert lexical_fast_path(index, "referencia XK-2041") is None
+
+def test_fast_path_skips_long_queries():
+    index = make_index(["uno dos tres cuatro cinco seis siete", "uno"])
+
+    assert lexical_fast_path(index, "uno dos tres cuatro cinco seis siete") is None
+
+def test_hybrid_search_promotes_exact_keyword_matches():
+    index = make_index(["codigo ZZ-99 del contrato"])
+    # La consulta se parece más a otro bloque, pero solo el último contiene el código
+    query_embedding = index.matrix[7]
+
+    texts = [text for text, _ in hybrid_search(index, "ZZ-99", query_embedding, k=2)]
+
+    assert "codigo ZZ-99 del contrato" in texts
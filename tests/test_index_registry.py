@@ -0,0 +1,218 @@
+import os
+import random
+import threading
+import time
+
+import fitz
+import numpy as np
+import pytest
+
+from tools import index_registry, ingestion
+from tools.index_registry import IndexRegistry
+from tools.ingestion import file_hash
+from tools.ivf_index import load_index
+from tools.search_embedding import reset_query_embeddings_memo
+
+WORDS = ["contrato", "factura", "cliente", "plazo", "importe", "servicio", "entrega", "garantía", "pago", "anexo"]
+
+def make_pdf(seed, pages=2, words_per_page=150):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_number in range(pages):
+        words = [rng.choice(WORDS) + str(rng.randrange(1000)) for _ in range(words_per_page)]
+        lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+        doc.new_page().insert_textbox(fitz.Rect(40, 40, 560, 800), f"Página {page_number + 1}\n" + "\n".join(lines),
+                                      fontsize=8)
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+@pytest.fixture
+def registry(embedding_service, word_tokenizer, tmp_path):
+    reset_query_embeddings_memo()
+    return IndexRegistry(memory_budget_bytes=1 << 30, spill_dir=str(tmp_path / "spill"), session_ttl=0)
+
+@pytest.fixture(scope="module")
+def pdfs():
+    return [make_pdf(seed) for seed in range(3)]
+
+def first_chunk(registry, session_id):
+    index = registry.get(session_id)
+    return index.texts[0]
+
+def test_added_documents_are_searchable(registry, pdfs):
+    summary = registry.add_documents("s1", [("a.pdf", pdfs[0]), ("b.pdf", pdfs[1])])
+
+    assert summary["added"] == ["a.pdf", "b.pdf"]
+    assert [document["file_name"] for document in registry.list_documents("s1")] == ["a.pdf", "b.pdf"]
+    text = first_chunk(registry, "s1")
+    assert registry.search("s1", text)[0] == (text, pytest.approx(1.0, abs=1e-5))
+
+def test_same_file_name_keeps_the_documents_apart(registry, pdfs):
+    registry.add_documents("s1", [("a.pdf", pdfs[0]), ("a.pdf", pdfs[1])])
+
+    # El segundo "a.pdf" sustituye al primero, con su propio hash y sin mezclar sus bloques
+    documents = registry.list_documents("s1")
+    assert [document["file_hash"] for document in documents] == [file_hash(pdfs[1])]
+    index = registry.get("s1")
+    assert {index.metadata[row]["file_hash"] for row in range(len(index)) if not index.deleted[row]} == {file_hash(pdfs[1])}
+
+def test_sessions_with_the_same_documents_share_their_blocks(registry, pdfs, fake_server):
+    server, _ = fake_server
+    registry.add_documents("s1", [("a.pdf", pdfs[0])])
+    requests_sent = server.request_count
+
+    summary = registry.add_documents("s2", [("otro nombre.pdf", pdfs[0]), ("b.pdf", pdfs[1])])
+
+    # El documento de la otra sesión se comparte, sin volver a extraerlo ni a calcular sus embeddings
+    assert summary["reused_chunks"] >= len(registry.get("s1"))
+    assert server.request_count > requests_sent
+    block = registry.get("s1").blocks[0]
+    assert registry.get("s2").blocks[0] is block
+    assert not block.matrix.flags.writeable
+    assert registry.stats()["documents"] == 2
+    assert [document["file_name"] for document in registry.list_documents("s2")] == ["otro nombre.pdf", "b.pdf"]
+    assert registry.corpus_version("s1") != registry.corpus_version("s2")
+
+    # Quitar el documento de una sesión no lo quita de la otra
+    registry.remove_document("s2", file_hash(pdfs[0]))
+    assert registry.get("s1").blocks[0] is block
+    assert registry.get("s1").search(block.matrix[0], 1)[0][0] == block.texts[0]
+
+def test_remove_document(registry, pdfs):
+    registry.add_documents("s1", [("a.pdf", pdfs[0]), ("b.pdf", pdfs[1])])
+
+    removed = registry.remove_document("s1", file_hash(pdfs[0]))
+
+    assert removed > 0
+    assert [document["file_name"] for document in registry.list_documents("s1")] == ["b.pdf"]
+    assert file_hash(pdfs[0]) not in registry.documents
+
+def test_session_index_is_built_outside_the_lock(registry, pdfs, monkeypatch):
+    lock_was_free = []
+
+    class CheckedSessionIndex(index_registry.SessionIndex):
+        def __init__(self, *args, **kwargs):
+            # Otro hilo tiene que poder usar el registro mientras se construye el índice
+            thread = threading.Thread(target=lambda: lock_was_free.append(registry._lock.acquire(timeout=5)
+                                                                          and registry._lock.release() is None))
+            thread.start()
+            thread.join()
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(index_registry, "SessionIndex", CheckedSessionIndex)
+    registry.add_documents("s1", [("a.pdf", pdfs[0])])
+
+    assert lock_was_free == [True]
+    assert isinstance(registry.get("s1"), CheckedSessionIndex)
+
+def test_large_sessions_use_ivf_over_all_their_documents(registry, pdfs, monkeypatch):
+    monkeypatch.setattr(index_registry, "vector_index_backend", "auto")
+    monkeypatch.setattr(index_registry, "ann_min_rows", 1)
+    registry.add_documents("s1", [("a.pdf", pdfs[0])])
+    centroids = registry.get("s1").ivf.centroids
+
+    registry.add_documents("s1", [("b.pdf", pdfs[1])])
+
+    index = registry.get("s1")
+    assert len(index.ivf) == len(index) == sum(len(block) for block in index.blocks)
+    # Los centroides se reutilizan al añadir un documento
+    assert index.ivf.centroids is centroids
+    text = index.texts[-1]
+    assert registry.search("s1", text)[0] == (text, pytest.approx(1.0, abs=1e-5))
+    assert registry.memory_usage() >= index.ivf.memory_usage()
+
+def test_lexical_index_is_built_with_the_documents(registry, pdfs, monkeypatch):
+    monkeypatch.setattr(index_registry, "uses_lexical_index", lambda: True)
+    registry.add_documents("s1", [("a.pdf", pdfs[0])])
+    memory_before = registry.memory_usage()
+
+    registry.add_documents("s1", [("b.pdf", pdfs[1])])
+
+    index = registry.get("s1")
+    assert index.lexical is not None and len(index.lexical) == len(index)
+    assert registry.sessions["s1"].index_nbytes == index.lexical.memory_usage()
+    assert registry.memory_usage() > memory_before
+
+def test_sessions_over_the_budget_are_spilled_and_reloaded(registry, pdfs):
+    registry.add_documents("s1", [("a.pdf", pdfs[0])])
+    registry.add_documents("s2", [("b.pdf", pdfs[1])])
+    text = first_chunk(registry, "s1")
+
+    registry.memory_budget_bytes = registry.documents[file_hash(pdfs[1])].nbytes
+    registry._enforce_budget("s2")
+
+    document = registry.documents[file_hash(pdfs[0])]
+    assert document.index is None
+    assert os.path.isdir(document.spill_path)
+    assert registry.stats()["loaded_sessions"] == 1
+    assert registry.search("s1", text)[0][0] == text
+    assert registry.documents[file_hash(pdfs[0])].index is not None
+
+def test_idle_sessions_are_dropped_with_their_spill_files(registry, pdfs, monkeypatch):
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    registry.session_ttl = 60
+    registry.add_documents("s1", [("a.pdf", pdfs[0])])
+    registry.add_documents("s2", [("b.pdf", pdfs[1])])
+    registry._evict(registry.sessions["s1"])
+    spill_path = registry.documents[file_hash(pdfs[0])].spill_path
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 30)
+    registry.get("s2")
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+
+    assert not registry.has_session("s1")
+    assert registry.has_session("s2")
+    assert not os.path.exists(spill_path)
+    assert file_hash(pdfs[0]) not in registry.documents
+
+def test_saved_sessions_are_reopened_without_copying(registry, pdfs, tmp_path):
+    directory = str(tmp_path / "indice")
+    registry.add_documents("s1", [("a.pdf", pdfs[0]), ("b.pdf", pdfs[1])])
+    registry.save_session("s1", directory)
+    texts = registry.get("s1").texts
+    registry.drop_session("s1")
+
+    registry.set_documents("s2", load_index(directory))
+
+    index = registry.get("s2")
+    assert index.texts == texts
+    assert all(isinstance(block.matrix, np.memmap) for block in index.blocks)
+    assert [document["file_hash"] for document in registry.list_documents("s2")] == [file_hash(pdf) for pdf in pdfs[:2]]
+
+def test_save_session_appends_in_place(registry, pdfs, tmp_path, monkeypatch):
+    directory = str(tmp_path / "indice")
+    registry.add_documents("s1", [("a.pdf", pdfs[0])])
+    registry.save_session("s1", directory)
+    saved_rows = len(registry.get("s1"))
+
+    registry.add_documents("s1", [("b.pdf", pdfs[1])])
+    with monkeypatch.context() as patch:
+        patch.setattr(ingestion, "_rewrite_documents", lambda *args: pytest.fail("the index was saved again"))
+        registry.save_session("s1", directory)
+
+    index = registry.get("s1")
+    loaded = load_index(directory)
+    assert len(loaded) == len(index) > saved_rows
+    assert loaded.texts == index.texts
+
+    # El índice reabierto en otra sesión se sigue actualizando en el sitio: los documentos quitados se marcan como
+    # borrados mientras no pasen de COMPACT_DELETED_RATIO
+    monkeypatch.setattr(ingestion, "COMPACT_DELETED_RATIO", 0.5)
+    registry.drop_session("s1")
+    registry.set_documents("s2", loaded)
+    registry.add_documents("s2", [("c.pdf", pdfs[2])])
+    registry.remove_document("s2", file_hash(pdfs[1]))
+    with monkeypatch.context() as patch:
+        patch.setattr(ingestion, "_rewrite_documents", lambda *args: pytest.fail("the index was saved again"))
+        registry.save_session("s2", directory)
+    reloaded = load_index(directory)
+    assert reloaded.deleted.any()
+    assert [text for row, text in enumerate(reloaded.texts) if not reloaded.deleted[row]] == registry.get("s2").texts
+
+    registry.remove_document("s2", file_hash(pdfs[0]))
+    registry.save_session("s2", directory)
+    reloaded = load_index(directory)
+    assert not reloaded.deleted.any()
+    assert reloaded.texts == registry.get("s2").texts
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from tools.ivf_index import IVFIndex, default_n_lists, load_index
+from tools.vector_index import VectorIndex, normalize_vectors
+
+ROWS = 20000
+DIM = 64
+K = 5
+
+# Embeddings agrupados en torno a temas aleatorios, como los de los documentos reales
+def clustered_embeddings(rows, topics=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, DIM)).astype(np.float32)
+    return normalize_vectors(centers[rng.integers(0, topics, rows)] + 0.6 * rng.standard_normal((rows, DIM)))
+
+@pytest.fixture(scope="module")
+def corpus():
+    matrix = clustered_embeddings(ROWS)
+    texts = [str(i) for i in range(ROWS)]
+    return VectorIndex(matrix, texts, normalized=True), IVFIndex(matrix, texts, normalized=True)
+
+def recall(exact, ivf, queries, **kwargs):
+    return np.mean([len({text for text, _ in exact.search(query, K)} & {text for text, _ in ivf.search(query, K, **kwargs)}) / K
+                    for query in queries])
+
+def test_default_n_probe_keeps_recall(corpus):
+    exact, ivf = corpus
+    queries = clustered_embeddings(100, seed=1)
+
+    assert ivf.n_lists == default_n_lists(ROWS)
+    assert recall(exact, ivf, queries) >= 0.8
+    # Explorando todas las listas la búsqueda es exacta
+    assert recall(exact, ivf, queries, n_probe=ivf.n_lists) == 1.0
+
+def test_save_and_load_keep_the_lists(corpus, tmp_path):
+    _, ivf = corpus
+    ivf.save(str(tmp_path))
+
+    loaded = load_index(str(tmp_path))
+
+    assert isinstance(loaded, IVFIndex)
+    assert isinstance(loaded.matrix, np.memmap)
+    np.testing.assert_array_equal(loaded.offsets, ivf.offsets)
+    query = clustered_embeddings(1, seed=2)[0]
+    assert loaded.search(query, K) == ivf.search(query, K)
+
+def test_added_rows_are_found_before_and_after_compaction():
+    matrix = clustered_embeddings(2000)
+    ivf = IVFIndex(matrix[:1000], [str(i) for i in range(1000)], normalized=True)
+    ivf.add_entries([{"text": str(i), "embeddings": matrix[i]} for i in range(1000, 2000)])
+
+    assert ivf.search(matrix[1500], 1)[0][0] == "1500"
+    ivf.remove_rows([ivf.texts.index("0")])
+    ivf.compact()
+    assert len(ivf) == 1999
+    assert ivf.search(matrix[1500], 1)[0][0] == "1500"
+
+def test_compaction_retrains_an_index_that_grew():
+    matrix = clustered_embeddings(4000)
+    ivf = IVFIndex(matrix[:100], [str(i) for i in range(100)], normalized=True)
+    ivf.add_entries([{"text": str(i), "embeddings": matrix[i]} for i in range(100, 4000)])
+
+    ivf.compact()
+
+    assert ivf.n_lists == default_n_lists(4000)
+    assert ivf.search(matrix[3000], 1)[0][0] == "3000"
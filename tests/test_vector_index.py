@@ -0,0 +1,154 @@
+import json
+import os
+
+import numpy as np
+
+from tools.quantized_index import QuantizedIndex, load_quantized_index
+from tools.vector_index import METADATA_FILE_NAME, MATRIX_FILE_NAME, VectorIndex, list_saved_indexes, normalize_vectors
+
+def make_entries(count, dim=16, seed=0, start=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return [{"text": f"bloque {start + i}", "file_name": "a.pdf", "page_number": i, "embeddings": vector}
+            for i, vector in enumerate(vectors)]
+
+def test_search_matches_the_cosine_ranking():
+    entries = make_entries(50)
+    index = VectorIndex.from_entries(entries)
+    query = np.random.default_rng(1).standard_normal(16)
+
+    results = index.search(query, 5)
+
+    matrix = normalize_vectors(np.vstack([entry["embeddings"] for entry in entries]))
+    scores = matrix @ normalize_vectors(query)
+    expected = np.argsort(-scores)[:5]
+    assert [text for text, _ in results] == [f"bloque {i}" for i in expected]
+    np.testing.assert_allclose([score for _, score in results], scores[expected], rtol=1e-5)
+
+def test_search_many_matches_search():
+    entries = make_entries(50)
+    index = VectorIndex.from_entries(entries)
+    queries = [entries[i]["embeddings"] for i in (3, 17, 42)]
+
+    for results, query in zip(index.search_many(queries, 3), queries):
+        expected = index.search(query, 3)
+        assert [text for text, _ in results] == [text for text, _ in expected]
+        np.testing.assert_allclose([score for _, score in results], [score for _, score in expected], rtol=1e-5)
+
+def test_from_entries_keeps_the_other_fields_as_metadata():
+    index = VectorIndex.from_entries(make_entries(3))
+
+    assert index.texts == ["bloque 0", "bloque 1", "bloque 2"]
+    assert index.metadata[2] == {"file_name": "a.pdf", "page_number": 2}
+    assert index.search(make_entries(3)[1]["embeddings"])[0][0] == "bloque 1"
+
+def test_empty_index_returns_no_results():
+    index = VectorIndex.from_entries([])
+
+    assert index.search(np.ones(16)) == []
+    assert index.search_many(np.ones((2, 16))) == [[], []]
+
+def test_save_and_load_keep_rows_and_results(tmp_path):
+    entries = make_entries(50)
+    index = VectorIndex.from_entries(entries)
+    index.remove_rows([3, 7])
+    index.save(str(tmp_path / "indice"))
+
+    loaded = VectorIndex.load(str(tmp_path / "indice"))
+
+    assert isinstance(loaded.matrix, np.memmap)
+    assert loaded.texts == index.texts
+    assert loaded.metadata == index.metadata
+    assert loaded.deleted.nonzero()[0].tolist() == [3, 7]
+    query = entries[10]["embeddings"]
+    assert loaded.search(query, 5) == index.search(query, 5)
+    assert loaded.search(entries[3]["embeddings"], 1)[0][0] != "bloque 3"
+    assert list_saved_indexes(str(tmp_path)) == ["indice"]
+
+def test_append_to_disk_updates_the_saved_index(tmp_path):
+    index = VectorIndex.from_entries(make_entries(20))
+    index.save(str(tmp_path))
+    index.add_entries(make_entries(5, seed=1, start=20))
+    index.remove_rows([0])
+
+    index.append_to_disk(str(tmp_path), 20)
+    loaded = VectorIndex.load(str(tmp_path))
+
+    assert len(loaded) == 25
+    assert loaded.texts[20:] == [f"bloque {i}" for i in range(20, 25)]
+    np.testing.assert_allclose(loaded.matrix, index.matrix)
+    assert loaded.deleted.nonzero()[0].tolist() == [0]
+    assert loaded.saved_rows == {os.path.abspath(str(tmp_path)): 25}
+
+def test_load_ignores_rows_of_an_interrupted_append(tmp_path):
+    index = VectorIndex.from_entries(make_entries(10))
+    index.save(str(tmp_path))
+    # La escritura se corta tras añadir los metadatos y las filas, antes de actualizar la cabecera de la matriz
+    with open(tmp_path / METADATA_FILE_NAME, "a", encoding="utf-8") as metadata_file:
+        metadata_file.write(json.dumps({"text": "bloque 10", "file_name": "a.pdf"}) + "\n")
+    with open(tmp_path / MATRIX_FILE_NAME, "ab") as matrix_file:
+        matrix_file.write(np.ones(16, dtype=np.float32).tobytes())
+
+    loaded = VectorIndex.load(str(tmp_path))
+
+    assert len(loaded) == 10
+    assert loaded.texts == index.texts
+    # El directorio no coincide con el índice, así que el próximo guardado lo reescribe entero
+    assert loaded.saved_rows == {}
+
+def test_load_ignores_matrix_rows_without_metadata(tmp_path):
+    index = VectorIndex.from_entries(make_entries(10))
+    index.save(str(tmp_path))
+    lines = (tmp_path / METADATA_FILE_NAME).read_text(encoding="utf-8").splitlines(keepends=True)
+    (tmp_path / METADATA_FILE_NAME).write_text("".join(lines[:8]), encoding="utf-8")
+
+    loaded = VectorIndex.load(str(tmp_path))
+
+    assert len(loaded) == 8
+    np.testing.assert_allclose(loaded.matrix, index.matrix[:8])
+
+def test_compact_drops_deleted_rows():
+    index = VectorIndex.from_entries(make_entries(10))
+    index.remove_rows([1, 2, 3])
+    index.compact()
+
+    assert len(index) == 7
+    assert "bloque 2" not in index.texts
+    assert not index.deleted.any()
+
+def test_quantized_index_rescores_with_the_originals(tmp_path):
+    entries = make_entries(200, dim=32)
+    exact = VectorIndex.from_entries(entries)
+    quantized = QuantizedIndex.from_index(exact, dtype="int8", originals_dir=str(tmp_path / "originals"))
+
+    assert isinstance(quantized.matrix, np.memmap)
+    query = entries[42]["embeddings"]
+    assert [text for text, _ in quantized.search(query, 3)] == [text for text, _ in exact.search(query, 3)]
+
+def test_loaded_quantized_index_keeps_only_the_codes_in_memory(tmp_path):
+    entries = make_entries(100, dim=32)
+    quantized = QuantizedIndex.from_index(VectorIndex.from_entries(entries), dtype="int8")
+    quantized.save(str(tmp_path))
+
+    loaded = load_quantized_index(str(tmp_path))
+
+    assert isinstance(loaded.matrix, np.memmap)
+    np.testing.assert_array_equal(loaded.codes, quantized.codes)
+    assert loaded.memory_usage() == quantized.codes.nbytes + quantized.scales.nbytes
+    query = entries[7]["embeddings"]
+    assert loaded.search(query, 3) == quantized.search(query, 3)
+
+def test_quantized_index_recovers_missing_codes(tmp_path):
+    index = QuantizedIndex.from_index(VectorIndex.from_entries(make_entries(30)), dtype="int8")
+    index.save(str(tmp_path))
+    # Las filas nuevas llegan a la matriz pero la escritura se corta antes de guardar sus códigos
+    saved_codes = index.codes.copy(), index.scales.copy()
+    index.add_entries(make_entries(5, seed=1, start=30))
+    VectorIndex.append_to_disk(index, str(tmp_path), 30)
+
+    loaded = load_quantized_index(str(tmp_path))
+
+    assert len(loaded) == 35
+    assert len(loaded.codes) == len(loaded.scales) == 35
+    np.testing.assert_array_equal(loaded.codes[:30], saved_codes[0])
+    query = normalize_vectors(index.matrix[33])
+    assert loaded.search(query, 1)[0][0] == "bloque 33"
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config.env_loader import answer_cache_threshold, answer_cache_ttl, answer_cache_max_entries
+from tools.vector_index import normalize_vectors
+
+"""
+Returns the namespace of a cached answer: a hash of everything besides the question that the answer depends on.
+Args:
+    system_prompt (str): The system prompt of the agent.
+    corpus_version (str): The version of the documents searched (see IndexRegistry.corpus_version).
+    history (list of dict, optional): The previous turns of the conversation ('role' and 'content'). Answers to
+                                      follow-up questions depend on them, so only identical conversations share them.
+Returns:
+    str: The hex SHA-256 digest.
+"""
+def answer_namespace(system_prompt, corpus_version, history=None):
+    digest = hashlib.sha256()
+    digest.update(json.dumps([system_prompt, corpus_version, history or []], ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+class _Namespace:
+    def __init__(self):
+        self.keys = []
+        self.matrix = None
+
+    def embeddings(self, entries):
+        # La matriz de embeddings del espacio se reconstruye solo cuando cambian sus entradas
+        if self.matrix is None:
+            self.matrix = np.vstack([entries[key][1] for key in self.keys])
+        return self.matrix
+
+"""
+Cache of agent answers looked up by meaning: a question matches a cached one when the cosine similarity of their
+embeddings reaches the threshold, within the same namespace (system prompt, corpus version and conversation, see
+answer_namespace). A new document set gives a new namespace, so the answers of the previous one are never
+returned again and age out. Entries expire after a time to live, and the least recently used ones are evicted
+when the cache is full. It is thread-safe, so it can be shared by every Streamlit session.
+Args:
+    threshold (float): The minimum cosine similarity for a match. Defaults to ANSWER_CACHE_THRESHOLD.
+    ttl (float): Seconds an answer stays valid. Defaults to ANSWER_CACHE_TTL.
+    max_entries (int): The maximum number of cached answers. Defaults to ANSWER_CACHE_MAX_ENTRIES. 0 disables
+                       the cache.
+"""
+class SemanticAnswerCache:
+    def __init__(self, threshold=None, ttl=None, max_entries=None):
+        self.threshold = answer_cache_threshold if threshold is None else threshold
+        self.ttl = answer_cache_ttl if ttl is None else ttl
+        self.max_entries = answer_cache_max_entries if max_entries is None else max_entries
+        # Entrada: (espacio, embedding normalizado, pregunta, respuesta, caducidad)
+        self._entries = OrderedDict()
+        self._namespaces = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    """
+    Looks up the answer to a question.
+    Args:
+        namespace (str): The namespace (see answer_namespace).
+        query_embedding (list or numpy.ndarray): The embedding of the question.
+    Returns:
+        tuple: The cached answer and the similarity of its question, or None if there is no match.
+    """
+    def lookup(self, namespace, query_embedding):
+        query = normalize_vectors(query_embedding)
+        with self._lock:
+            self._expire()
+            space = self._namespaces.get(namespace)
+            if space is None or not space.keys:
+                self.misses += 1
+                return None
+            scores = space.embeddings(self._entries) @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            key = space.keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][3], float(scores[best])
+
+    """
+    Stores the answer to a question.
+    Args:
+        namespace (str): The namespace (see answer_namespace).
+        query_embedding (list or numpy.ndarray): The embedding of the question.
+        question (str): The question, kept for inspection.
+        answer (str): The answer of the agent.
+    """
+    def store(self, namespace, query_embedding, question, answer):
+        if not self.enabled or not answer:
+            return
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = (namespace, normalize_vectors(query_embedding), question, answer,
+                                  time.monotonic() + self.ttl)
+            space = self._namespaces.setdefault(namespace, _Namespace())
+            space.keys.append(key)
+            space.matrix = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    """
+    Drops every answer of a namespace, or every answer if no namespace is given.
+    Args:
+        namespace (str, optional): The namespace.
+    """
+    def invalidate(self, namespace=None):
+        with self._lock:
+            keys = list(self._entries) if namespace is None else list(getattr(self._namespaces.get(namespace), "keys", []))
+            for key in keys:
+                self._remove(key)
+
+    def _remove(self, key):
+        namespace = self._entries.pop(key)[0]
+        space = self._namespaces[namespace]
+        space.keys.remove(key)
+        space.matrix = None
+        if not space.keys:
+            del self._namespaces[namespace]
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry[4] < now]:
+            self._remove(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self), "namespaces": len(self._namespaces)}
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+"""
+Returns the process-wide SemanticAnswerCache configured from the environment, creating it on first use.
+Returns:
+    SemanticAnswerCache: The shared answer cache.
+"""
+def get_answer_cache():
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = SemanticAnswerCache()
+        return _answer_cache
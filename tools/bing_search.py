@@ -1,28 +1,187 @@
+import threading
+import time
+from collections import OrderedDict
+
 import requests
+from requests.adapters import HTTPAdapter
+
 from config.env_loader import (
-    bing_search_api_key
+    bing_search_api_key,
+    bing_search_endpoint,
+    bing_connect_timeout,
+    bing_read_timeout,
+    bing_cache_ttl,
+    bing_cache_max_entries,
+    bing_result_count
 )
+from tools.telemetry import traced
+
 """
-Searches for data using the Bing Search API and returns the snippet of the first result.
+Returns the cache key of a search query: surrounding and repeated whitespace removed and lowercased, since Bing
+does not distinguish case either.
 Args:
     query (str): The search query string.
 Returns:
-    str: The snippet of the first search result if available, otherwise "No results found."
-Raises:
-    requests.exceptions.HTTPError: If the HTTP request returned an unsuccessful status code.
+    str: The normalized query.
+"""
+def normalize_query(query):
+    return " ".join(query.split()).lower()
+
+"""
+In-memory cache of search results with a time to live and a maximum number of entries (least recently used
+entries are evicted first). It is thread-safe, so it can be shared by the agent turns of every Streamlit session.
+Args:
+    ttl (float): Seconds a result stays valid.
+    max_entries (int): The maximum number of cached queries.
+"""
+class SearchResultCache:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self)}
+
+"""
+Reusable client for the Bing Web Search API.
+A single requests.Session with a connection pool is shared by every call, so the TLS connection is reused
+between agent turns, and every request has explicit connect and read timeouts so a stalled endpoint cannot
+block a turn. Results are cached by normalized query.
+Args:
+    api_key (str): The Bing Search API key.
+    endpoint (str): The URL of the search endpoint (a local fake endpoint can be used for testing).
+    connect_timeout (float): Seconds to wait for the connection. Defaults to 3.
+    read_timeout (float): Seconds to wait for the answer. Defaults to 10.
+    cache (SearchResultCache, optional): The result cache. Results are not cached if it is None.
+    pool_size (int): The maximum number of pooled connections. Defaults to 4.
+"""
+class BingSearchClient:
+    def __init__(self, api_key, endpoint="https://api.bing.microsoft.com/v7.0/search", connect_timeout=3.0,
+                 read_timeout=10.0, cache=None, pool_size=4):
+        self.endpoint = endpoint
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache = cache
+
+        self.session = requests.Session()
+        self.session.headers.update({"Ocp-Apim-Subscription-Key": api_key or ""})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    """
+    Searches the web and returns the top results.
+    Args:
+        query (str): The search query string.
+        count (int): The number of results to return. Defaults to 1.
+    Returns:
+        list of dict: 'name', 'url' and 'snippet' of each result, in ranking order (empty if there are none).
+    Raises:
+        requests.exceptions.HTTPError: If the HTTP request returned an unsuccessful status code.
+        requests.exceptions.Timeout: If the endpoint does not answer within the timeouts.
+    """
+    def search(self, query, count=1):
+        key = (normalize_query(query), count)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        response = self.session.get(self.endpoint, params={"q": query, "count": count}, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+
+        results = [
+            {"name": page.get("name", ""), "url": page.get("url", ""), "snippet": page.get("snippet", "no snippet")}
+            for page in data.get("webPages", {}).get("value", [])[:count]
+        ]
+        if self.cache is not None:
+            self.cache.put(key, results)
+        return results
+
+    def close(self):
+        self.session.close()
+
+_bing_client = None
+_bing_client_lock = threading.Lock()
+
 """
-def search_for_data_in_bing(query):
-    "Search the Bing Web Search API and return de first result snippet."
-    headers = {"Ocp-Apim-Subscription-Key": bing_search_api_key}
-    params = {"q": query,"count": 1}
+Returns the process-wide BingSearchClient configured from the environment, creating it on first use.
+Returns:
+    BingSearchClient: The shared search client.
+"""
+def get_bing_client():
+    global _bing_client
+    with _bing_client_lock:
+        if _bing_client is None:
+            _bing_client = BingSearchClient(
+                api_key=bing_search_api_key,
+                endpoint=bing_search_endpoint,
+                connect_timeout=bing_connect_timeout,
+                read_timeout=bing_read_timeout,
+                cache=SearchResultCache(bing_cache_ttl, bing_cache_max_entries)
+            )
+        return _bing_client
 
-    response = requests.get("https://api.bing.microsoft.com/v7.0/search", headers=headers, params=params)  
-    response.raise_for_status()
-    data = response.json()
+"""
+Replaces the process-wide BingSearchClient, for example to point it to a local fake endpoint.
+Args:
+    client (BingSearchClient): The client to use from now on.
+"""
+def set_bing_client(client):
+    global _bing_client
+    with _bing_client_lock:
+        _bing_client = client
 
-    if "webPages" in data and "value" in data["webPages"] and len(data["webPages"]["value"]) > 0:
-        first_result = data["webPages"]["value"][0]
-        snippet = first_result.get("snippet","no snippet")
-        return snippet
+"""
+Searches for data using the Bing Search API and returns the snippets of the top results.
+Args:
+    query (str): The search query string.
+    count (int, optional): The number of snippets to return. Defaults to BING_RESULT_COUNT.
+Returns:
+    str: The snippets of the top results, one per line, if available, otherwise "No results found."
+Raises:
+    requests.exceptions.HTTPError: If the HTTP request returned an unsuccessful status code.
+    requests.exceptions.Timeout: If Bing does not answer within the timeouts.
+"""
+@traced("search_for_data_in_bing")
+def search_for_data_in_bing(query, count=None):
+    "Search the Bing Web Search API and return the top result snippets."
+    results = get_bing_client().search(query, count=count or bing_result_count)
+    if results:
+        return "\n".join(result["snippet"] for result in results)
     else:
         return "No results found."
\ No newline at end of file
@@ -0,0 +1,80 @@
+from config.env_loader import (
+    chunk_tokenizer_model,
+    chunk_max_tokens,
+    chunk_overlap_tokens
+)
+from tools.resources import get_tokenizer
+
+"""
+Splits the page records of one or more PDFs into fixed-size, token-bounded chunks with token-level overlap.
+Each page is tokenized exactly once; the windows are cut directly on the token array and every finished chunk
+is decoded once. Chunks never cross file boundaries (a change of 'source_index', when the pages have it, also
+starts a new file), and pages without words are skipped (as get_pages_and_texts does). It is a generator, so it can consume iter_pdf_pages while the extraction is still running.
+Args:
+    pages (iterable of dict): Page records with 'file_name', 'page_number', 'page_word_count' and 'text' keys.
+    tokenizer (tiktoken.Encoding, optional): The encoder. Defaults to the one of CHUNK_TOKENIZER_MODEL.
+    max_tokens (int, optional): The size of each chunk in tokens. Defaults to CHUNK_MAX_TOKENS.
+    overlap_tokens (int, optional): The tokens shared by consecutive chunks. Defaults to CHUNK_OVERLAP_TOKENS.
+Yields:
+    dict: A chunk with keys:
+        - file_name (str): The name of the PDF file.
+        - page_number (int): The page where the chunk starts.
+        - last_page_number (int): The page where the chunk ends.
+        - text (str): The decoded text of the chunk.
+        - token_size (int): The number of tokens of the chunk.
+"""
+def iter_token_chunks(pages, tokenizer=None, max_tokens=None, overlap_tokens=None):
+    tokenizer = tokenizer or get_tokenizer(chunk_tokenizer_model)
+    max_tokens = max_tokens or chunk_max_tokens
+    overlap_tokens = chunk_overlap_tokens if overlap_tokens is None else overlap_tokens
+    step = max_tokens - overlap_tokens
+    if step <= 0:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+
+    separator = tokenizer.encode(" ")
+    source = None
+    file_name = None
+    tokens = []
+    token_pages = []
+    emitted = False
+
+    def make_chunk(end):
+        return {
+            "file_name": file_name,
+            "page_number": token_pages[0],
+            "last_page_number": token_pages[end - 1],
+            "text": tokenizer.decode(tokens[:end]).strip(),
+            "token_size": end
+        }
+
+    for page in pages:
+        if page["page_word_count"] <= 0:
+            continue
+
+        # Dos PDF subidos con el mismo nombre se distinguen por su posición en la subida
+        if (page.get("source_index"), page["file_name"]) != source:
+            # El resto del fichero anterior solo se emite si no está ya contenido en el último bloque
+            if tokens and (not emitted or len(tokens) > overlap_tokens):
+                yield make_chunk(len(tokens))
+            source = (page.get("source_index"), page["file_name"])
+            file_name = page["file_name"]
+            tokens = []
+            token_pages = []
+            emitted = False
+
+        page_tokens = tokenizer.encode(page["text"])
+        if tokens:
+            tokens.extend(separator)
+            token_pages.extend([page["page_number"]] * len(separator))
+        tokens.extend(page_tokens)
+        token_pages.extend([page["page_number"]] * len(page_tokens))
+
+        # Se emiten las ventanas completas y se descarta lo que ya no forma parte del solapamiento
+        while len(tokens) >= max_tokens:
+            yield make_chunk(max_tokens)
+            del tokens[:step]
+            del token_pages[:step]
+            emitted = True
+
+    if tokens and (not emitted or len(tokens) > overlap_tokens):
+        yield make_chunk(len(tokens))
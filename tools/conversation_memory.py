@@ -0,0 +1,253 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms.llm import LLM
+from llama_index.core.memory.types import BaseMemory
+
+from config.env_loader import memory_token_budget, memory_summary_max_tokens, memory_tokenizer_model
+from tools.resources import get_tokenizer
+from tools.telemetry import increment, observe
+
+# Tokens que añade el formato de cada mensaje (rol y separadores) además de su contenido
+MESSAGE_OVERHEAD_TOKENS = 4
+# Al superar el presupuesto, los turnos recientes se reducen hasta esta fracción del espacio que tienen, para no
+# tener que resumir en todos los turnos siguientes
+COMPACTION_TARGET = 0.5
+# Encabezado del mensaje de sistema que lleva el resumen de la conversación
+SUMMARY_HEADER = "Resumen de la conversación anterior:"
+# Tokens que se conservan de cada salida de herramienta de los turnos anteriores al recortarlas (ver _compact)
+TOOL_OUTPUT_KEEP_TOKENS = 100
+TRIMMED_MARKER = " [...]"
+
+SUMMARY_PROMPT = (
+    "Resume la conversación entre un usuario y un asistente para que el asistente pueda continuarla. Conserva "
+    "los datos concretos (nombres, cifras, documentos, preferencias del usuario y preguntas pendientes) y omite "
+    "los saludos y las repeticiones. Escribe solo el resumen, en el idioma de la conversación y en menos de "
+    "{max_words} palabras."
+)
+
+def default_token_counter(text):
+    return len(get_tokenizer(memory_tokenizer_model).encode(text))
+
+"""
+Returns the approximate number of prompt tokens of a list of chat messages: their content, the arguments of their
+tool calls and a fixed overhead per message.
+Args:
+    messages (list of ChatMessage): The messages.
+    token_counter (callable, optional): A function returning the token count of a text. Defaults to the tiktoken
+                                        encoder of MEMORY_TOKENIZER_MODEL.
+Returns:
+    int: The token count.
+"""
+def count_message_tokens(messages, token_counter=None):
+    token_counter = token_counter or default_token_counter
+    total = 0
+    for message in messages:
+        total += MESSAGE_OVERHEAD_TOKENS + token_counter(str(message.content or ""))
+        for tool_call in message.additional_kwargs.get("tool_calls") or []:
+            function = getattr(tool_call, "function", None)
+            if function is not None:
+                total += token_counter(f"{function.name} {function.arguments}")
+    return total
+
+"""
+Splits a conversation into turns, each starting with a user message and followed by the tool calls, tool outputs
+and answers it produced. A turn is never split, so a tool output is never separated from its tool call.
+Args:
+    messages (list of ChatMessage): The messages, oldest first.
+Returns:
+    list of list of ChatMessage: The turns, oldest first.
+"""
+def split_turns(messages):
+    turns = []
+    for message in messages:
+        if message.role == MessageRole.USER or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+def _transcript(messages):
+    lines = []
+    for message in messages:
+        if message.content:
+            lines.append(f"{message.role.value}: {message.content}")
+        for tool_call in message.additional_kwargs.get("tool_calls") or []:
+            function = getattr(tool_call, "function", None)
+            if function is not None:
+                lines.append(f"{message.role.value}: llamada a {function.name}({function.arguments})")
+    return "\n".join(lines)
+
+"""
+Agent memory that keeps the conversation within a token budget. The recent turns are kept verbatim; when they
+exceed the budget, the tool outputs of the previous turns (document chunks or Bing results of up to
+CHUNK_MAX_TOKENS tokens each, already used by the answers that followed them) are cut to TOOL_OUTPUT_KEEP_TOKENS
+tokens first. Only if that is not enough, the oldest turns are folded into a running summary with one LLM call that
+only reads the previous summary and those turns, so the cost of a compaction does not grow with the length of the
+conversation. The summary is sent to the LLM as a system message before the recent turns.
+The agent stores each finished turn with set() from the thread that consumes its stream, after the answer has been
+sent, so compacting does not delay the answer; a lock makes the next turn wait for it.
+Args:
+    llm (LLM, optional): The model that writes the summaries. Without it the oldest turns are dropped.
+    token_limit (int): The maximum number of tokens of the history (summary plus recent turns). Defaults to
+                       MEMORY_TOKEN_BUDGET.
+    summary_max_tokens (int): The maximum number of tokens of the summary. Defaults to MEMORY_SUMMARY_MAX_TOKENS.
+    token_counter (callable, optional): A function returning the token count of a text. Defaults to the tiktoken
+                                        encoder of MEMORY_TOKENIZER_MODEL.
+"""
+class TokenBudgetMemory(BaseMemory):
+    llm: Optional[LLM] = Field(default=None, exclude=True)
+    token_limit: int = Field(default=memory_token_budget)
+    summary_max_tokens: int = Field(default=memory_summary_max_tokens)
+    token_counter: Optional[Callable[[str], int]] = Field(default=None, exclude=True)
+    summary: Optional[str] = Field(default=None)
+    messages: List[ChatMessage] = Field(default_factory=list)
+    summarized_turns: int = Field(default=0)
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+
+    @classmethod
+    def class_name(cls):
+        return "TokenBudgetMemory"
+
+    @classmethod
+    def from_defaults(cls, llm=None, chat_history=None, **kwargs):
+        memory = cls(llm=llm, **kwargs)
+        if chat_history:
+            memory.set(chat_history)
+        return memory
+
+    def count_tokens(self, messages):
+        return count_message_tokens(messages, self.token_counter)
+
+    def get(self, input=None, **kwargs):
+        with self._lock:
+            return self._summary_messages() + list(self.messages)
+
+    def get_all(self):
+        return self.get()
+
+    def put(self, message):
+        with self._lock:
+            self.messages.append(message)
+            # Solo se compacta con el turno completo (la respuesta final ya en memoria)
+            if message.role == MessageRole.ASSISTANT and not message.additional_kwargs.get("tool_calls"):
+                self._compact()
+
+    """
+    Replaces the history. The agent calls it at the end of every turn with get_all() plus the new messages, so a
+    leading summary message is recognized and not stored as a turn.
+    Args:
+        messages (list of ChatMessage): The history, oldest first.
+    """
+    def set(self, messages):
+        with self._lock:
+            messages = list(messages)
+            # El mensaje del resumen se reconoce por su contenido: additional_kwargs se envía tal cual a la API
+            summary_messages = self._summary_messages()
+            if summary_messages and messages and messages[0].role == MessageRole.SYSTEM \
+                    and messages[0].content == summary_messages[0].content:
+                messages.pop(0)
+            self.messages = messages
+            self._compact()
+
+    def reset(self):
+        with self._lock:
+            self.summary = None
+            self.messages = []
+            self.summarized_turns = 0
+
+    """
+    Returns the token count of the history the next turn will send (summary plus recent turns).
+    Returns:
+        int: The token count.
+    """
+    def token_count(self):
+        return self.count_tokens(self.get())
+
+    def _summary_messages(self):
+        if not self.summary:
+            return []
+        return [ChatMessage(role=MessageRole.SYSTEM, content=f"{SUMMARY_HEADER}\n{self.summary}")]
+
+    def _compact(self):
+        turns = split_turns(self.messages)
+        turn_tokens = [self.count_tokens(turn) for turn in turns]
+        summary_tokens = self.count_tokens(self._summary_messages())
+        if summary_tokens + sum(turn_tokens) <= self.token_limit:
+            return
+
+        # Antes de resumir se recortan las salidas de herramientas de los turnos anteriores: ocupan la mayor parte
+        # del historial y sus respuestas ya recogen lo que se usó de ellas
+        trimmed_turns = [[self._trim_tool_output(message) for message in turn] for turn in turns[:-1]] + turns[-1:]
+        trimmed_tokens = [self.count_tokens(turn) for turn in trimmed_turns]
+        if sum(trimmed_tokens) < sum(turn_tokens):
+            turns, turn_tokens = trimmed_turns, trimmed_tokens
+            self.messages = [message for turn in turns for message in turn]
+            increment("memory_tool_output_trim")
+            if summary_tokens + sum(turn_tokens) <= self.token_limit:
+                return
+
+        # Se sacan los turnos más antiguos hasta que los recientes ocupan COMPACTION_TARGET de su espacio; el último
+        # turno se conserva siempre completo
+        recent_budget = max(0, self.token_limit - self.summary_max_tokens) * COMPACTION_TARGET
+        evicted = 0
+        while evicted < len(turns) - 1 and sum(turn_tokens[evicted:]) > recent_budget:
+            evicted += 1
+        if evicted == 0:
+            return
+
+        old_messages = [message for turn in turns[:evicted] for message in turn]
+        self.messages = [message for turn in turns[evicted:] for message in turn]
+        self.summary = self._summarize(old_messages)
+        self.summarized_turns += evicted
+        increment("memory_compaction")
+
+    def _trim_tool_output(self, message):
+        if message.role != MessageRole.TOOL or not message.content:
+            return message
+        text = str(message.content)
+        counter = self.token_counter or default_token_counter
+        if text.endswith(TRIMMED_MARKER) or counter(text) <= TOOL_OUTPUT_KEEP_TOKENS:
+            return message
+        # El mensaje conserva su tool_call_id (en additional_kwargs) para seguir emparejado con su llamada
+        return ChatMessage(role=message.role, content=self._truncate(text, TOOL_OUTPUT_KEEP_TOKENS) + TRIMMED_MARKER,
+                           additional_kwargs=message.additional_kwargs)
+
+    def _summarize(self, old_messages):
+        if self.llm is None:
+            return self.summary
+        transcript = _transcript(old_messages)
+        if self.summary:
+            transcript = f"Resumen anterior:\n{self.summary}\n\nContinuación:\n{transcript}"
+        start = time.perf_counter()
+        try:
+            response = self.llm.chat([
+                ChatMessage(role=MessageRole.SYSTEM,
+                            content=SUMMARY_PROMPT.format(max_words=int(self.summary_max_tokens * 0.6))),
+                ChatMessage(role=MessageRole.USER, content=transcript)
+            ])
+        except Exception:
+            # Sin resumen nuevo se pierden los turnos sacados, pero la conversación sigue dentro del presupuesto
+            logging.warning("No se pudo resumir la conversación; se descartan los turnos antiguos", exc_info=True)
+            return self.summary
+        observe("memory_summary", time.perf_counter() - start)
+        return self._truncate(str(response.message.content or "").strip()) or self.summary
+
+    def _truncate(self, text, max_tokens=None):
+        # El resumen no puede superar su presupuesto aunque el LLM no respete el límite pedido
+        max_tokens = self.summary_max_tokens if max_tokens is None else max_tokens
+        counter = self.token_counter or default_token_counter
+        if counter(text) <= max_tokens:
+            return text
+        words = text.split()
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if counter(" ".join(words[:middle])) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return " ".join(words[:low])
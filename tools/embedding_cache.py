@@ -0,0 +1,143 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+"""
+Normalizes a text before hashing it, so that texts that only differ in whitespace share the same cache entry.
+Args:
+    text (str): The text to normalize.
+Returns:
+    str: The normalized text.
+"""
+def normalize_text(text):
+    return " ".join(text.split())
+
+"""
+Returns the content address of a text for a given embedding deployment.
+Args:
+    text (str): The input text.
+    deployment_name (str): The embeddings deployment that produced (or will produce) the vector.
+Returns:
+    str: The hex SHA-256 digest of the deployment name and the normalized text.
+"""
+def cache_key(text, deployment_name):
+    content = f"{deployment_name}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+"""
+Disk-backed, content-addressed cache of embeddings stored in SQLite.
+The database runs in WAL mode so several Streamlit worker processes can share the same file. Vectors are
+stored as float32 blobs. When the number of entries goes over max_entries, the least recently used entries
+are evicted. Hit and miss counters (and the tokens that did not have to be sent) are kept per process.
+Args:
+    path (str): The path of the SQLite file.
+    max_entries (int): The maximum number of cached embeddings.
+"""
+class EmbeddingCache:
+    def __init__(self, path, max_entries=200000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " tokens INTEGER NOT NULL DEFAULT 0,"
+            " last_access REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+
+    """
+    Looks up several keys at once and refreshes the access time of the ones found.
+    Args:
+        keys (list of str): The cache keys.
+    Returns:
+        dict: The embeddings found, as {key: list of float}.
+    """
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            # SQLite limita el número de parámetros por consulta, así que se consulta por tramos
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT key, vector, tokens FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, vector, tokens in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+                    self.saved_tokens += tokens
+                if rows:
+                    now = time.time()
+                    self._connection.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, row[0]) for row in rows]
+                    )
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    """
+    Stores several embeddings and evicts the least recently used entries if the cache is over its size cap.
+    Args:
+        items (list of tuple): (key, embedding, tokens) triples.
+    """
+    def put_many(self, items):
+        now = time.time()
+        rows = [(key, np.asarray(embedding, dtype=np.float32).tobytes(), tokens, now) for key, embedding, tokens in items]
+        if not rows:
+            return
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, tokens, last_access) VALUES (?, ?, ?, ?)", rows
+                )
+                excess = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    self._connection.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)", (excess,)
+                    )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    """
+    Returns the counters of this process.
+    Returns:
+        dict: hits, misses, hit_rate, saved_tokens and the current number of entries.
+    """
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_tokens": self.saved_tokens,
+            "entries": len(self)
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
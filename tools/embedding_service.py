@@ -0,0 +1,247 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config.env_loader import (
+    azure_openai_endpoint_embeding,
+    azure_openai_embeding_api_key,
+    azure_openai_embeding_deployment_name,
+    chunk_tokenizer_model,
+    embeddings_cache_path,
+    embeddings_cache_max_entries
+)
+from tools.embedding_cache import EmbeddingCache, cache_key
+from tools.resources import get_tokenizer, lazy_import
+from tools.telemetry import traced
+
+# El cliente de OpenAI tarda en importarse: se carga al crear el primer EmbeddingService
+httpx = lazy_import("httpx")
+openai = lazy_import("openai")
+
+# Límites por petición del endpoint de embeddings de Azure OpenAI
+MAX_TOKENS_PER_REQUEST = 8000
+MAX_ITEMS_PER_REQUEST = 2048
+
+"""
+Reusable client for the Azure OpenAI embeddings endpoint.
+A single openai.AzureOpenAI client backed by a pooled httpx.Client is shared by every call, so the TLS
+connections are reused. Batches of texts are packed into requests that respect the per-request token and
+item limits, sent concurrently by a pool of threads kept for the life of the service (a single request is sent
+from the calling thread), and retried with exponential backoff when the service answers 429.
+Args:
+    azure_endpoint (str): The URL of the embeddings endpoint (a local fake endpoint can be used for testing).
+    api_key (str): The API key of the endpoint.
+    deployment_name (str): The embeddings deployment name.
+    api_version (str): The API version. Defaults to "2024-05-01-preview".
+    max_tokens_per_request (int): The maximum number of tokens packed into a single request.
+    max_items_per_request (int): The maximum number of texts packed into a single request.
+    max_in_flight (int): The maximum number of concurrent requests. Defaults to 4.
+    max_retries (int): The number of retries after a 429 answer. Defaults to 5.
+    backoff_base (float): The initial backoff in seconds, doubled on every retry. Defaults to 1.0.
+    token_counter (callable, optional): A function returning the token count of a text. Defaults to the shared
+                                        tokenizer of CHUNK_TOKENIZER_MODEL (see resources.get_tokenizer), the one
+                                        the chunker counts with.
+    cache (EmbeddingCache, optional): A persistent cache consulted before calling the endpoint.
+"""
+class EmbeddingService:
+    def __init__(self, azure_endpoint, api_key, deployment_name, api_version="2024-05-01-preview",
+                 max_tokens_per_request=MAX_TOKENS_PER_REQUEST, max_items_per_request=MAX_ITEMS_PER_REQUEST,
+                 max_in_flight=4, max_retries=5, backoff_base=1.0, token_counter=None, cache=None):
+        self.deployment_name = deployment_name
+        self.cache = cache
+        self.max_tokens_per_request = max_tokens_per_request
+        self.max_items_per_request = max_items_per_request
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._token_counter = token_counter
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        # Pool de conexiones compartido por todas las peticiones (una conexión por petición en vuelo)
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+            timeout=httpx.Timeout(60.0, connect=10.0)
+        )
+        # Los reintentos los gestionamos nosotros para poder aplicar el backoff a cada lote
+        self.client = openai.AzureOpenAI(
+            azure_endpoint=azure_endpoint,
+            api_key=api_key,
+            api_version=api_version,
+            max_retries=0,
+            http_client=self.http_client
+        )
+
+    def count_tokens(self, text):
+        if self._token_counter is None:
+            tokenizer = get_tokenizer(chunk_tokenizer_model)
+            self._token_counter = lambda value: len(tokenizer.encode(value))
+        return self._token_counter(text)
+
+    """
+    Packs the texts into batches that respect the per-request token and item limits, keeping the input order.
+    A text longer than the token limit is sent alone.
+    Args:
+        texts (list of str): The texts to pack.
+        token_counts (list of int, optional): The token count of each text, if already known.
+    Returns:
+        list of list of int: The indices of the texts of each batch.
+    """
+    def pack_batches(self, texts, token_counts=None):
+        if token_counts is None:
+            token_counts = [self.count_tokens(text) for text in texts]
+        batches = []
+        current_batch = []
+        current_tokens = 0
+
+        for i, tokens in enumerate(token_counts):
+            if current_batch and (current_tokens + tokens > self.max_tokens_per_request
+                                  or len(current_batch) >= self.max_items_per_request):
+                batches.append(current_batch)
+                current_batch = []
+                current_tokens = 0
+            current_batch.append(i)
+            current_tokens += tokens
+
+        if current_batch:
+            batches.append(current_batch)
+
+        return batches
+
+    def _retry_delay(self, error, attempt):
+        retry_after = None
+        if getattr(error, "response", None) is not None:
+            retry_after = error.response.headers.get("retry-after")
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            return self.backoff_base * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    def _send(self, batch_texts):
+        attempt = 0
+        while True:
+            try:
+                response = self.client.embeddings.create(input=batch_texts, model=self.deployment_name)
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except openai.RateLimitError as error:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(error, attempt))
+                attempt += 1
+
+    """
+    Calculates the embeddings of a single text.
+    Args:
+        text (str): The input text.
+    Returns:
+        list: The embeddings for the input text.
+    """
+    def embed(self, text):
+        return self.embed_batch([text])[0]
+
+    """
+    Calculates the embeddings of many texts, sending the packed batches concurrently.
+    When a cache is configured only the texts that are not cached are sent, and each distinct text only once.
+    Args:
+        texts (list of str): The input texts.
+        token_counts (list of int, optional): The token count of each text, if already known (e.g. from the chunker).
+    Returns:
+        list of list: The embeddings of each text, in the same order as the input.
+    """
+    def embed_batch(self, texts, token_counts=None):
+        texts = list(texts)
+        if token_counts is None:
+            token_counts = [self.count_tokens(text) for text in texts]
+        if self.cache is None:
+            return self._embed_uncached(texts, list(token_counts))
+
+        keys = [cache_key(text, self.deployment_name) for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Solo se calculan los textos que no están en caché, una vez por cada clave distinta
+        pending = {}
+        for key, text, tokens in zip(keys, texts, token_counts):
+            if key not in found and key not in pending:
+                pending[key] = (text, tokens)
+        if pending:
+            pending_texts = [text for text, _ in pending.values()]
+            pending_tokens = [tokens for _, tokens in pending.values()]
+            new_embeddings = self._embed_uncached(pending_texts, pending_tokens)
+            self.cache.put_many(list(zip(pending.keys(), new_embeddings, pending_tokens)))
+            found.update(zip(pending.keys(), new_embeddings))
+
+        return [found[key] for key in keys]
+
+    def _embed_uncached(self, texts, token_counts):
+        batches = self.pack_batches(texts, token_counts)
+        if not batches:
+            return []
+        if len(batches) == 1:
+            # Una sola petición (p. ej. el embedding de una consulta) se envía desde el propio hilo
+            return self._send(texts)
+        embeddings = [None] * len(texts)
+
+        results = self._get_executor().map(lambda batch: self._send([texts[i] for i in batch]), batches)
+        for batch, batch_embeddings in zip(batches, results):
+            for i, embedding in zip(batch, batch_embeddings):
+                embeddings[i] = embedding
+
+        return embeddings
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="embeddings")
+            return self._executor
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self.http_client.close()
+        if self.cache is not None:
+            self.cache.close()
+
+_embedding_service = None
+_embedding_service_lock = threading.Lock()
+
+"""
+Returns the process-wide EmbeddingService configured from the environment, creating it on first use.
+Returns:
+    EmbeddingService: The shared embedding service.
+"""
+def get_embedding_service():
+    global _embedding_service
+    with _embedding_service_lock:
+        if _embedding_service is None:
+            _embedding_service = EmbeddingService(
+                azure_endpoint=azure_openai_endpoint_embeding,
+                api_key=azure_openai_embeding_api_key,
+                deployment_name=azure_openai_embeding_deployment_name,
+                cache=EmbeddingCache(embeddings_cache_path, max_entries=embeddings_cache_max_entries)
+            )
+        return _embedding_service
+
+"""
+Replaces the process-wide EmbeddingService, for example to point it to a local fake endpoint.
+Args:
+    service (EmbeddingService): The service to use from now on.
+"""
+def set_embedding_service(service):
+    global _embedding_service
+    with _embedding_service_lock:
+        _embedding_service = service
+
+"""
+Calculates the embeddings of many texts with the shared embedding service.
+Args:
+    texts (list of str): The input texts.
+    token_counts (list of int, optional): The token count of each text, if already known.
+Returns:
+    list of list: The embeddings of each text, in the same order as the input.
+"""
+@traced("calculate_embeddings_batch")
+def calculate_embeddings_batch(texts, token_counts=None):
+    return get_embedding_service().embed_batch(texts, token_counts)
@@ -1,5 +1,16 @@
-import fitz  # PyMuPDF
-import tiktoken
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from tools.resources import get_tokenizer, lazy_import
+from tools.telemetry import traced
+
+fitz = lazy_import("fitz")  # PyMuPDF
+
+# Por debajo de este número de páginas no compensa arrancar un pool de procesos
+MIN_PAGES_FOR_PROCESS_POOL = 64
+# Páginas que extrae como mínimo cada tarea del pool
+PAGES_PER_TASK = 16
 """
 Formats the given text by replacing newline characters with spaces and stripping leading/trailing whitespace.
 Args:
@@ -12,6 +23,8 @@ pass
 Opens a PDF file, reads its content, and extracts text from each page. The text is then tokenized and word count is calculated.
 Args:
     pdf_path (str): The path to the PDF file.
+    pdf_bytes (bytes, optional): The content of the PDF. When given, the PDF is opened from memory and pdf_path is
+                                 only used as the file name of the records.
 Returns:
     list: A list of dictionaries, each containing information about a page in the PDF, including:
         - file_name (str): The name of the PDF file.
@@ -35,29 +48,113 @@ def text_formatter(text: str) -> str:
 
     return cleaned_text
 
-def open_and_read_pdf(pdf_path: str):
-    doc = fitz.open(pdf_path)
-    pages_and_texts = []
+@traced("open_and_read_pdf")
+def open_and_read_pdf(pdf_path: str, pdf_bytes: bytes = None):
+    doc = open_pdf_document(pdf_path, pdf_bytes)
+    pages_and_texts = read_pdf_pages(doc, pdf_path, 0, doc.page_count, tokenizer=get_tokenizer())
+    doc.close()
+
+    return pages_and_texts
 
-    tokenizer = tiktoken.encoding_for_model("gpt-4o")
+def open_pdf_document(pdf_path: str, pdf_bytes: bytes = None):
+    if pdf_bytes is not None:
+        return fitz.open(stream=pdf_bytes, filetype="pdf")
+    return fitz.open(pdf_path)
+
+"""
+Extracts the page records of a range of pages of an open document.
+Args:
+    doc (fitz.Document): The open PDF document.
+    file_name (str): The name stored in the records.
+    start (int): The first page (inclusive).
+    end (int): The last page (exclusive).
+    tokenizer (tiktoken.Encoding, optional): When given, the token count of each page is stored in 'page_token_cont'.
+                                             The streaming pipeline leaves it to the chunker, which tokenizes each
+                                             page only once.
+Returns:
+    list: The page records, with the same keys as open_and_read_pdf ('page_token_cont' only with a tokenizer).
+"""
+def read_pdf_pages(doc, file_name: str, start: int, end: int, tokenizer=None):
+    pages_and_texts = []
 
-    for page_number, page in enumerate(doc):
-        text = page.get_text()
+    for page_number in range(start, end):
+        text = doc.load_page(page_number).get_text()
         text = text_formatter(text)
 
-        tokens = tokenizer.encode(text)
         word_count = len(text.split())
 
-        pages_and_texts.append({
-            "file_name": pdf_path,
+        page = {
+            "file_name": file_name,
             "page_number": page_number,
             "page_word_count": word_count,
-            "page_token_cont": len(tokens),
             "text": text
-        })
+        }
+        if tokenizer is not None:
+            page["page_token_cont"] = len(tokenizer.encode(text))
+        pages_and_texts.append(page)
 
     return pages_and_texts
 
+def _extract_page_range(task):
+    file_name, pdf_bytes, start, end = task
+    with open_pdf_document(file_name, pdf_bytes) as doc:
+        return read_pdf_pages(doc, file_name, start, end)
+
+def _page_ranges(page_count, pages_per_task, max_workers):
+    # Cada tarea lleva los bytes de su PDF: un documento se reparte como mucho en max_workers tramos, para no
+    # enviarlo a los procesos más veces de las necesarias
+    pages = max(pages_per_task, math.ceil(page_count / max_workers))
+    return [(start, min(start + pages, page_count)) for start in range(0, page_count, pages)]
+
+"""
+Extracts the pages of several PDFs held in memory and yields the page records as soon as they are ready, in
+document and page order, so the following stages can start before the extraction finishes.
+Large uploads (many pages or many files) are split into page ranges extracted by a process pool; small ones
+are extracted in the current process. Each task of the pool carries only the bytes of its own PDF, and a PDF is
+split into at most max_workers ranges, so it is not sent to the processes more times than there are processes.
+Args:
+    sources (list of tuple): (file_name, pdf_bytes) pairs, e.g. from Streamlit's uploaded files.
+    max_workers (int, optional): The number of processes of the pool. Defaults to the number of CPUs.
+    pages_per_task (int): The minimum number of pages extracted by each task of the pool. Defaults to PAGES_PER_TASK.
+    min_pages_for_pool (int): The minimum total number of pages to use the pool. Defaults to MIN_PAGES_FOR_PROCESS_POOL.
+Yields:
+    dict: The page records, with the same keys as open_and_read_pdf except 'page_token_cont' (see iter_token_chunks),
+          plus the 'source_index' of their PDF in sources (two uploads may have the same file name).
+"""
+def iter_pdf_pages(sources, max_workers=None, pages_per_task=PAGES_PER_TASK,
+                   min_pages_for_pool=MIN_PAGES_FOR_PROCESS_POOL):
+    sources = list(sources)
+    page_counts = []
+    for file_name, pdf_bytes in sources:
+        with open_pdf_document(file_name, pdf_bytes) as doc:
+            page_counts.append(doc.page_count)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or sum(page_counts) < min_pages_for_pool:
+        for source_index, ((file_name, pdf_bytes), page_count) in enumerate(zip(sources, page_counts)):
+            with open_pdf_document(file_name, pdf_bytes) as doc:
+                # Se extrae por tramos para ir entregando páginas mientras se procesa el resto
+                for start in range(0, page_count, pages_per_task):
+                    pages = read_pdf_pages(doc, file_name, start, min(start + pages_per_task, page_count))
+                    yield from _with_source_index(pages, source_index)
+        return
+
+    task_sources = []
+    tasks = []
+    for source_index, ((file_name, pdf_bytes), page_count) in enumerate(zip(sources, page_counts)):
+        for start, end in _page_ranges(page_count, pages_per_task, max_workers):
+            task_sources.append(source_index)
+            tasks.append((file_name, pdf_bytes, start, end))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map devuelve los resultados en orden, a medida que van terminando las tareas
+        for source_index, pages in zip(task_sources, executor.map(_extract_page_range, tasks)):
+            yield from _with_source_index(pages, source_index)
+
+def _with_source_index(pages, source_index):
+    for page in pages:
+        page["source_index"] = source_index
+    return pages
+
 def get_pages_and_texts(pages_and_texts_sublist):
     pages_and_texts = [page for page in pages_and_texts_sublist if page["page_word_count"] > 0]
 
@@ -79,21 +176,25 @@ Returns:
 """
 def concatenate_documents(docs, max_tokens):
     concatenated_docs = []
-    current_group = {"file_name": "", "text": "", "token_size": 0}
+    # Los textos de cada grupo se acumulan en una lista y se unen una sola vez al cerrar el grupo
+    current_group = {"file_name": "", "texts": [], "token_size": 0}
+
+    def close_group(group):
+        return {"file_name": group["file_name"], "text": "".join(group["texts"]), "token_size": group["token_size"]}
 
     for doc in docs:
         if current_group["file_name"] != doc["file_name"]:
             if current_group["token_size"] > 0:
-                concatenated_docs.append(current_group)
-            current_group = {"file_name": doc["file_name"], "text": doc["text"], "token_size": doc["token_size"]}
+                concatenated_docs.append(close_group(current_group))
+            current_group = {"file_name": doc["file_name"], "texts": [doc["text"]], "token_size": doc["token_size"]}
         elif current_group["token_size"] + doc["token_size"] <= max_tokens:
-            current_group["text"] += (" " + doc["text"]).strip()
+            current_group["texts"].append((" " + doc["text"]).strip())
             current_group["token_size"] += doc["token_size"]
         else:
-            concatenated_docs.append(current_group)
-            current_group = {"file_name": doc["file_name"], "text": doc["text"], "token_size": doc["token_size"]}
+            concatenated_docs.append(close_group(current_group))
+            current_group = {"file_name": doc["file_name"], "texts": [doc["text"]], "token_size": doc["token_size"]}
 
     if current_group["token_size"] > 0:
-        concatenated_docs.append(current_group)
+        concatenated_docs.append(close_group(current_group))
     
     return concatenated_docs
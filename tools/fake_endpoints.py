@@ -0,0 +1,225 @@
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+"""
+Local stand-ins for the external services used by the project, so the tools can be exercised offline.
+The embeddings endpoint answers like Azure OpenAI (POST /openai/deployments/<name>/embeddings) with
+deterministic vectors derived from a hash of each input text.
+The chat endpoint (POST /openai/deployments/<name>/chat/completions) behaves like a minimal function-calling
+model: when tools are offered and the last message comes from the user it calls the first tool with the user
+message as 'query'; otherwise it answers with a short text built from the last tool output. It supports
+streaming (server-sent events) like the real service.
+The search endpoint answers like the Bing Web Search API (GET /v7.0/search?q=...&count=N) with N results whose
+snippets mention the query.
+WordTokenizer stands in for the tiktoken encodings, which are downloaded on first use.
+
+Example:
+    server, url = start_fake_server(latency=0.05)
+    service = EmbeddingService(azure_endpoint=url, api_key="fake", deployment_name="fake-embeddings")
+    ...
+    server.shutdown()
+"""
+
+"""
+Returns a deterministic unit-length vector for the given text.
+Args:
+    text (str): The input text.
+    dimensions (int): The size of the vector. Defaults to 256.
+Returns:
+    list: The fake embedding.
+"""
+def fake_embedding(text, dimensions=256):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente cerró la conexión antes de la respuesta, por ejemplo al vencer su timeout
+            pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _rate_limited(self):
+        # Cada rate_limit_every peticiones se devuelve un 429 para ejercitar los reintentos
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            count = server.request_count
+        if server.rate_limit_every and count % server.rate_limit_every == 0:
+            self._send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                            headers={"retry-after": "0"})
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        time.sleep(self.server.latency)
+        if self._rate_limited():
+            return
+
+        if url.path.endswith("/search"):
+            params = parse_qs(url.query)
+            query = params.get("q", [""])[0]
+            count = int(params.get("count", ["10"])[0])
+            pages = [
+                {"name": f"Resultado {i + 1}: {query}", "url": f"https://example.com/{i + 1}",
+                 "snippet": f"Fragmento {i + 1} sobre {query}."}
+                for i in range(count)
+            ]
+            self._send_json(200, {"_type": "SearchResponse", "webPages": {"value": pages}})
+        else:
+            self._send_json(404, {"error": {"code": "404", "message": f"Unknown path {url.path}"}})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        time.sleep(self.server.latency)
+        if self._rate_limited():
+            return
+
+        if path.endswith("/embeddings"):
+            payload = self._read_json()
+            inputs = payload.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            data = [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text, self.server.dimensions)}
+                for i, text in enumerate(inputs)
+            ]
+            tokens = sum(len(text.split()) for text in inputs)
+            self._send_json(200, {
+                "object": "list",
+                "data": data,
+                "model": payload.get("model", "fake-embeddings"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+            })
+        elif path.endswith("/chat/completions"):
+            self._chat_completion(self._read_json())
+        else:
+            self._send_json(404, {"error": {"code": "404", "message": f"Unknown path {path}"}})
+
+    def _chat_completion(self, payload):
+        messages = payload.get("messages", [])
+        tools = payload.get("tools") or []
+        last_message = messages[-1] if messages else {"role": "user", "content": ""}
+        created = int(time.time())
+        model = payload.get("model", "fake-chat")
+
+        tool_calls = None
+        content = None
+        if tools and last_message.get("role") == "user":
+            tool_calls = [{
+                "id": f"call_{created}_{len(messages)}",
+                "type": "function",
+                "function": {"name": tools[0]["function"]["name"],
+                             "arguments": json.dumps({"query": last_message.get("content") or ""})}
+            }]
+        else:
+            tool_output = next((message.get("content") for message in reversed(messages)
+                                if message.get("role") == "tool"), None)
+            content = f"Según la información encontrada: {tool_output[:200]}" if tool_output else "No tengo información."
+
+        if not payload.get("stream"):
+            message = {"role": "assistant", "content": content}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            self._send_json(200, {
+                "id": f"chatcmpl-{created}", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            })
+            return
+
+        # Respuesta en streaming: un evento por palabra (o uno para la llamada a la herramienta)
+        if tool_calls:
+            deltas = [{"role": "assistant", "content": None,
+                       "tool_calls": [{"index": 0, **tool_calls[0]}]}]
+        else:
+            words = content.split(" ")
+            deltas = [{"role": "assistant", "content": ""}] + [
+                {"content": word if i == 0 else " " + word} for i, word in enumerate(words)
+            ]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for i, delta in enumerate(deltas + [{}]):
+            finish_reason = None if i < len(deltas) else ("tool_calls" if tool_calls else "stop")
+            chunk = {"id": f"chatcmpl-{created}", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if i > 0:
+                time.sleep(self.server.token_latency)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+"""
+Word-level tokenizer with the encode/decode interface of tiktoken, for machines without the tiktoken encodings
+(they are downloaded on first use). Token counts differ from the real ones, so only compare runs that use the same
+tokenizer.
+"""
+class WordTokenizer:
+    def __init__(self):
+        self.vocabulary = {}
+        self.words = []
+
+    def encode(self, text):
+        tokens = []
+        for word in text.split():
+            if word not in self.vocabulary:
+                self.vocabulary[word] = len(self.words)
+                self.words.append(word)
+            tokens.append(self.vocabulary[word])
+        return tokens
+
+    def decode(self, tokens):
+        return " ".join(self.words[token] for token in tokens)
+
+"""
+Starts the fake services in a background thread.
+Args:
+    port (int): The port to listen on. Defaults to 0 (a free port is chosen).
+    latency (float): Seconds to wait before answering each request. Defaults to 0.
+    dimensions (int): The size of the fake embeddings. Defaults to 256.
+    rate_limit_every (int): Answer 429 every N requests (0 disables it). Defaults to 0.
+    token_latency (float): Seconds between streamed chat tokens. Defaults to 0.
+Returns:
+    tuple: The ThreadingHTTPServer instance and its base URL.
+"""
+def start_fake_server(port=0, latency=0.0, dimensions=256, rate_limit_every=0, token_latency=0.0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeServiceHandler)
+    server.latency = latency
+    server.token_latency = token_latency
+    server.dimensions = dimensions
+    server.rate_limit_every = rate_limit_every
+    server.request_count = 0
+    server.lock = threading.Lock()
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
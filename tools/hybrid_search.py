@@ -0,0 +1,84 @@
+from config.env_loader import lexical_fast_path_max_terms, lexical_fast_path_min_margin, lexical_fast_path_min_score
+from tools.lexical_index import bm25_search, lexical_confidence, tokenize_terms
+from tools.vector_index import normalize_vectors
+
+# Constante de la fusión por rango recíproco (RRF): atenúa la diferencia entre los primeros puestos de cada ranking
+RRF_K = 60
+
+# Parte del peso IDF de la consulta que debe estar en el mejor bloque para responder solo con la búsqueda léxica
+FAST_PATH_MIN_COVERAGE = 0.95
+
+"""
+Searches the lexical index of an index, leaving out its deleted rows.
+Args:
+    index (VectorIndex): The index.
+    query (str): The query text.
+    k (int): The number of results.
+Returns:
+    list of tuple: (row, bm25 score) pairs sorted by score in descending order.
+"""
+def lexical_search(index, query, k):
+    return bm25_search(index.lexical_index(), query, k, excluded=index.deleted if index.deleted.any() else None)
+
+"""
+Fuses the vector and the lexical (BM25) rankings with reciprocal rank fusion. Exact keyword matches that the
+embeddings rank low (codes, names, references) move up, and the returned score is still the cosine similarity
+of each row, so the relevance threshold of custom_agent_worker keeps its meaning.
+Args:
+    index (VectorIndex): The index.
+    query (str): The query text.
+    query_embedding (list or numpy.ndarray): The embedding of the query.
+    k (int): The number of results. Defaults to 1.
+    candidates (int, optional): The depth of each ranking. Defaults to max(4 * k, 20).
+Returns:
+    list of tuple: (text, similarity) pairs in fused order.
+"""
+def hybrid_search(index, query, query_embedding, k=1, candidates=None):
+    candidates = candidates or max(4 * k, 20)
+    query_embedding = normalize_vectors(query_embedding)
+    # Las filas de ambos rankings deben ser las mismas: el índice no se compacta mientras tanto
+    with index.locked():
+        vector_results = index.search_rows(query_embedding, candidates)
+        lexical_results = lexical_search(index, query, candidates)
+
+        fused = {}
+        for results in (vector_results, lexical_results):
+            for rank, (row, _) in enumerate(results):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (RRF_K + rank + 1)
+        best = sorted(fused, key=fused.get, reverse=True)[:k]
+
+        similarities = dict(vector_results)
+        results = []
+        for row in best:
+            # Los bloques que solo encontró la búsqueda léxica se puntúan con su vector
+            similarity = similarities.get(row)
+            if similarity is None:
+                similarity = float(index.row_vector(row) @ query_embedding)
+            results.append((index.texts[row], similarity))
+        return results
+
+"""
+Answers a keyword-like query with the best rows of the lexical index alone, without embedding the query, when the
+match is clear: the query has at most LEXICAL_FAST_PATH_MAX_TERMS terms, the best row contains (nearly) all of
+their IDF weight, its score is at least LEXICAL_FAST_PATH_MIN_SCORE and at least LEXICAL_FAST_PATH_MIN_MARGIN times
+the score of the second one (a single matching row is not enough: its margin means nothing). The minimum score is
+the relevance threshold of these answers: BM25 scores are not similarities, so the cosine threshold of
+custom_agent_worker does not apply to them.
+Args:
+    index (VectorIndex): The index, or None.
+    query (str): The query text.
+    k (int): The number of results. Defaults to 1.
+Returns:
+    list of tuple: (text, bm25 score) pairs, or None if the lexical match is not confident enough.
+"""
+def lexical_fast_path(index, query, k=1):
+    if index is None or not 0 < len(tokenize_terms(query)) <= lexical_fast_path_max_terms:
+        return None
+    with index.locked():
+        results = lexical_search(index, query, max(k, 2))
+        if len(results) < 2 or results[0][1] < lexical_fast_path_min_score:
+            return None
+        coverage, margin = lexical_confidence(index.lexical_index(), query, results)
+        if coverage < FAST_PATH_MIN_COVERAGE or margin < lexical_fast_path_min_margin:
+            return None
+        return [(index.texts[row], score) for row, score in results[:k]]
@@ -0,0 +1,646 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config.env_loader import (ann_min_rows, index_memory_budget_mb, index_session_ttl, index_spill_dir,
+                               ivf_n_lists, ivf_n_probe, vector_index_backend)
+from tools.embedding_service import calculate_embeddings_batch
+from tools.ingestion import chunks_to_entries, file_hash, iter_document_chunks, save_documents
+from tools.ivf_index import IVFIndex, default_n_lists, load_index
+from tools.lexical_index import BM25Index
+from tools.search_embedding import build_vector_index, find_most_similar, uses_lexical_index
+from tools.vector_index import VectorIndex, normalize_vectors
+
+# Centroides IVF de una sesión guardada, para no volver a entrenarlos al reabrirla
+CENTROIDS_FILE_NAME = "centroids.npy"
+
+"""
+Returns the key that identifies a document across sessions: its content hash, or, for the entries of indexes
+saved before the documents were hashed, a hash of the texts of its chunks.
+Args:
+    metadata (list of dict): The metadata of the rows of the document.
+    texts (list of str): The texts of the rows of the document.
+Returns:
+    str: The document key.
+"""
+def document_key(metadata, texts):
+    if metadata and metadata[0].get("file_hash"):
+        return metadata[0]["file_hash"]
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+"""
+Gives a document key to the rows of an index saved before the documents were hashed (rows without 'file_hash'),
+grouping them by file name, so every row belongs to a document that can be listed, shared and removed.
+Args:
+    index (VectorIndex): The index. Its metadata is updated in place.
+"""
+def assign_document_keys(index):
+    groups = OrderedDict()
+    for row, entry in enumerate(index.metadata):
+        if not entry.get("file_hash"):
+            groups.setdefault(entry.get("file_name"), []).append(row)
+    for rows in groups.values():
+        key = document_key([], [index.texts[row] for row in rows])
+        for row in rows:
+            index.metadata[row] = {**index.metadata[row], "file_hash": key}
+
+def _freeze(index):
+    # Los bloques se comparten entre sesiones: sus matrices son de solo lectura (una vista de un memmap ya lo es)
+    for array in (index.matrix, getattr(index, "codes", None), getattr(index, "scales", None)):
+        if array is not None and array.flags.writeable:
+            array.setflags(write=False)
+    return index
+
+"""
+Builds the read-only index of one document (exact or quantized, see build_vector_index; never IVF, which applies
+to the session as a whole, see SessionIndex).
+Args:
+    index (VectorIndex): The rows of the document.
+Returns:
+    VectorIndex: The index of the document, shared by every session that has it.
+"""
+def build_document_index(index):
+    return _freeze(build_vector_index(index, approximate=False))
+
+def _document_nbytes(index):
+    # Los embeddings según el tipo de índice (nada si están mapeados desde disco) y los textos
+    return index.memory_usage() + sum(len(text) for text in index.texts)
+
+"""
+Splits an index into one read-only index per document (rows grouped by document key, in order of appearance).
+The rows of a document that are contiguous in the matrix are taken as a view, so splitting an index opened with
+mmap does not copy its embeddings.
+Args:
+    index (VectorIndex): The index to split, with a document key in every row (see assign_document_keys). Its
+                         deleted rows are left out.
+Returns:
+    list of tuple: (key, file_name, rows, VectorIndex) for each document, rows being its rows in the index.
+"""
+def split_by_document(index):
+    groups = OrderedDict()
+    for row in np.flatnonzero(~index.deleted):
+        groups.setdefault(index.metadata[row]["file_hash"], []).append(row)
+
+    documents = []
+    for key, rows in groups.items():
+        rows = np.asarray(rows)
+        if rows[-1] - rows[0] + 1 == len(rows):
+            matrix = index.matrix[rows[0]:rows[-1] + 1]
+        else:
+            matrix = np.ascontiguousarray(index.matrix[rows])
+        texts = [index.texts[row] for row in rows]
+        metadata = [index.metadata[row] for row in rows]
+        document = build_document_index(VectorIndex(matrix, texts, metadata, normalized=True))
+        documents.append((key, metadata[0].get("file_name"), rows, document))
+    return documents
+
+def _uses_ivf(rows):
+    # En el registro IVF solo se usa con colecciones grandes: necesita su propia copia de las filas de la sesión
+    return vector_index_backend in ("ivf", "auto") and rows >= ann_min_rows
+
+def _build_ivf(blocks, centroids):
+    matrix = np.concatenate([np.asarray(block.matrix) for block in blocks])
+    n_lists = min(ivf_n_lists or default_n_lists(len(matrix)), len(matrix))
+    # Se reutilizan los centroides anteriores mientras el número de listas no se haya duplicado (ver IVFIndex.compact)
+    if centroids is not None and not n_lists // 2 < len(centroids) <= n_lists:
+        centroids = None
+    return IVFIndex(matrix, [text for block in blocks for text in block.texts],
+                    [entry for block in blocks for entry in block.metadata], normalized=True,
+                    n_lists=ivf_n_lists or None, n_probe=ivf_n_probe or None, centroids=centroids)
+
+"""
+Read-only index of the documents of a session, composed over their shared indexes (one block per document, see
+build_document_index) instead of copying them. It has the search interface of VectorIndex (search, search_rows,
+search_many, row_vector, lexical_index, locked), so it can be used with find_most_similar and hybrid_search.
+A query scores every block and merges their results. From ANN_MIN_ROWS rows on (VECTOR_INDEX_BACKEND ivf or auto)
+the session also keeps an IVFIndex over the rows of all its documents and searches it instead; the inverted lists
+need the rows grouped by cluster, so that index holds its own copy of them, and the rows of the view follow its
+order.
+Args:
+    blocks (list of VectorIndex): The indexes of the documents of the session, in order.
+    centroids (numpy.ndarray, optional): IVF centroids to reuse (from the previous index of the session or a saved
+                                         index) instead of training them again.
+"""
+class SessionIndex:
+    def __init__(self, blocks, centroids=None):
+        self.blocks = list(blocks)
+        self.offsets = np.cumsum([0] + [len(block) for block in self.blocks])
+        self.ivf = _build_ivf(self.blocks, centroids) if _uses_ivf(int(self.offsets[-1])) else None
+        if self.ivf is not None:
+            self.texts = self.ivf.texts
+            self.metadata = self.ivf.metadata
+        else:
+            self.texts = [text for block in self.blocks for text in block.texts]
+            self.metadata = [entry for block in self.blocks for entry in block.metadata]
+        # Las sesiones no borran filas: quitar un documento crea un índice nuevo
+        self.deleted = np.zeros(len(self.texts), dtype=bool)
+        self.lexical = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.texts)
+
+    """
+    Returns the memory used by the index of the session itself (its IVF copy and the lexical index). The blocks are
+    counted with their documents, once however many sessions share them.
+    Returns:
+        int: The number of bytes.
+    """
+    def memory_usage(self):
+        ivf_nbytes = self.ivf.memory_usage() + self.ivf.centroids.nbytes if self.ivf is not None else 0
+        return ivf_nbytes + (self.lexical.memory_usage() if self.lexical is not None else 0)
+
+    def search(self, query_embedding, k=1):
+        return [(self.texts[row], score) for row, score in self.search_rows(query_embedding, k)]
+
+    def search_rows(self, query_embedding, k=1):
+        query = normalize_vectors(query_embedding)
+        if self.ivf is not None:
+            return self.ivf.search_rows(query, k)
+        results = [(int(offset) + row, score) for block, offset in zip(self.blocks, self.offsets)
+                   for row, score in block.search_rows(query, k)]
+        return sorted(results, key=lambda result: result[1], reverse=True)[:k]
+
+    def search_many(self, query_embeddings, k=1):
+        queries = normalize_vectors(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        if self.ivf is not None:
+            return self.ivf.search_many(queries, k)
+        merged = [[] for _ in range(len(queries))]
+        for block in self.blocks:
+            for results, block_results in zip(merged, block.search_many(queries, k)):
+                results.extend(block_results)
+        return [sorted(results, key=lambda result: result[1], reverse=True)[:k] for results in merged]
+
+    def row_vector(self, row):
+        if self.ivf is not None:
+            return self.ivf.row_vector(row)
+        position = int(np.searchsorted(self.offsets, row, side="right")) - 1
+        return self.blocks[position].row_vector(row - int(self.offsets[position]))
+
+    def lexical_index(self):
+        with self._lock:
+            if self.lexical is None:
+                self.lexical = BM25Index(self.texts)
+            return self.lexical
+
+    def locked(self):
+        return self._lock
+
+class _Document:
+    def __init__(self, index):
+        self.index = index
+        self.chunks = len(index)
+        self.nbytes = _document_nbytes(index)
+        self.spill_path = None
+
+class _Session:
+    def __init__(self):
+        # Documentos de la sesión en orden (clave -> nombre con el que los subió la sesión)
+        self.documents = OrderedDict()
+        self.version = 0
+        self.index = None
+        self.index_version = -1
+        self.index_nbytes = 0
+        self.centroids = None
+        self.last_access = time.monotonic()
+
+"""
+Process-wide registry of the document indexes of every Streamlit session.
+- Each session has its own corpus, so one user's uploads never change another user's answers.
+- Documents are stored once, by content hash, as read-only blocks: every session that has a PDF (the same saved
+  index, or the same file uploaded by two users) shares its embeddings, and a PDF already loaded by another session
+  is not extracted or embedded again. The index of a session is composed over the blocks of its documents (see
+  SessionIndex).
+- The index of a session is built outside the registry lock and swapped in under it, so a large upload does not
+  block the searches of other sessions.
+- The memory used by the loaded documents and session indexes is bounded: when it goes over the budget, the least
+  recently used sessions are evicted. Their documents are written to the spill directory (unless another loaded
+  session uses them) and reopened with mmap the next time the session searches.
+- Sessions not used for session_ttl seconds are dropped, and the documents no other session uses are released,
+  with their spill files.
+It is thread-safe. Extraction and embedding run outside the lock too.
+Args:
+    memory_budget_bytes (int): The memory allowed for the loaded documents and session indexes. Defaults to
+                               INDEX_MEMORY_BUDGET_MB.
+    spill_dir (str): The directory the documents of evicted sessions are written to. Defaults to INDEX_SPILL_DIR.
+    session_ttl (float): The seconds without use after which a session is dropped (0 never drops them). Defaults
+                         to INDEX_SESSION_TTL.
+"""
+class IndexRegistry:
+    def __init__(self, memory_budget_bytes=None, spill_dir=None, session_ttl=None):
+        self.memory_budget_bytes = index_memory_budget_mb * 1024 * 1024 if memory_budget_bytes is None else memory_budget_bytes
+        self.spill_dir = spill_dir or index_spill_dir
+        self.session_ttl = index_session_ttl if session_ttl is None else session_ttl
+        self.documents = {}
+        self.sessions = OrderedDict()
+        # Disposición de lo guardado en cada directorio, para actualizarlo en el sitio al volver a guardar
+        self.saved_layouts = {}
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+
+    def _session(self, session_id):
+        session = self._touch(session_id)
+        if session is None:
+            session = self.sessions[session_id] = _Session()
+        return session
+
+    def _touch(self, session_id):
+        # Las sesiones quedan ordenadas por su último uso: las inactivas están al principio. Se descartan antes de
+        # actualizar el acceso, para que una sesión caducada no reviva al volver a usarla
+        self._drop_idle()
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.last_access = time.monotonic()
+            self.sessions.move_to_end(session_id)
+        return session
+
+    def _drop_idle(self):
+        if not self.session_ttl:
+            return
+        deadline = time.monotonic() - self.session_ttl
+        for session_id, session in list(self.sessions.items()):
+            if session.last_access > deadline:
+                break
+            self.drop_session(session_id)
+
+    def _share(self, key, index):
+        # Si otra sesión ya tiene el documento se reutiliza su bloque (o se recupera el recién construido si estaba
+        # volcado a disco)
+        document = self.documents.get(key)
+        if document is None:
+            document = self.documents[key] = _Document(index)
+        elif document.index is None:
+            document.index = index
+            document.nbytes = _document_nbytes(index)
+        return document
+
+    def _load(self, document):
+        if document.index is None:
+            document.index = build_document_index(load_index(document.spill_path))
+            document.nbytes = _document_nbytes(document.index)
+        return document.index
+
+    def _attach(self, session, key, file_name, summary):
+        # La versión anterior del documento (mismo nombre) se sustituye
+        old_key = next((other for other, name in session.documents.items() if name == file_name), None)
+        if old_key is not None:
+            del session.documents[old_key]
+        session.documents[key] = file_name
+        session.version += 1
+        summary["replaced" if old_key is not None else "added"].append(file_name)
+        if old_key is not None:
+            self._release([old_key])
+
+    def _release(self, keys):
+        # Los documentos que ya no usa ninguna sesión se olvidan, también en disco
+        for key in keys:
+            if any(key in session.documents for session in self.sessions.values()):
+                continue
+            document = self.documents.pop(key, None)
+            if document is not None and document.spill_path is not None:
+                shutil.rmtree(document.spill_path, ignore_errors=True)
+
+    def _refresh_index(self, session_id):
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            if not session.documents:
+                session.index = None
+                return None
+            if session.index is not None and session.index_version == session.version:
+                return session.index
+            version = session.version
+            keys = list(session.documents)
+            blocks = [self._load(self.documents[key]) for key in keys]
+            centroids = session.centroids
+
+        # El índice de la sesión (con su IVF y su índice léxico, si aplican) se construye fuera del cerrojo: las
+        # demás sesiones siguen consultando mientras tanto
+        index = SessionIndex(blocks, centroids)
+        if uses_lexical_index():
+            index.lexical_index()
+
+        with self._lock:
+            if self.sessions.get(session_id) is not session or session.version != version:
+                # La sesión cambió mientras tanto: el índice de la versión nueva lo monta quien la cambió
+                return index
+            # Los documentos volcados a disco entretanto vuelven a contar como cargados: el índice los usa
+            for key, block in zip(keys, blocks):
+                self._share(key, block)
+            session.index = index
+            session.index_version = version
+            # Con el índice léxico ya construido, su memoria cuenta para el presupuesto
+            session.index_nbytes = index.memory_usage()
+            if index.ivf is not None:
+                session.centroids = index.ivf.centroids
+            self._enforce_budget(session_id)
+            return index
+
+    def _loaded_elsewhere(self, key, excluded_session):
+        return any(session is not excluded_session and session.index is not None and key in session.documents
+                   for session in self.sessions.values())
+
+    def _evict(self, session):
+        session.index = None
+        for key in session.documents:
+            document = self.documents[key]
+            if document.index is None or self._loaded_elsewhere(key, session):
+                continue
+            if document.spill_path is None:
+                document.spill_path = os.path.join(self.spill_dir, key)
+                document.index.save(document.spill_path)
+            document.index = None
+
+    def _enforce_budget(self, keep_session_id):
+        for session_id, session in list(self.sessions.items()):
+            if self.memory_usage() <= self.memory_budget_bytes:
+                return
+            if session_id != keep_session_id:
+                self._evict(session)
+
+    """
+    Returns the memory used by the loaded documents (matrices read into memory plus texts) and session indexes
+    (their IVF copies and lexical indexes).
+    Returns:
+        int: The number of bytes.
+    """
+    def memory_usage(self):
+        with self._lock:
+            return (sum(document.nbytes for document in self.documents.values() if document.index is not None)
+                    + sum(session.index_nbytes for session in self.sessions.values() if session.index is not None))
+
+    """
+    Replaces the corpus of a session.
+    Args:
+        session_id (str): The session.
+        data (list of dict or VectorIndex): The entries (see tools.ingestion.chunks_to_entries) or an index, e.g.
+                                            one loaded from disk with load_index. The rows of each document that
+                                            are contiguous in the index are used as is (a memory-mapped matrix is
+                                            not copied), and the IVF centroids of the index are reused.
+    """
+    def set_documents(self, session_id, data):
+        index = data if isinstance(data, VectorIndex) else VectorIndex.from_entries(data)
+        assign_document_keys(index)
+        documents = split_by_document(index) if len(index) else []
+        centroids = index.centroids if isinstance(index, IVFIndex) else None
+        layouts = {}
+        for directory, saved_rows in index.saved_rows.items():
+            centroids_path = os.path.join(directory, CENTROIDS_FILE_NAME)
+            if centroids is None and os.path.isfile(centroids_path):
+                centroids = np.load(centroids_path)
+            # Un índice exacto abierto desde disco, con los bloques de cada documento seguidos, se amplía en el sitio
+            if type(index) is VectorIndex and saved_rows == len(index) and all(
+                    rows[-1] - rows[0] + 1 == len(rows) for _, _, rows, _ in documents):
+                layouts[directory] = {"documents": {key: (int(rows[0]), int(rows[-1]) + 1)
+                                                    for key, _, rows, _ in documents},
+                                      "rows": len(index), "deleted": np.flatnonzero(index.deleted).tolist()}
+
+        with self._lock:
+            session = self._session(session_id)
+            old_keys = set(session.documents)
+            session.documents = OrderedDict((key, file_name) for key, file_name, _, _ in documents)
+            for key, _, _, document in documents:
+                self._share(key, document)
+            session.version += 1
+            session.centroids = centroids
+            self._release(old_keys - set(session.documents))
+        with self._save_lock:
+            self.saved_layouts.update(layouts)
+        self._refresh_index(session_id)
+
+    """
+    Adds documents to the corpus of a session. Each document is searchable as soon as it is embedded, so the
+    session can be queried while the next files are still being processed.
+    - A PDF already in the session, or earlier in the same sources, is skipped.
+    - A PDF already loaded by another session is shared, without extracting or embedding it again.
+    - A PDF with the same file name as one of the session but different content replaces it, embedding only its
+      new or changed chunks.
+    Args:
+        session_id (str): The session.
+        sources (list of tuple): (file_name, pdf_bytes) pairs.
+        on_file (callable, optional): Called with the file name when a file starts being embedded.
+        on_stage (callable, optional): Called with the file name and its stage ('extract', 'chunk', 'embed',
+                                       'index' or 'done') as each file goes through the pipeline.
+        cancelled (callable, optional): Checked before each file is embedded; when it returns True the remaining
+                                        files are left out (the documents already added are kept).
+    Returns:
+        dict: The names of the added, replaced and unchanged files, and the number of embedded and reused chunks.
+    """
+    def add_documents(self, session_id, sources, on_file=None, on_stage=None, cancelled=None):
+        summary = {"added": [], "replaced": [], "unchanged": [], "embedded_chunks": 0, "reused_chunks": 0}
+        report = on_stage or (lambda file_name, stage: None)
+        pending_sources = []
+        pending_keys = set()
+        shared_files = []
+        with self._lock:
+            session = self._session(session_id)
+            for file_name, pdf_bytes in sources:
+                key = file_hash(pdf_bytes)
+                # El mismo PDF subido dos veces (aunque sea con otro nombre) se procesa una sola vez
+                if key in pending_keys or key in session.documents:
+                    summary["unchanged"].append(file_name)
+                elif key in self.documents:
+                    self._attach(session, key, file_name, summary)
+                    summary["reused_chunks"] += self.documents[key].chunks
+                    shared_files.append(file_name)
+                else:
+                    pending_sources.append((file_name, pdf_bytes))
+                    pending_keys.add(key)
+        if shared_files:
+            self._refresh_index(session_id)
+        for file_name in summary["unchanged"] + shared_files:
+            report(file_name, "done")
+
+        for file_name, chunks in iter_document_chunks(pending_sources, on_stage=on_stage):
+            if cancelled is not None and cancelled():
+                break
+            report(file_name, "embed")
+            if on_file is not None:
+                on_file(file_name)
+            # Vectores de los bloques sin cambios de la versión anterior del documento, si la hay
+            old_embeddings = self._chunk_embeddings(session_id, file_name)
+            new_chunks = [chunk for chunk in chunks if chunk["chunk_hash"] not in old_embeddings]
+            new_embeddings = iter(calculate_embeddings_batch([chunk['text'] for chunk in new_chunks],
+                                                             [chunk['token_size'] for chunk in new_chunks]))
+            embeddings = [old_embeddings[chunk["chunk_hash"]] if chunk["chunk_hash"] in old_embeddings
+                          else next(new_embeddings) for chunk in chunks]
+            summary["embedded_chunks"] += len(new_chunks)
+            summary["reused_chunks"] += len(chunks) - len(new_chunks)
+            report(file_name, "index")
+            if chunks:
+                document = build_document_index(VectorIndex.from_entries(chunks_to_entries(chunks, embeddings)))
+                with self._lock:
+                    self._share(chunks[0]["file_hash"], document)
+                    self._attach(self._session(session_id), chunks[0]["file_hash"], file_name, summary)
+                self._refresh_index(session_id)
+            report(file_name, "done")
+        return summary
+
+    def _chunk_embeddings(self, session_id, file_name):
+        with self._lock:
+            session = self._session(session_id)
+            key = next((key for key, name in session.documents.items() if name == file_name), None)
+            if key is None:
+                return {}
+            index = self._load(self.documents[key])
+        return {entry.get("chunk_hash"): np.array(index.row_vector(row)) for row, entry in enumerate(index.metadata)}
+
+    """
+    Removes a document from the corpus of a session (other sessions keep it).
+    Args:
+        session_id (str): The session.
+        document_hash (str): The document key (the content hash of the PDF, see list_documents).
+    Returns:
+        int: The number of chunks removed from the session.
+    """
+    def remove_document(self, session_id, document_hash):
+        with self._lock:
+            session = self._session(session_id)
+            if document_hash not in session.documents:
+                return 0
+            del session.documents[document_hash]
+            session.version += 1
+            chunks = self.documents[document_hash].chunks
+            self._release([document_hash])
+        self._refresh_index(session_id)
+        return chunks
+
+    """
+    Returns the version of the corpus of a session: a hash of its set of documents, which changes whenever a
+    document is added, replaced or removed. Sessions with the same documents have the same version.
+    Args:
+        session_id (str): The session.
+    Returns:
+        str: The hex SHA-256 digest of the sorted document keys.
+    """
+    def corpus_version(self, session_id):
+        with self._lock:
+            session = self._touch(session_id)
+            keys = sorted(session.documents) if session is not None else []
+            return hashlib.sha256("\n".join(keys).encode("ascii")).hexdigest()
+
+    """
+    Lists the documents of a session.
+    Args:
+        session_id (str): The session.
+    Returns:
+        list of dict: 'file_name', 'file_hash' and number of 'chunks' of each document, in order.
+    """
+    def list_documents(self, session_id):
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return []
+            return [{"file_name": file_name, "file_hash": key, "chunks": self.documents[key].chunks}
+                    for key, file_name in session.documents.items()]
+
+    """
+    Returns the index of a session, reopening its documents from disk if the session was evicted.
+    Args:
+        session_id (str): The session.
+    Returns:
+        SessionIndex: The index, or None if the session has no documents.
+    """
+    def get(self, session_id):
+        with self._lock:
+            if self._touch(session_id) is None:
+                return None
+        return self._refresh_index(session_id)
+
+    """
+    Searches the corpus of a session, like search_for_info_with_scores does with the global data.
+    Args:
+        session_id (str): The session.
+        input_text (str): The text to search for similar entries.
+        desired_doc_count (int, optional): The number of most similar documents to return. Defaults to 1.
+    Returns:
+        list of tuple: (text, similarity) pairs sorted by similarity, or None if there is no data or no match.
+    """
+    def search(self, session_id, input_text, desired_doc_count=1):
+        index = self.get(session_id)
+        if index is None:
+            return None
+        return find_most_similar(input_text, index, desired_doc_count)
+
+    """
+    Saves the corpus of a session as a single index, to reopen it later with load_index (and set_documents). When
+    the directory holds an earlier save (from this or another session), only the changes are written: the new
+    documents are appended in place and the removed ones are marked as deleted (see
+    tools.ingestion.save_documents). The IVF centroids of the session, if it has them, are saved too.
+    Args:
+        session_id (str): The session.
+        directory (str): The directory to save the index to.
+    """
+    def save_session(self, session_id, directory):
+        with self._lock:
+            session = self._touch(session_id)
+            documents = [] if session is None else [
+                (key, file_name, self._load(self.documents[key])) for key, file_name in session.documents.items()
+            ]
+            index = session.index if session is not None else None
+            centroids = index.ivf.centroids if index is not None and index.ivf is not None else None
+        path = os.path.abspath(directory)
+        with self._save_lock:
+            self.saved_layouts[path] = save_documents(directory, documents, self.saved_layouts.get(path))
+            centroids_path = os.path.join(directory, CENTROIDS_FILE_NAME)
+            if centroids is not None:
+                np.save(centroids_path, centroids)
+            elif os.path.isfile(centroids_path):
+                os.remove(centroids_path)
+
+    """
+    Tells whether the registry has a session (it may have been dropped after INDEX_SESSION_TTL seconds unused).
+    Args:
+        session_id (str): The session.
+    Returns:
+        bool: True if the session exists.
+    """
+    def has_session(self, session_id):
+        with self._lock:
+            return self._touch(session_id) is not None
+
+    """
+    Forgets a session. The documents that no other session uses are released, deleting their spill files.
+    Args:
+        session_id (str): The session.
+    """
+    def drop_session(self, session_id):
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+            if session is not None:
+                self._release(session.documents)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self.sessions),
+                "loaded_sessions": sum(session.index is not None for session in self.sessions.values()),
+                "documents": len(self.documents),
+                "loaded_documents": sum(document.index is not None for document in self.documents.values()),
+                "memory_bytes": self.memory_usage(),
+                "memory_budget_bytes": self.memory_budget_bytes,
+            }
+
+_index_registry = None
+_index_registry_lock = threading.Lock()
+
+"""
+Returns the process-wide IndexRegistry configured from the environment, creating it on first use.
+Returns:
+    IndexRegistry: The shared registry.
+"""
+def get_index_registry():
+    global _index_registry
+    with _index_registry_lock:
+        if _index_registry is None:
+            _index_registry = IndexRegistry()
+        return _index_registry
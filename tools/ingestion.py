@@ -0,0 +1,142 @@
+import hashlib
+import os
+from itertools import groupby
+
+import numpy as np
+
+from tools.chunker import iter_token_chunks
+from tools.embedding_cache import normalize_text
+from tools.explore_pdf import iter_pdf_pages
+from tools.ivf_index import IVF_FILE_NAME
+from tools.quantized_index import QUANTIZED_FILE_NAME
+from tools.telemetry import span
+from tools.vector_index import COMPACT_DELETED_RATIO, VectorIndex, append_saved_rows, save_deleted_rows
+
+"""
+Returns the content hash of a PDF, used to identify a document in the index.
+Args:
+    pdf_bytes (bytes): The content of the PDF.
+Returns:
+    str: The hex SHA-256 digest.
+"""
+def file_hash(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+"""
+Returns the content hash of a chunk, used to find the chunks that did not change between two versions of a document.
+Args:
+    text (str): The text of the chunk.
+Returns:
+    str: The hex SHA-256 digest of the normalized text.
+"""
+def chunk_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+"""
+Extracts and chunks several PDFs held in memory, yielding the chunks of each file as soon as it is processed.
+Each chunk gets the 'file_hash' of its PDF and its own 'chunk_hash'. The files are told apart by their position in
+sources, not by their name, so two uploads with the same file name stay separate documents.
+Args:
+    sources (list of tuple): (file_name, pdf_bytes) pairs.
+    on_stage (callable, optional): Called with the file name and 'extract' when the extraction of a file starts
+                                   and 'chunk' when it is chunked.
+Yields:
+    tuple: The file name and the list of its chunks (see iter_token_chunks).
+"""
+def iter_document_chunks(sources, on_stage=None):
+    sources = list(sources)
+    hashes = [file_hash(pdf_bytes) for _, pdf_bytes in sources]
+    # iter_pdf_pages entrega las páginas en el orden de los ficheros, así que las de cada uno son consecutivas
+    pages_by_source = groupby(iter_pdf_pages(sources), key=lambda page: page["source_index"])
+    position = 0
+    while True:
+        # El siguiente fichero en extraerse es el que sigue al último (los que no tienen páginas no aparecen)
+        if on_stage is not None and position < len(sources):
+            on_stage(sources[position][0], "extract")
+        with span("extract_pdf"):
+            source_index, pages = next(pages_by_source, (None, None))
+            if source_index is None:
+                return
+            pages = list(pages)
+        file_name = sources[source_index][0]
+        position = source_index + 1
+        if on_stage is not None:
+            on_stage(file_name, "chunk")
+        with span("chunk"):
+            chunks = list(iter_token_chunks(pages))
+        for chunk in chunks:
+            chunk["file_hash"] = hashes[source_index]
+            chunk["chunk_hash"] = chunk_hash(chunk["text"])
+        yield file_name, chunks
+
+def chunks_to_entries(chunks, embeddings):
+    return [
+        {
+            'file_name': chunk['file_name'],
+            'file_hash': chunk['file_hash'],
+            'chunk_hash': chunk['chunk_hash'],
+            'page_number': chunk['page_number'],
+            'text': chunk['text'],
+            'embeddings': embedding
+        }
+        for chunk, embedding in zip(chunks, embeddings)
+    ]
+
+"""
+Saves the documents of a session as one index (see load_index), the rows of each document contiguous and in the
+order of the documents. When the directory holds an earlier save of these documents (its layout), only the changes
+are written: the rows of the new documents are appended in place and the rows of the removed ones are marked as
+deleted. The index is rewritten when the deleted rows would go over COMPACT_DELETED_RATIO.
+Args:
+    directory (str): The directory to save the index to.
+    documents (list of tuple): (key, file_name, VectorIndex) for each document.
+    layout (dict, optional): The layout returned by the previous save to the directory, or None to rewrite it.
+Returns:
+    dict: The layout of the saved index: the rows of each document by key ('documents'), the number of rows
+          ('rows') and the deleted rows ('deleted').
+"""
+def save_documents(directory, documents, layout=None):
+    if layout is not None:
+        added = [document for document in documents if document[0] not in layout["documents"]]
+        keys = {key for key, _, _ in documents}
+        removed = [rows for key, rows in layout["documents"].items() if key not in keys]
+        deleted = sorted(set(layout["deleted"]).union(*(range(start, end) for start, end in removed)))
+        rows = layout["rows"] + sum(len(index) for _, _, index in added)
+        if rows and len(deleted) / rows > COMPACT_DELETED_RATIO:
+            layout = None
+
+    if layout is None:
+        return _rewrite_documents(directory, documents)
+
+    positions = {key: rows for key, rows in layout["documents"].items() if key in keys}
+    start = layout["rows"]
+    for key, file_name, index in added:
+        append_saved_rows(directory, index.texts, _document_metadata(index, file_name), np.asarray(index.matrix), start)
+        positions[key] = (start, start + len(index))
+        start += len(index)
+    save_deleted_rows(directory, deleted)
+    return {"documents": positions, "rows": start, "deleted": deleted}
+
+def _document_metadata(index, file_name):
+    # Cada sesión guarda el documento con el nombre con el que lo subió
+    return [{**entry, "file_name": file_name} for entry in index.metadata]
+
+def _rewrite_documents(directory, documents):
+    positions = {}
+    start = 0
+    for key, _, index in documents:
+        positions[key] = (start, start + len(index))
+        start += len(index)
+    if documents:
+        saved = VectorIndex(np.concatenate([np.asarray(index.matrix) for _, _, index in documents]),
+                            [text for _, _, index in documents for text in index.texts],
+                            [entry for _, file_name, index in documents for entry in _document_metadata(index, file_name)],
+                            normalized=True)
+    else:
+        saved = VectorIndex.from_entries([])
+    saved.save(directory)
+    # Se guarda como índice exacto: las listas IVF o los códigos de un guardado anterior ya no corresponden
+    for file_name in (IVF_FILE_NAME, QUANTIZED_FILE_NAME):
+        if os.path.isfile(os.path.join(directory, file_name)):
+            os.remove(os.path.join(directory, file_name))
+    return {"documents": positions, "rows": start, "deleted": []}
@@ -0,0 +1,232 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config.env_loader import ingestion_workers, ingestion_job_history
+from tools.index_registry import get_index_registry
+from tools.telemetry import increment
+
+# Un trabajo pasa de "queued" a "running" y termina en uno de estos estados
+FINISHED_STATES = ("done", "cancelled", "failed")
+# Etapas por las que pasa cada fichero, en orden
+FILE_STAGES = ("pending", "extract", "chunk", "embed", "index", "done")
+
+"""
+Ingestion of a batch of PDFs into the corpus of a session, run by an IngestionQueue worker. Its state is only
+changed by the worker (and cancel), under a lock, and read through status().
+Args:
+    session_id (str): The session the documents are added to.
+    sources (list of tuple): (file_name, pdf_bytes) pairs.
+    directory (str, optional): The directory the corpus of the session is saved to when the job finishes.
+"""
+class IngestionJob:
+    def __init__(self, session_id, sources, directory=None):
+        self.job_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.sources = list(sources)
+        self.directory = directory
+        self.state = "queued"
+        self.stages = OrderedDict((file_name, "pending") for file_name, _ in self.sources)
+        self.summary = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def set_stage(self, file_name, stage):
+        with self._lock:
+            self.stages[file_name] = stage
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    """
+    Returns a snapshot of the job, safe to read from any thread.
+    Returns:
+        dict: 'job_id', 'session_id', 'state', 'files' (file name and stage of each file, in order), 'indexed_files'
+              (files already searchable), 'total_files', 'summary' (see IndexRegistry.add_documents, once finished),
+              'error' and 'elapsed' (seconds since the job started, or its total duration).
+    """
+    def status(self):
+        with self._lock:
+            files = [{"file_name": file_name, "stage": stage} for file_name, stage in self.stages.items()]
+            end = self.finished_at or time.time()
+            return {
+                "job_id": self.job_id,
+                "session_id": self.session_id,
+                "state": self.state,
+                "files": files,
+                "indexed_files": sum(file["stage"] == "done" for file in files),
+                "total_files": len(files),
+                "summary": self.summary,
+                "error": self.error,
+                "elapsed": end - self.started_at if self.started_at else 0.0
+            }
+
+    def run(self, registry):
+        with self._lock:
+            if self.cancelled():
+                self.state = "cancelled"
+                self.finished_at = time.time()
+                return
+            self.state = "running"
+            self.started_at = time.time()
+        try:
+            summary = registry.add_documents(self.session_id, self.sources, on_stage=self.set_stage,
+                                             cancelled=self.cancelled)
+            if self.directory is not None:
+                registry.save_session(self.session_id, self.directory)
+            state = "cancelled" if self.cancelled() else "done"
+            error = None
+        except Exception as exception:
+            logging.exception("Falló la ingesta del trabajo %s", self.job_id)
+            summary = None
+            state = "failed"
+            error = f"{type(exception).__name__}: {exception}"
+        with self._lock:
+            self.summary = summary
+            self.state = state
+            self.error = error
+            self.finished_at = time.time()
+            # Se libera el contenido de los PDF; los ficheros que no se llegaron a indexar vuelven a "pending"
+            self.sources = []
+            if state != "done":
+                for file_name, stage in self.stages.items():
+                    if stage != "done":
+                        self.stages[file_name] = "pending"
+        increment(f"ingestion_job_{state}")
+
+"""
+Background queue of ingestion jobs. Extraction, chunking and embedding run in a small pool of worker threads
+(ingestion is mostly waiting on the embeddings endpoint and on the PDF extraction processes), so a large upload
+does not block the Streamlit script. Every document is added to the session as soon as it is embedded, so the
+session can be searched while the next files are processed.
+It is thread-safe and shared by every Streamlit session.
+Args:
+    max_workers (int): The number of jobs processed at once. Defaults to INGESTION_WORKERS.
+    registry (IndexRegistry, optional): The registry the documents are added to. Defaults to the shared one.
+    history (int): The number of finished jobs kept for status(). Defaults to INGESTION_JOB_HISTORY.
+"""
+class IngestionQueue:
+    def __init__(self, max_workers=None, registry=None, history=None):
+        self.registry = registry or get_index_registry()
+        self.history = ingestion_job_history if history is None else history
+        self.jobs = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or ingestion_workers,
+                                            thread_name_prefix="ingestion")
+        self._lock = threading.Lock()
+
+    """
+    Queues the ingestion of a batch of PDFs.
+    Args:
+        session_id (str): The session the documents are added to.
+        sources (list of tuple): (file_name, pdf_bytes) pairs.
+        directory (str, optional): The directory the corpus of the session is saved to when the job finishes.
+    Returns:
+        str: The job id.
+    """
+    def submit(self, session_id, sources, directory=None):
+        job = IngestionJob(session_id, sources, directory)
+        with self._lock:
+            self.jobs[job.job_id] = job
+            self._forget_finished()
+        self._executor.submit(job.run, self.registry)
+        return job.job_id
+
+    """
+    Returns the status of a job (see IngestionJob.status).
+    Args:
+        job_id (str): The job id.
+    Returns:
+        dict: The status, or None if the job is unknown.
+    """
+    def status(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+        return None if job is None else job.status()
+
+    """
+    Cancels a job. A queued job does not start; a running one stops before embedding its next file, keeping the
+    documents it already added.
+    Args:
+        job_id (str): The job id.
+    Returns:
+        bool: True if the job was queued or running.
+    """
+    def cancel(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel()
+        return True
+
+    """
+    Lists the jobs of a session, oldest first.
+    Args:
+        session_id (str): The session.
+    Returns:
+        list of dict: The status of each job.
+    """
+    def list_jobs(self, session_id):
+        with self._lock:
+            jobs = [job for job in self.jobs.values() if job.session_id == session_id]
+        return [job.status() for job in jobs]
+
+    """
+    Waits until a job finishes, mainly for scripts and tests.
+    Args:
+        job_id (str): The job id.
+        timeout (float, optional): The maximum number of seconds to wait.
+    Returns:
+        dict: The status of the job.
+    """
+    def wait(self, job_id, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            status = self.status(job_id)
+            if status is None or status["state"] in FINISHED_STATES:
+                return status
+            if deadline is not None and time.monotonic() >= deadline:
+                return status
+            time.sleep(0.05)
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
+
+    def shutdown(self, cancel_jobs=True):
+        if cancel_jobs:
+            with self._lock:
+                jobs = list(self.jobs.values())
+            for job in jobs:
+                job.cancel()
+        self._executor.shutdown(wait=True)
+
+_ingestion_queue = None
+_ingestion_queue_lock = threading.Lock()
+
+"""
+Returns the process-wide IngestionQueue, creating it on first use.
+Returns:
+    IngestionQueue: The shared ingestion queue.
+"""
+def get_ingestion_queue():
+    global _ingestion_queue
+    with _ingestion_queue_lock:
+        if _ingestion_queue is None:
+            _ingestion_queue = IngestionQueue()
+        return _ingestion_queue
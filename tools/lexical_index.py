@@ -0,0 +1,133 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+from config.env_loader import bm25_k1, bm25_b
+
+# Términos: palabras y códigos con guiones, puntos o barras (referencias, números de pieza, secciones como 4.2.1)
+TERM_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+
+"""
+Splits a text into the terms used by the lexical index (case-insensitive).
+Args:
+    text (str): The text.
+Returns:
+    list of str: The terms, in order.
+"""
+def tokenize_terms(text):
+    return TERM_PATTERN.findall(text.casefold())
+
+"""
+Inverted index of the texts of a vector index, for BM25 scoring.
+Each term maps to the sorted rows that contain it and its frequency in each of them.
+Args:
+    texts (list of str): The texts, one per row (the same rows as the vector index).
+"""
+class BM25Index:
+    def __init__(self, texts):
+        postings = {}
+        self.lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms = tokenize_terms(text)
+            self.lengths[row] = len(terms)
+            for term, frequency in Counter(terms).items():
+                rows, frequencies = postings.setdefault(term, ([], []))
+                rows.append(row)
+                frequencies.append(frequency)
+        self.postings = {
+            term: (np.asarray(rows, dtype=np.int32), np.asarray(frequencies, dtype=np.float32))
+            for term, (rows, frequencies) in postings.items()
+        }
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def document_frequency(self, term):
+        posting = self.postings.get(term)
+        return 0 if posting is None else len(posting[0])
+
+    def contains(self, row, term):
+        posting = self.postings.get(term)
+        if posting is None:
+            return False
+        position = np.searchsorted(posting[0], row)
+        return position < len(posting[0]) and posting[0][position] == row
+
+    """
+    Returns an estimate of the memory used by the index: the posting arrays plus the terms.
+    Returns:
+        int: The number of bytes.
+    """
+    def memory_usage(self):
+        return self.lengths.nbytes + sum(
+            len(term) + rows.nbytes + frequencies.nbytes for term, (rows, frequencies) in self.postings.items()
+        )
+
+"""
+Returns the BM25 inverse document frequency of each term.
+Args:
+    index (BM25Index): The lexical index.
+    terms (list of str): The distinct query terms.
+Returns:
+    dict: The IDF of each term.
+"""
+def bm25_idf(index, terms):
+    idf = {}
+    for term in terms:
+        frequency = index.document_frequency(term)
+        idf[term] = math.log((len(index) - frequency + 0.5) / (frequency + 0.5) + 1)
+    return idf
+
+"""
+Scores a query with BM25.
+Args:
+    index (BM25Index): The lexical index.
+    query (str): The query text.
+    k (int): The number of results.
+    excluded (numpy.ndarray, optional): A boolean mask with the rows to leave out (deleted rows).
+Returns:
+    list of tuple: (row, score) pairs sorted by score in descending order. Rows without any query term are not
+                   returned.
+"""
+def bm25_search(index, query, k, excluded=None):
+    terms = list(dict.fromkeys(tokenize_terms(query)))
+    if not terms or len(index) == 0:
+        return []
+    idf = bm25_idf(index, terms)
+    average_length = max(float(index.lengths.sum()) / len(index), 1.0)
+
+    scores = np.zeros(len(index), dtype=np.float32)
+    length_norm = bm25_k1 * (1 - bm25_b + bm25_b * index.lengths / average_length)
+    for term in terms:
+        posting = index.postings.get(term)
+        if posting is None:
+            continue
+        rows, frequencies = posting
+        scores[rows] += idf[term] * frequencies * (bm25_k1 + 1) / (frequencies + length_norm[rows])
+    if excluded is not None:
+        scores[excluded] = 0
+    # Solo puntúan las filas con algún término de la consulta, normalmente pocas: se ordenan directamente
+    rows = np.flatnonzero(scores)
+    rows = rows[np.argsort(-scores[rows], kind="stable")[:k]]
+    return [(int(row), float(scores[row])) for row in rows]
+
+"""
+Measures how well the best lexical result matches a query: the share of the IDF weight of the query terms that
+appear in the best row, and how much its score exceeds the second one.
+Args:
+    index (BM25Index): The lexical index searched.
+    query (str): The query text.
+    results (list of tuple): The results of bm25_search.
+Returns:
+    tuple: The coverage (0 to 1) and the margin (score of the first result / score of the second one).
+"""
+def lexical_confidence(index, query, results):
+    if not results:
+        return 0.0, 0.0
+    idf = bm25_idf(index, list(dict.fromkeys(tokenize_terms(query))))
+    row, top_score = results[0]
+    covered = sum(weight for term, weight in idf.items() if index.contains(row, term))
+    margin = top_score / results[1][1] if len(results) > 1 else math.inf
+    return covered / sum(idf.values()), margin
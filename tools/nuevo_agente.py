@@ -1,32 +1,240 @@
-from config.env_loader import (
-    azure_openai_endpoint,
-    azure_openai_deployment_name,
-    azure_openai_api_key
-)
-from llama_index.llms.azure_openai import AzureOpenAI
+import logging
+import time
+import uuid
+from functools import partial
+from itertools import chain
+from threading import Thread
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from llama_index.core.tools import FunctionTool
 from llama_index.core.agent import FunctionCallingAgentWorker
+from llama_index.core.agent.types import TaskStepOutput
+from llama_index.core.agent.utils import add_user_step_to_memory
+from llama_index.core.chat_engine.types import AgentChatResponse, StreamingAgentChatResponse
+from tools.conversation_memory import TokenBudgetMemory
 from tools.search_with_azure import custom_agent_worker
+from tools.telemetry import increment, observe
+from tools.resources import get_agent_factory, get_llm
 from llama_index.core.agent import AgentRunner
 
-def nuevo_agente(system_prompt):
-    azure_openai_client = AzureOpenAI(
-                                engine = azure_openai_deployment_name,
-                                azure_endpoint=azure_openai_endpoint,
-                                api_key=azure_openai_api_key,
-                                api_version="2024-05-01-preview")
-
-    # Registrar el agente
-    search_custom = FunctionTool.from_defaults(
-        fn=custom_agent_worker, 
-        description="Busca información en embeddings y, si no encuentra, en Bing."
-    )
-
-    agent_worker = FunctionCallingAgentWorker.from_tools(
-        tools=[search_custom],  # Solo se registra la herramienta que coordina ambas búsquedas
-        llm=azure_openai_client,
-        verbose=True,
-        system_prompt=system_prompt
-    )
-
-    return AgentRunner(agent_worker)
\ No newline at end of file
+"""
+FunctionCallingAgentWorker with a streaming step, so AgentRunner.stream_chat can send the final answer token by
+token. Tool calls are still executed whole (the LLM stream is consumed until the tool call is complete); the
+on_tool_call callback, if set, is called before each tool runs so the UI can show its progress. If prompt_tokens is
+a list, the prompt size of every LLM call (history messages, counted by the memory of the agent) is appended to it.
+"""
+class StreamingFunctionCallingAgentWorker(FunctionCallingAgentWorker):
+    on_tool_call = None
+    prompt_tokens = None
+
+    def _call_function(self, tools, tool_call, memory, sources, verbose=False):
+        if self.on_tool_call is not None:
+            self.on_tool_call(tool_call.tool_name, tool_call.tool_kwargs)
+        return super()._call_function(tools, tool_call, memory, sources, verbose=verbose)
+
+    def stream_step(self, step, task, **kwargs):
+        if step.input is not None:
+            add_user_step_to_memory(step, task.extra_state["new_memory"], verbose=self._verbose)
+        tools = self.get_tools(task.input)
+        chat_history = self.get_all_messages(task)
+        if self.prompt_tokens is not None and hasattr(task.memory, "count_tokens"):
+            self.prompt_tokens.append(task.memory.count_tokens(chat_history))
+
+        chat_stream = self._llm.stream_chat_with_tools(
+            tools=tools,
+            chat_history=chat_history,
+            verbose=self._verbose,
+            allow_parallel_tool_calls=self.allow_parallel_tool_calls,
+        )
+
+        # Se leen fragmentos hasta saber si el LLM está llamando a una herramienta o respondiendo con texto
+        consumed_chunks = []
+        is_tool_call = False
+        for chunk in chat_stream:
+            consumed_chunks.append(chunk)
+            if chunk.message.additional_kwargs.get("tool_calls"):
+                is_tool_call = True
+                break
+            if chunk.delta:
+                break
+
+        if not consumed_chunks:
+            return TaskStepOutput(output=AgentChatResponse(response="", is_dummy_stream=True),
+                                  task_step=step, is_last=True, next_steps=[])
+
+        can_call_tools = task.extra_state["n_function_calls"] < self._max_function_calls
+        if is_tool_call:
+            # La llamada a la herramienta se recibe completa antes de ejecutarla
+            for chunk in chat_stream:
+                consumed_chunks.append(chunk)
+            response = consumed_chunks[-1]
+            tool_calls = self._llm.get_tool_calls_from_response(response, error_on_no_tool_call=False)
+            task.extra_state["new_memory"].put(response.message)
+
+            if can_call_tools:
+                tool_outputs = []
+                for tool_call in tool_calls:
+                    self._call_function(tools, tool_call, task.extra_state["new_memory"], tool_outputs,
+                                        verbose=self._verbose)
+                    task.extra_state["sources"].append(tool_outputs[-1])
+                    task.extra_state["n_function_calls"] += 1
+                return TaskStepOutput(
+                    output=AgentChatResponse(response=str(response.message.content), sources=tool_outputs),
+                    task_step=step,
+                    is_last=False,
+                    next_steps=[step.get_next_step(step_id=str(uuid.uuid4()), input=None)],
+                )
+            return TaskStepOutput(
+                output=AgentChatResponse(response=str(response.message.content or ""), is_dummy_stream=True),
+                task_step=step, is_last=True, next_steps=[]
+            )
+
+        # Respuesta final: se devuelve en streaming y se guarda en la memoria cuando termina
+        agent_response_stream = StreamingAgentChatResponse(
+            chat_stream=chain(consumed_chunks, chat_stream),
+            sources=task.extra_state["sources"],
+        )
+        thread = Thread(
+            target=agent_response_stream.write_response_to_history,
+            args=(task.extra_state["new_memory"],),
+            kwargs={"on_stream_end_fn": partial(self.finalize_task, task)},
+        )
+        thread.start()
+
+        return TaskStepOutput(output=agent_response_stream, task_step=step, is_last=True, next_steps=[])
+
+def _search_documents(query: str):
+    return custom_agent_worker(query)
+
+"""
+Builds the agents of every session from shared parts: the chat model and the schema of the search tool are
+created once (the schema is derived from the function signature with pydantic, which is slow to do per agent),
+so creating an agent only binds the tool to the session and sets the system prompt.
+Args:
+    llm (FunctionCallingLLM): The chat model shared by the agents.
+    token_counter (callable, optional): A function returning the token count of a text, used by the memory of the
+                                        agents. Defaults to the tiktoken encoder of MEMORY_TOKENIZER_MODEL.
+"""
+class AgentFactory:
+    def __init__(self, llm, token_counter=None):
+        self.llm = llm
+        self.token_counter = token_counter
+        self.tool_metadata = FunctionTool.from_defaults(
+            fn=_search_documents,
+            name="custom_agent_worker",
+            description="Busca información en embeddings y, si no encuentra, en Bing."
+        ).metadata
+
+    """
+    Creates an agent with its own memory, kept within MEMORY_TOKEN_BUDGET tokens (see TokenBudgetMemory).
+    Args:
+        system_prompt (str): The system prompt of the agent.
+        session_id (str, optional): The session whose documents the search tool uses.
+    Returns:
+        AgentRunner: The agent.
+    """
+    def create(self, system_prompt, session_id=None):
+        # La herramienta queda ligada a la sesión; el LLM solo ve el parámetro query
+        def search_session_documents(query: str):
+            return custom_agent_worker(query, session_id=session_id)
+
+        search_custom = FunctionTool(fn=search_session_documents, metadata=self.tool_metadata)
+
+        agent_worker = StreamingFunctionCallingAgentWorker.from_tools(
+            tools=[search_custom],  # Solo se registra la herramienta que coordina ambas búsquedas
+            llm=self.llm,
+            verbose=True,
+            system_prompt=system_prompt
+        )
+
+        # Los turnos antiguos se resumen con el mismo LLM para que el prompt no crezca con la conversación
+        memory = TokenBudgetMemory.from_defaults(llm=self.llm, token_counter=self.token_counter)
+        return AgentRunner(agent_worker, memory=memory)
+
+"""
+Creates the agent with the custom search tool.
+Args:
+    system_prompt (str): The system prompt of the agent.
+    llm (FunctionCallingLLM, optional): The chat model. Defaults to the shared Azure OpenAI deployment of the
+                                        environment (see tools.resources.get_llm).
+    session_id (str, optional): The session whose documents the search tool uses (see IndexRegistry). Defaults to
+                                the global data of search_for_info_with_scores.
+    token_counter (callable, optional): A function returning the token count of a text, used by the memory of the
+                                        agent (e.g. the encoder of tools.resources.get_tokenizer, or a word counter
+                                        without the tiktoken encodings). Defaults to the tiktoken encoder of
+                                        MEMORY_TOKENIZER_MODEL.
+Returns:
+    AgentRunner: The agent.
+"""
+def nuevo_agente(system_prompt, llm=None, session_id=None, token_counter=None):
+    if llm is None and token_counter is None:
+        factory = get_agent_factory()
+    else:
+        factory = AgentFactory(llm or get_llm(), token_counter=token_counter)
+    return factory.create(system_prompt, session_id=session_id)
+
+"""
+Sends a message to the agent and returns its answer as a stream of text fragments.
+The time to the first token and the total latency of the turn are written to `metrics` while the stream is consumed,
+and recorded in the shared telemetry ('agent_time_to_first_token' and 'agent_turn' stages), and the prompt size
+and latency of the turn are logged.
+Args:
+    agent (AgentRunner): The agent created with nuevo_agente.
+    message (str): The user message.
+    metrics (dict): Receives 'time_to_first_token' and 'total_latency' (seconds, from the start of the call),
+                    'prompt_tokens' (tokens of the largest prompt of the turn), 'llm_calls' and 'memory_tokens'
+                    (tokens of the history kept for the next turn, once the memory has stored this one).
+    on_tool_call (callable, optional): Called with the tool name and arguments before each tool runs.
+    sources (list, optional): Receives the outputs of the tools called in the turn (ToolOutput).
+Returns:
+    generator: The text fragments of the answer.
+"""
+def stream_agent_response(agent, message, metrics, on_tool_call=None, sources=None):
+    start = time.perf_counter()
+    prompt_tokens = []
+    agent.agent_worker.on_tool_call = on_tool_call
+    agent.agent_worker.prompt_tokens = prompt_tokens
+    try:
+        response = agent.stream_chat(message)
+    finally:
+        agent.agent_worker.on_tool_call = None
+        agent.agent_worker.prompt_tokens = None
+    # Los pasos del agente (llamadas a herramientas y la petición de la respuesta) ya se han ejecutado
+    metrics["prompt_tokens"] = max(prompt_tokens, default=0)
+    metrics["llm_calls"] = len(prompt_tokens)
+    increment("agent_prompt_tokens", sum(prompt_tokens))
+    if sources is not None:
+        sources.extend(response.sources)
+
+    def timed_tokens():
+        if isinstance(response, StreamingAgentChatResponse):
+            tokens = response.response_gen
+        else:
+            tokens = iter([response.response])
+        for token in tokens:
+            if "time_to_first_token" not in metrics:
+                metrics["time_to_first_token"] = time.perf_counter() - start
+            yield token
+        metrics.setdefault("time_to_first_token", time.perf_counter() - start)
+        metrics["total_latency"] = time.perf_counter() - start
+        observe("agent_time_to_first_token", metrics["time_to_first_token"])
+        observe("agent_turn", metrics["total_latency"])
+        if hasattr(agent.memory, "token_count"):
+            metrics["memory_tokens"] = agent.memory.token_count()
+        logging.info("Turno del agente: prompt de %d tokens (%d llamadas al LLM), primer token en %.2f s, "
+                     "total %.2f s, memoria de %s tokens", metrics["prompt_tokens"], metrics["llm_calls"],
+                     metrics["time_to_first_token"], metrics["total_latency"], metrics.get("memory_tokens", "?"))
+
+    return timed_tokens()
+
+"""
+Adds a turn that was answered without the agent (e.g. from the answer cache) to its memory, so the next
+questions of the conversation keep their context.
+Args:
+    agent (AgentRunner): The agent created with nuevo_agente.
+    message (str): The user message.
+    answer (str): The answer shown to the user.
+"""
+def remember_turn(agent, message, answer):
+    agent.memory.put(ChatMessage(role=MessageRole.USER, content=message))
+    agent.memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
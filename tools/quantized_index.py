@@ -0,0 +1,225 @@
+import os
+import uuid
+import weakref
+
+import numpy as np
+
+from tools.vector_index import VectorIndex, normalize_vectors, top_k_indices, write_npy_header
+
+# Fichero adicional con los códigos cuantizados de un índice guardado
+QUANTIZED_FILE_NAME = "quantized.npz"
+
+# Filas convertidas a float32 a la vez al puntuar los códigos: bloques pequeños caben en la caché del procesador,
+# así que la conversión apenas añade coste y la memoria temporal queda acotada
+SCORE_BLOCK_ROWS = 4096
+
+"""
+Quantizes unit-length vectors row by row.
+- float16: the vectors are cast to half precision (2 bytes per value, scale 1).
+- int8: each row is divided by its own scale (its largest absolute value / 127) and rounded (1 byte per value).
+Args:
+    vectors (numpy.ndarray): A (n, dim) float32 matrix.
+    dtype (str): "float16" or "int8".
+Returns:
+    tuple: The (n, dim) codes and the (n,) float32 scales.
+"""
+def quantize(vectors, dtype):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127 if len(vectors) else np.empty(0, dtype=np.float32)
+        scales = scales.astype(np.float32)
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales
+    raise ValueError(f"Unknown quantization type: {dtype}")
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+"""
+Vector index that keeps a compact copy of the embeddings (float16, or int8 with a scale per vector) to score the
+queries, and the float32 originals only to rescore the best candidates exactly. The originals are memory-mapped
+(from the saved index, or from a file of originals_dir for the rows built or added in memory), so only the codes
+(a half or a quarter of the float32 matrix) stay in memory and just a few rows of the originals are read per
+query. int8 scores about as fast as the float32 index; float16 is slower to score, because NumPy converts half floats to float32 slowly.
+It is a VectorIndex, so it can be used everywhere a VectorIndex is expected (search_for_info, find_most_similar).
+Args:
+    dtype (str): "float16" or "int8". Defaults to "int8".
+    rescore_factor (int): The query scores k * rescore_factor candidates on the codes and rescores them with the
+                          originals. 0 disables the rescoring (the approximate scores are returned). Defaults to 4.
+    codes (numpy.ndarray, optional): Already computed codes (used when loading a saved index).
+    scales (numpy.ndarray, optional): Already computed scales (used when loading a saved index).
+    originals_dir (str, optional): A directory where the originals that are not memory-mapped yet are written (a
+                                   file per index, deleted with it) to memory-map them. Without it they stay in
+                                   memory.
+"""
+class QuantizedIndex(VectorIndex):
+    def __init__(self, matrix, texts, metadata=None, normalized=False, deleted=None, dtype="int8", rescore_factor=4,
+                 codes=None, scales=None, originals_dir=None):
+        super().__init__(matrix, texts, metadata, normalized=normalized, deleted=deleted)
+        self.dtype = dtype
+        self.rescore_factor = rescore_factor
+        self.originals_dir = originals_dir
+        self._originals_path = None
+        self._originals_finalizer = None
+        if codes is not None and scales is not None:
+            self.codes = np.asarray(codes)
+            self.scales = np.asarray(scales, dtype=np.float32)
+        else:
+            self.codes, self.scales = quantize(self.matrix if len(self) else np.empty((0, 0)), dtype)
+        if originals_dir is not None and len(self) and not isinstance(self.matrix, np.memmap):
+            self._offload_originals()
+
+    """
+    Builds a quantized index from an existing VectorIndex.
+    Args:
+        index (VectorIndex): The full-precision index.
+        **kwargs: The quantization parameters (dtype, rescore_factor).
+    Returns:
+        QuantizedIndex: The built index.
+    """
+    @classmethod
+    def from_index(cls, index, **kwargs):
+        return cls(index.matrix, index.texts, index.metadata, normalized=True, deleted=index.deleted, **kwargs)
+
+    """
+    Returns the memory used by the embeddings: the codes and scales, plus the originals when they are not
+    memory-mapped.
+    Returns:
+        int: The number of bytes.
+    """
+    def memory_usage(self):
+        return super().memory_usage() + self.codes.nbytes + self.scales.nbytes
+
+    def _approximate_scores(self, queries):
+        # Se puntúa por bloques para no convertir toda la matriz de códigos a float32 a la vez
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), SCORE_BLOCK_ROWS):
+            block = slice(start, start + SCORE_BLOCK_ROWS)
+            scores[:, block] = (queries @ self.codes[block].astype(np.float32).T) * self.scales[block]
+        return self._exclude_deleted(scores)
+
+    def _rescore(self, query, scores, k):
+        if not self.rescore_factor:
+            return [(int(i), float(scores[i])) for i in top_k_indices(scores, k) if scores[i] > -np.inf]
+        candidates = [i for i in top_k_indices(scores, k * self.rescore_factor) if scores[i] > -np.inf]
+        # Las filas se leen en orden para que la lectura del memmap sea lo más secuencial posible
+        candidates = np.sort(np.asarray(candidates, dtype=np.int64))
+        exact_scores = np.asarray(self.matrix[candidates]) @ query
+        return [(int(candidates[i]), float(exact_scores[i])) for i in top_k_indices(exact_scores, k)]
+
+    def search_rows(self, query_embedding, k=1):
+        query = normalize_vectors(query_embedding)
+        with self._lock:
+            if len(self) == 0:
+                return []
+            return self._rescore(query, self._approximate_scores(query[None, :])[0], k)
+
+    def search_many(self, query_embeddings, k=1):
+        queries = normalize_vectors(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        with self._lock:
+            if len(self) == 0:
+                return [[] for _ in range(len(queries))]
+            scores = self._approximate_scores(queries)
+            return [
+                [(self.texts[row], score) for row, score in self._rescore(query, query_scores, k)]
+                for query, query_scores in zip(queries, scores)
+            ]
+
+    def _offload_originals(self, rows=None):
+        # Los originales (y las filas nuevas, si las hay) se escriben en un fichero propio del índice y se abren con
+        # mmap; el fichero anterior se borra
+        rows = np.empty((0, self.matrix.shape[1]), dtype=np.float32) if rows is None else rows
+        os.makedirs(self.originals_dir, exist_ok=True)
+        path = os.path.join(self.originals_dir, f"{uuid.uuid4().hex}.npy")
+        with open(path, "wb") as originals_file:
+            write_npy_header(originals_file, (len(self.matrix) + len(rows), rows.shape[1]))
+            for start in range(0, len(self.matrix), SCORE_BLOCK_ROWS):
+                originals_file.write(np.ascontiguousarray(self.matrix[start:start + SCORE_BLOCK_ROWS]).tobytes())
+            originals_file.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+        if self._originals_finalizer is not None:
+            self._originals_finalizer()
+        self._originals_path = path
+        self._originals_finalizer = weakref.finalize(self, _remove_file, path)
+        self.matrix = np.load(path, mmap_mode="r")
+        self._buffer = None
+
+    def _append_matrix(self, start, rows):
+        if self.originals_dir is None:
+            return super()._append_matrix(start, rows)
+        if self._originals_path is None:
+            # Primeras filas en disco: se escriben también las existentes (en memoria o mapeadas de otro fichero)
+            if start == 0:
+                self.matrix = np.empty((0, rows.shape[1]), dtype=np.float32)
+            self._offload_originals(rows)
+            return
+        # Las filas nuevas se añaden al final del fichero y la cabecera se actualiza con la nueva forma
+        with open(self._originals_path, "r+b") as originals_file:
+            originals_file.seek(0, os.SEEK_END)
+            originals_file.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+            originals_file.seek(0)
+            write_npy_header(originals_file, (start + len(rows), rows.shape[1]))
+        self.matrix = np.load(self._originals_path, mmap_mode="r")
+
+    def _rows_added(self, start, end):
+        codes, scales = quantize(self.matrix[start:end], self.dtype)
+        self.codes = codes if start == 0 else np.concatenate((self.codes, codes))
+        self.scales = np.concatenate((self.scales[:start], scales))
+
+    def compact(self):
+        with self._lock:
+            keep = np.flatnonzero(~self.deleted)
+            self.codes = np.ascontiguousarray(self.codes[keep])
+            self.scales = self.scales[keep]
+            super().compact()
+            if self.originals_dir is not None and len(self):
+                self._offload_originals()
+
+    def _save_codes(self, directory):
+        quantized_path = os.path.join(directory, QUANTIZED_FILE_NAME)
+        with open(quantized_path + ".tmp", "wb") as quantized_file:
+            np.savez(quantized_file, codes=self.codes, scales=self.scales, rescore_factor=self.rescore_factor)
+        os.replace(quantized_path + ".tmp", quantized_path)
+
+    """
+    Saves the index like VectorIndex.save (the float32 originals, which are memory-mapped when loading) plus the
+    codes and scales.
+    Args:
+        directory (str): The directory to save the index to.
+    """
+    def save(self, directory):
+        super().save(directory)
+        with self._lock:
+            self._save_codes(directory)
+
+    def append_to_disk(self, directory, start):
+        super().append_to_disk(directory, start)
+        with self._lock:
+            self._save_codes(directory)
+
+"""
+Opens a quantized index saved with QuantizedIndex.save. The originals are memory-mapped and the codes are read
+into memory.
+Args:
+    directory (str): The directory the index was saved to.
+Returns:
+    QuantizedIndex: The loaded index.
+"""
+def load_quantized_index(directory):
+    with np.load(os.path.join(directory, QUANTIZED_FILE_NAME)) as quantized:
+        codes = quantized["codes"]
+        index = QuantizedIndex.load(directory, dtype=str(codes.dtype), codes=codes, scales=quantized["scales"],
+                                    rescore_factor=int(quantized["rescore_factor"]))
+    # Si una escritura se interrumpió, los códigos pueden tener más filas que la matriz, o menos si se cortó
+    # después de añadir las filas a la matriz: las que faltan se cuantizan de nuevo
+    index.codes = index.codes[:len(index)]
+    index.scales = index.scales[:len(index)]
+    if len(index.codes) < len(index):
+        codes, scales = quantize(index.matrix[len(index.codes):], index.dtype)
+        index.codes = np.concatenate((index.codes, codes)) if len(index.codes) else codes
+        index.scales = np.concatenate((index.scales, scales))
+    return index
@@ -0,0 +1,150 @@
+import importlib
+import logging
+import threading
+import time
+from functools import lru_cache
+
+from config.env_loader import (
+    azure_openai_endpoint,
+    azure_openai_deployment_name,
+    azure_openai_api_key
+)
+from tools.telemetry import observe, span
+
+"""
+Module proxy that imports the module the first time one of its attributes is used. Heavy dependencies (llama_index,
+openai, fitz, tiktoken...) are declared with lazy_import so importing the app does not load them before the
+first screen is drawn; they are loaded by the code path that needs them, once per process.
+Args:
+    name (str): The module name.
+"""
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    with span(f"import:{self._name}"):
+                        self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+def lazy_import(name):
+    return LazyModule(name)
+
+tiktoken = lazy_import("tiktoken")
+
+"""
+Returns the tiktoken encoder for a model. It is created once per process and reused for every document.
+Args:
+    model (str): The model name. Defaults to "gpt-4o".
+Returns:
+    tiktoken.Encoding: The encoder.
+"""
+@lru_cache(maxsize=None)
+def get_tokenizer(model: str = "gpt-4o"):
+    with span(f"init:tokenizer:{model}"):
+        return tiktoken.encoding_for_model(model)
+
+_llm = None
+_agent_factory = None
+_warm_up_thread = None
+_resources_lock = threading.Lock()
+
+"""
+Returns the process-wide chat model (the Azure OpenAI deployment of the environment), creating it on first use.
+Every agent of every session shares it, and with it its HTTP connection pool.
+Returns:
+    AzureOpenAI: The llama_index chat model.
+"""
+def get_llm():
+    global _llm
+    with _resources_lock:
+        if _llm is None:
+            with span("init:llm"):
+                from llama_index.llms.azure_openai import AzureOpenAI
+                _llm = AzureOpenAI(
+                    engine=azure_openai_deployment_name,
+                    azure_endpoint=azure_openai_endpoint,
+                    api_key=azure_openai_api_key,
+                    api_version="2024-05-01-preview"
+                )
+        return _llm
+
+"""
+Replaces the process-wide chat model, for example with one that points to a local fake endpoint. The agent
+factory is recreated with it on its next use.
+Args:
+    llm (FunctionCallingLLM): The chat model to use from now on.
+"""
+def set_llm(llm):
+    global _llm, _agent_factory
+    with _resources_lock:
+        _llm = llm
+        _agent_factory = None
+
+"""
+Returns the process-wide AgentFactory (see tools.nuevo_agente), built on first use with the shared chat model.
+Returns:
+    AgentFactory: The agent factory.
+"""
+def get_agent_factory():
+    global _agent_factory
+    llm = get_llm()
+    with _resources_lock:
+        if _agent_factory is None:
+            with span("init:agent_factory"):
+                from tools.nuevo_agente import AgentFactory
+                _agent_factory = AgentFactory(llm)
+        return _agent_factory
+
+def _warm_up():
+    try:
+        get_agent_factory()
+    except Exception:
+        # Sin configuración del LLM el error se verá al crear el agente, no en el hilo de precarga
+        logging.warning("No se pudo precargar el agente", exc_info=True)
+
+"""
+Loads the chat model and the agent factory in a background thread, so the first agent is ready sooner
+without delaying the screen being drawn. The thread is started once per process.
+Returns:
+    threading.Thread: The thread (already started).
+"""
+def warm_up():
+    global _warm_up_thread
+    with _resources_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=_warm_up, name="resources-warm-up", daemon=True)
+            _warm_up_thread.start()
+        return _warm_up_thread
+
+_first_run_recorded = False
+_first_run_lock = threading.Lock()
+
+"""
+Records the duration of a run of the Streamlit script: the first run of the process as 'app_cold_start'
+(it includes importing the app modules) and the next ones, one per interaction, as 'app_rerun'.
+Args:
+    start (float): The time.perf_counter() value taken at the start of the run.
+Returns:
+    float: The duration of the run in seconds.
+"""
+def record_app_run(start):
+    global _first_run_recorded
+    duration = time.perf_counter() - start
+    with _first_run_lock:
+        stage = "app_rerun" if _first_run_recorded else "app_cold_start"
+        _first_run_recorded = True
+    observe(stage, duration)
+    return duration
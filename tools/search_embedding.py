@@ -1,5 +1,15 @@
+import os
+import threading
+
 import numpy as np
 
+from tools.vector_index import VectorIndex
+from tools.ivf_index import IVFIndex
+from tools.quantized_index import QuantizedIndex
+from tools.hybrid_search import hybrid_search
+from tools.embedding_service import get_embedding_service
+from tools.telemetry import span, traced
+
 from config.env_loader import (
     azure_openai_endpoint,
     azure_openai_deployment_name,
@@ -7,14 +17,23 @@ from config.env_loader import (
     azure_openai_endpoint_embeding,
     bing_search_api_key,
     azure_openai_embeding_api_key,
-    azure_openai_embeding_deployment_name
+    azure_openai_embeding_deployment_name,
+    vector_index_backend,
+    ann_min_rows,
+    ivf_n_lists,
+    ivf_n_probe,
+    vector_index_quantization,
+    quantized_rescore_factor,
+    index_spill_dir,
+    retrieval_mode,
+    lexical_fast_path
 )
 
 """
 Calculate the embeddings for a given text using the specified Azure OpenAI client.
 Args:
     text (str): The input text to calculate embeddings for.
-    client: The Azure OpenAI client to use for generating embeddings. Defaults to azure_openai_client_embeding.
+    The shared EmbeddingService from tools.embedding_service is used to send the request.
 Returns:
     list: The embeddings for the input text.
 """
@@ -32,23 +51,44 @@ pass
 Find the most similar documents to the input text from a given dataset.
 Args:
     input_text (str): The input text to compare against the dataset.
-    data (list): A list of dictionaries containing 'text' and 'embeddings' keys.
+    data (list or VectorIndex): A list of dictionaries containing 'text' and 'embeddings' keys, or an index
+                                built from them (VectorIndex, preferred: it is reused across queries).
+                                With RETRIEVAL_MODE=hybrid the vector and BM25 rankings are fused (see hybrid_search).
     desired_doc_count (int): The number of most similar documents to return. Defaults to 1.
 Returns:
-    list: A list of tuples containing the most similar documents and their similarity scores.
+    list: A list of tuples containing the most similar documents and their similarity scores, or None if there are none.
 """
 pass
 
+@traced("calculate_embeddings")
 def calculate_embeddings(text):
-    from openai import AzureOpenAI
-    client = AzureOpenAI(
-                        azure_endpoint=azure_openai_endpoint_embeding,
-                        api_key=azure_openai_embeding_api_key,
-                        api_version="2024-05-01-preview")
-    
-    embeddings = client.embeddings.create(input=text, model=azure_openai_embeding_deployment_name)
+    # Se reutiliza el cliente compartido (con pool de conexiones) en lugar de crear uno por llamada
+    return get_embedding_service().embed(text)
 
-    return embeddings.data[0].embedding
+# Memo de embeddings de consultas para el turno actual del agente (uno por hilo, es decir, por sesión de Streamlit)
+_query_embeddings_memo = threading.local()
+
+"""
+Clears the memoized query embeddings. Call it at the start of every agent turn.
+"""
+def reset_query_embeddings_memo():
+    _query_embeddings_memo.values = {}
+
+"""
+Calculate the embeddings of a query, memoized for the current agent turn. The LLM often calls the search tool
+several times with the same query, and only the first call goes to the embeddings endpoint.
+Args:
+    text (str): The query text.
+Returns:
+    list: The embeddings for the query.
+"""
+def calculate_query_embeddings(text):
+    values = getattr(_query_embeddings_memo, "values", None)
+    if values is None:
+        values = _query_embeddings_memo.values = {}
+    if text not in values:
+        values[text] = calculate_embeddings(text)
+    return values[text]
 
 
 def cosine_similarity(vec1, vec2):
@@ -57,15 +97,19 @@ def cosine_similarity(vec1, vec2):
     norm_vec2 = np.linalg.norm(vec2)
     return dot_product / (norm_vec1 * norm_vec2)
 
+@traced("find_most_similar")
 def find_most_similar(input_text, data, desired_doc_count=1):
-    input_text_embeding = calculate_embeddings(input_text)
-    similarities = []
-    for entry in data:
-        similarity = cosine_similarity(input_text_embeding, np.array(entry["embeddings"]))
-        similarities.append((entry["text"], similarity))
+    # Se construye el índice una sola vez; si ya es un índice (VectorIndex) se reutiliza tal cual
+    index = VectorIndex.from_entries(data) if isinstance(data, list) else data
+    input_text_embeding = calculate_query_embeddings(input_text)
+    with span("similarity_scan"):
+        if retrieval_mode == "hybrid":
+            sorted_documents = hybrid_search(index, input_text, input_text_embeding, desired_doc_count)
+        else:
+            sorted_documents = index.search(input_text_embeding, desired_doc_count)
 
-    sorted_documents =sorted(similarities, key=lambda x: x[1], reverse=True)
-    return sorted_documents[:desired_doc_count]
+    # Si no hay resultados, devolver None
+    return sorted_documents if sorted_documents else None
 
 """
 Create contextual texts for each PDF by combining text from adjacent pages with a specified overlap ratio.
@@ -101,44 +145,6 @@ def create_contextual_texts_per_pdf(filtered_pages_and_texts, overlap_ratio=0.2)
 
     return all_output_texts
 """
-Calculate the cosine similarity between two vectors.
-Parameters:
-vec1 (numpy.ndarray): The first vector.
-vec2 (numpy.ndarray): The second vector.
-Returns:
-float: The cosine similarity between vec1 and vec2.
-"""
-# function implementation
-"""
-Find the most similar documents to the input text based on cosine similarity.
-Parameters:
-input_text (str): The input text to compare.
-data (list of dict): A list of dictionaries, each containing 'text' and 'embeddings' keys.
-desired_doc_count (int, optional): The number of most similar documents to return. Defaults to 1.
-Returns:
-list of tuple: A list of tuples, each containing the text and its similarity score, sorted by similarity in descending order.
-"""
-# function implementation
-def cosine_similarity(vec1, vec2):
-    dot_product = np.dot(vec1, vec2)
-    norm_vec1 = np.linalg.norm(vec1)
-    norm_vec2 = np.linalg.norm(vec2)
-    return dot_product / (norm_vec1 * norm_vec2)
-
-def find_most_similar(input_text, data, desired_doc_count=0):
-    input_text_embeding = calculate_embeddings(input_text)
-    similarities = []
-    
-    for entry in data:
-        similarity = cosine_similarity(input_text_embeding, np.array(entry["embeddings"]))
-        similarities.append((entry["text"], similarity))
-
-    sorted_documents = sorted(similarities, key=lambda x: x[1], reverse=True)
-
-    # Si no hay resultados, devolver None
-    return sorted_documents[:desired_doc_count] if sorted_documents else None
-
-"""
 This script loads a list of embeddings from a JSON file and provides a function to search for the most similar text based on input text.
 Functions:
     search_for_info(input_text, comparision_data=embedings_list, desired_doc_count=1):
@@ -153,14 +159,80 @@ Returns:
 comparision_data = None
 
 def search_for_info(input_text,desired_doc_count=1):   
-    if comparision_data == None:
-        return None
-    most_similar = find_most_similar(input_text, comparision_data, desired_doc_count)
+    most_similar = search_for_info_with_scores(input_text, desired_doc_count)
     if not most_similar:  # Si la lista está vacía
         return None
     most_similar_text = " ".join([entry[0] for entry in most_similar])
     return most_similar_text
 
+"""
+Same search as search_for_info, but returns the matches with the similarity scores computed by the index,
+so callers can judge relevance without embedding the query or the response again.
+Args:
+    input_text (str): The text to search for similar entries.
+    desired_doc_count (int, optional): The number of most similar documents to return. Defaults to 1.
+Returns:
+    list of tuple: (text, similarity) pairs sorted by similarity, or None if there is no data or no match.
+"""
+def search_for_info_with_scores(input_text, desired_doc_count=1):
+    if comparision_data is None:
+        return None
+    return find_most_similar(input_text, comparision_data, desired_doc_count)
+
+# Ficheros con los originales float32 de los índices cuantizados construidos en memoria (se borran con el índice)
+QUANTIZED_ORIGINALS_DIR = os.path.join(index_spill_dir, "originals")
+
+"""
+Builds the index used by search_for_info with the configured backend (VECTOR_INDEX_BACKEND): an exact
+VectorIndex, an approximate IVFIndex, or "auto" to use IVF from ANN_MIN_ROWS rows on. When IVF does not apply
+and VECTOR_INDEX_QUANTIZATION is float16 or int8, the exact index is replaced by a QuantizedIndex whose float32
+originals are written to INDEX_SPILL_DIR/originals and memory-mapped, so only the codes stay in memory.
+Args:
+    data (list of dict or VectorIndex): The entries with 'text' and 'embeddings' keys, or an already built index.
+    approximate (bool): Whether IVF may be used. The registry passes False for the index of each document, which
+                        is searched together with the other documents of the session. Defaults to True.
+Returns:
+    VectorIndex: The index (an IVFIndex when the approximate backend applies).
+"""
+def build_vector_index(data, approximate=True):
+    index = data if isinstance(data, VectorIndex) else VectorIndex.from_entries(data)
+    use_ivf = approximate and (vector_index_backend == "ivf"
+                               or (vector_index_backend == "auto" and len(index) >= ann_min_rows))
+    if use_ivf and not isinstance(index, IVFIndex) and len(index) > 0:
+        index = IVFIndex.from_index(index, n_lists=ivf_n_lists or None)
+    if isinstance(index, IVFIndex):
+        # IVF_N_PROBE se aplica también a los índices guardados con otro valor
+        index.n_probe = ivf_n_probe or None
+    elif vector_index_quantization != "none" and type(index) is VectorIndex and len(index) > 0:
+        index = QuantizedIndex.from_index(index, dtype=vector_index_quantization,
+                                          rescore_factor=quantized_rescore_factor, originals_dir=QUANTIZED_ORIGINALS_DIR)
+    if isinstance(index, QuantizedIndex) and index.originals_dir is None:
+        # Un índice cuantizado abierto desde disco también escribe a disco los originales de las filas que se añadan
+        index.originals_dir = QUANTIZED_ORIGINALS_DIR
+    return index
+
+"""
+Replaces the data used by search_for_info. The entries are packed once into an index (see build_vector_index)
+so that every query is a single matrix-vector product, or a scan of a few inverted lists for large corpora.
+Args:
+    new_data (list of dict or VectorIndex): The entries with 'text' and 'embeddings' keys, or an already built index.
+"""
 def update_comparision_data(new_data):
     global comparision_data  # Permite modificar la variable global
-    comparision_data = new_data
\ No newline at end of file
+    index = None if new_data is None else build_vector_index(new_data)
+    # El índice léxico se construye al ingerir, no en la primera consulta
+    if index is not None and uses_lexical_index():
+        index.lexical_index()
+    comparision_data = index
+
+"""
+Tells whether the retrieval configuration uses the BM25 index (hybrid mode or the lexical fast path), in which
+case it is built with the documents.
+Returns:
+    bool: True if the lexical index is used.
+"""
+def uses_lexical_index():
+    return retrieval_mode == "hybrid" or lexical_fast_path
+
+def get_comparision_data():
+    return comparision_data
@@ -1,21 +1,28 @@
-from tools.search_embedding import search_for_info, calculate_embeddings
+import logging
+
+from tools.search_embedding import search_for_info_with_scores, get_comparision_data
+from tools.index_registry import get_index_registry
+from tools.hybrid_search import lexical_fast_path
 from tools.bing_search import search_for_data_in_bing
-from tools.search_embedding import cosine_similarity
-from llama_index.core.agent import FunctionCallingAgentWorker
-from llama_index.core.agent import AgentRunner
-from llama_index.core.tools import FunctionTool
+from tools.telemetry import increment
+from config.env_loader import lexical_fast_path as lexical_fast_path_enabled
 """
 Registers a custom search tool with Azure OpenAI and returns an agent.
 The custom search tool first searches for information using embeddings and, if no relevant information is found, 
-it falls back to searching for data in Bing. The relevance of the information is determined by calculating the 
-cosine similarity between the query and the response.
+it falls back to searching for data in Bing. The relevance of the information is determined by the cosine
+similarity between the query and the retrieved documents, as already computed by the index search. With
+LEXICAL_FAST_PATH, short keyword queries with a clear lexical match (see lexical_fast_path) are answered with the
+block of the BM25 index without embedding the query: the match is judged on its BM25 score, against
+LEXICAL_FAST_PATH_MIN_SCORE instead of the cosine threshold.
 Returns:
     AgentRunner: An agent runner instance with the registered custom search tool.
 Functions:
-    custom_agent_worker(query: str) -> str:
+    custom_agent_worker(query: str, session_id: str = None) -> str:
         Executes the search tools in order and stops the search if relevant information is found.
         Args:
             query (str): The search query.
+            session_id (str, optional): The session whose documents are searched (see IndexRegistry). Without it
+                                        the global data of search_for_info_with_scores is searched.
         Returns:
             str: The search result, either from embeddings or Bing.
     search_custom:
@@ -25,20 +32,33 @@ Functions:
     agent:
         An AgentRunner instance created from the agent_worker.
 """
-def custom_agent_worker(query: str):
+def custom_agent_worker(query: str, session_id: str = None):
         """Ejecuta las herramientas en orden y detiene la búsqueda si encuentra información."""
-        response = search_for_info(query) 
+        if lexical_fast_path_enabled:
+            index = get_comparision_data() if session_id is None else get_index_registry().get(session_id)
+            # Sin llamada al servicio de embeddings: la coincidencia se juzga solo por su puntuación BM25
+            lexical_results = lexical_fast_path(index, query)
+            if lexical_results:
+                increment("lexical_hit")
+                return " ".join(entry[0] for entry in lexical_results)
+
+        if session_id is None:
+            most_similar = search_for_info_with_scores(query)
+        else:
+            most_similar = get_index_registry().search(session_id, query)
+        response = " ".join(entry[0] for entry in most_similar) if most_similar else None
         # Verifica si la respuesta es válida (no None, no cadena vacía)
-        if response and isinstance(response, str) and response.strip():
-            # Compara la similitud entre la query y la respuesta encontrada
-            similarity_score = cosine_similarity(calculate_embeddings(query), calculate_embeddings(response))
+        if response and response.strip():
+            # Se usa la similitud ya calculada por el índice, sin volver a calcular embeddings
+            similarity_score = max(entry[1] for entry in most_similar)
 
-            # Si la similitud es baja (por ejemplo, < 0.4), se considera irrelevante y se devuelve None
-            print(similarity_score)
+            # Si la similitud es baja (por ejemplo, < 0.4), se considera irrelevante y se recurre a Bing
+            logging.debug("Similitud de la búsqueda en embeddings: %.3f", similarity_score)
             if similarity_score >= 0.4:
+                increment("retrieval_hit")
                 return response
             else:
-                print(f"Respuesta irrelevante, similitud: {similarity_score}. Devolviendo None.")
-                return search_for_data_in_bing(query)
+                logging.debug("Respuesta irrelevante, similitud: %.3f. Buscando en Bing.", similarity_score)
 
+        increment("web_fallback")
         return search_for_data_in_bing(query)
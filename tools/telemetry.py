@@ -0,0 +1,193 @@
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from config.env_loader import metrics_window
+
+# Cuantiles calculados sobre la ventana de cada etapa (y exportados a Prometheus)
+QUANTILES = (0.5, 0.95, 0.99)
+
+"""
+Rolling latency histogram of one stage: the last `window` durations are kept to compute the quantiles, while the
+count and the sum cover the whole life of the process (as Prometheus expects).
+Args:
+    window (int): The number of recent durations used for the quantiles.
+"""
+class LatencyHistogram:
+    def __init__(self, window):
+        self.durations = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.durations.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self):
+        if not self.durations:
+            return {quantile: None for quantile in QUANTILES}
+        values = np.percentile(np.fromiter(self.durations, dtype=np.float64), [100 * q for q in QUANTILES])
+        return dict(zip(QUANTILES, values.tolist()))
+
+"""
+Lightweight tracing layer: spans record the duration of each pipeline stage into rolling histograms, and
+counters record events such as a retrieval hit or a web fallback. It is thread-safe and process-wide, so the
+Streamlit sessions, the agent threads and the ingestion share it.
+Args:
+    window (int): The number of recent durations kept per stage. Defaults to METRICS_WINDOW.
+"""
+class Telemetry:
+    def __init__(self, window=None):
+        self.window = window or metrics_window
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    """
+    Records the duration of a stage.
+    Args:
+        stage (str): The name of the stage.
+        seconds (float): The duration.
+    """
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram(self.window)
+            histogram.observe(seconds)
+
+    """
+    Context manager that records the duration of the enclosed block (also when it raises).
+    Args:
+        stage (str): The name of the stage.
+    """
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    """
+    Decorator that records the duration of every call to the decorated function.
+    Args:
+        stage (str): The name of the stage.
+    """
+    def traced(self, stage):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def increment(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    """
+    Returns the current state of the metrics.
+    Returns:
+        dict: 'stages' (count, total seconds and quantiles in seconds of each stage) and 'counters'.
+    """
+    def snapshot(self):
+        with self._lock:
+            stages = {
+                stage: {"count": histogram.count, "total_seconds": histogram.total, "quantiles": histogram.quantiles()}
+                for stage, histogram in sorted(self.histograms.items())
+            }
+            return {"stages": stages, "counters": dict(sorted(self.counters.items()))}
+
+    """
+    Renders the metrics in the Prometheus text exposition format: one summary per stage (with the rolling
+    quantiles) and one counter per event.
+    Returns:
+        str: The exposition text.
+    """
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP agent_stage_duration_seconds Duration of each pipeline stage.",
+            "# TYPE agent_stage_duration_seconds summary",
+        ]
+        for stage, values in snapshot["stages"].items():
+            for quantile, value in values["quantiles"].items():
+                if value is not None:
+                    lines.append(f'agent_stage_duration_seconds{{stage="{stage}",quantile="{quantile}"}} {value}')
+            lines.append(f'agent_stage_duration_seconds_sum{{stage="{stage}"}} {values["total_seconds"]}')
+            lines.append(f'agent_stage_duration_seconds_count{{stage="{stage}"}} {values["count"]}')
+        lines += [
+            "# HELP agent_events_total Events counted by the agent (retrieval hits, web fallbacks...).",
+            "# TYPE agent_events_total counter",
+        ]
+        for counter, value in snapshot["counters"].items():
+            lines.append(f'agent_events_total{{event="{counter}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    """
+    Writes the Prometheus exposition to a file (for the node_exporter textfile collector, for example).
+    The file is replaced atomically, so a scraper never reads it half written.
+    Args:
+        path (str): The destination file.
+    """
+    def write_prometheus(self, path):
+        with open(path + ".tmp", "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(self.to_prometheus())
+        os.replace(path + ".tmp", path)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+telemetry = Telemetry()
+
+# Atajos sobre la instancia compartida
+span = telemetry.span
+traced = telemetry.traced
+observe = telemetry.observe
+increment = telemetry.increment
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = telemetry.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+"""
+Serves the shared metrics at http://<host>:<port>/metrics in a background thread. Streamlit runs the script on
+every rerun, so only the first call starts the server and the next ones return it.
+Args:
+    port (int): The port to listen on.
+    host (str): The interface to listen on. Defaults to "127.0.0.1".
+Returns:
+    ThreadingHTTPServer: The metrics server.
+"""
+def start_metrics_server(port, host="127.0.0.1"):
+    global _metrics_server
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+        return _metrics_server
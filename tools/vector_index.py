@@ -0,0 +1,432 @@
+import json
+import os
+import struct
+import threading
+
+import numpy as np
+
+from tools.lexical_index import BM25Index
+
+# Ficheros que forman un índice guardado en disco
+MATRIX_FILE_NAME = "embeddings.npy"
+METADATA_FILE_NAME = "metadata.jsonl"
+DELETED_FILE_NAME = "deleted.json"
+
+# Tamaño fijo de la cabecera del .npy, con holgura para que la forma pueda crecer al añadir filas en disco
+NPY_HEADER_SIZE = 128
+
+# Proporción de filas borradas a partir de la cual se compacta el índice
+COMPACT_DELETED_RATIO = 0.25
+
+"""
+Normalizes the rows of a matrix (or a single vector) to unit length so that cosine similarity can be computed
+with a plain dot product. Rows with zero norm are left as zeros.
+Args:
+    vectors (numpy.ndarray): A 1D vector or a 2D matrix with one vector per row.
+Returns:
+    numpy.ndarray: A float32 array with the same shape and unit-length rows.
+"""
+def normalize_vectors(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+"""
+Returns the indices of the k highest scores along the last axis, sorted in descending order of score.
+Uses argpartition so only the k selected candidates are fully sorted.
+Args:
+    scores (numpy.ndarray): A 1D array of scores or a 2D array with one row of scores per query.
+    k (int): The number of indices to return per row.
+Returns:
+    numpy.ndarray: The indices of the top k scores (1D or 2D, following the input).
+"""
+def top_k_indices(scores, k):
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape).copy()
+    candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+    order = np.argsort(-candidate_scores, axis=-1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1)
+
+"""
+In-memory vector index used to search the document embeddings.
+The embeddings are stored once as a contiguous float32 matrix of unit-length rows, so a query is a single
+matrix-vector product followed by an argpartition top-k. Texts and metadata are kept in parallel lists.
+The index can be updated in place: new rows are appended to a buffer that grows geometrically, and removed
+rows are marked as deleted (excluded from the results) until the index is compacted.
+Attributes:
+    matrix (numpy.ndarray): A (n, dim) float32 matrix with the normalized embeddings (it may be a read-only memmap).
+    texts (list): The text of each row.
+    metadata (list): A dictionary per row with the remaining fields of the entry (file_name, page_number, ...).
+    deleted (numpy.ndarray): A boolean mask with the rows removed since the last compaction.
+    lexical (BM25Index): The lexical index of the texts, built on first use (see lexical_index).
+    saved_rows (dict): The number of rows of the index when it was last saved to (or loaded from) each directory,
+                       by absolute path, so later changes can be appended in place (see append_to_disk). It is
+                       cleared when the index is compacted.
+Args:
+    normalized (bool): Whether the matrix rows are already unit-length float32, in which case the matrix is used
+                       as is (without copying). Defaults to False.
+    deleted (numpy.ndarray, optional): The mask of deleted rows (used when loading a saved index).
+"""
+class VectorIndex:
+    def __init__(self, matrix, texts, metadata=None, normalized=False, deleted=None):
+        if normalized:
+            self.matrix = matrix
+        else:
+            self.matrix = np.ascontiguousarray(normalize_vectors(np.atleast_2d(matrix)))
+        self.texts = list(texts)
+        self.metadata = list(metadata) if metadata is not None else [{} for _ in self.texts]
+        self.deleted = np.zeros(len(self.texts), dtype=bool) if deleted is None else np.asarray(deleted, dtype=bool)
+        self._buffer = None
+        self.lexical = None
+        self.saved_rows = {}
+        self._lock = threading.RLock()
+
+    """
+    Builds the index from the list of dictionaries used across the project (keys 'text' and 'embeddings').
+    Any other key of the entries is kept as metadata.
+    Args:
+        entries (list of dict): The entries with 'text' and 'embeddings' keys.
+        **kwargs: The parameters of the subclass, if any.
+    Returns:
+        VectorIndex: The built index.
+    """
+    @classmethod
+    def from_entries(cls, entries, **kwargs):
+        texts, metadata, matrix = split_entries(entries)
+        return cls(matrix, texts, metadata, **kwargs)
+
+    def __len__(self):
+        return len(self.texts)
+
+    """
+    Returns the memory used by the embeddings. A memory-mapped matrix does not count: its pages belong to the
+    OS page cache and are read from disk on demand.
+    Returns:
+        int: The number of bytes.
+    """
+    def memory_usage(self):
+        return 0 if isinstance(self.matrix, np.memmap) else self.matrix.nbytes
+
+    @property
+    def live_count(self):
+        return len(self) - int(self.deleted.sum())
+
+    def _exclude_deleted(self, scores, start=0):
+        # Las filas borradas nunca pueden aparecer entre los resultados
+        deleted = self.deleted[start:start + scores.shape[-1]]
+        if deleted.any():
+            scores[..., deleted] = -np.inf
+        return scores
+
+    """
+    Searches the k rows most similar to the query embedding.
+    Args:
+        query_embedding (list or numpy.ndarray): The embedding of the query.
+        k (int): The number of results to return. Defaults to 1.
+    Returns:
+        list of tuple: (text, similarity) pairs sorted by similarity in descending order.
+    """
+    def search(self, query_embedding, k=1):
+        with self._lock:
+            return [(self.texts[row], score) for row, score in self.search_rows(query_embedding, k)]
+
+    """
+    Same search as search, but returns the row numbers instead of the texts (used to fuse rankings).
+    Args:
+        query_embedding (list or numpy.ndarray): The embedding of the query.
+        k (int): The number of results to return. Defaults to 1.
+    Returns:
+        list of tuple: (row, similarity) pairs sorted by similarity in descending order.
+    """
+    def search_rows(self, query_embedding, k=1):
+        with self._lock:
+            if len(self) == 0:
+                return []
+            scores = self._exclude_deleted(self.matrix @ normalize_vectors(query_embedding))
+            return [(int(i), float(scores[i])) for i in top_k_indices(scores, k) if scores[i] > -np.inf]
+
+    """
+    Searches the k most similar rows for several queries at once, scoring all of them in a single matmul.
+    Args:
+        query_embeddings (list or numpy.ndarray): A (m, dim) matrix or a list of m embeddings.
+        k (int): The number of results to return per query. Defaults to 1.
+    Returns:
+        list of list of tuple: For each query, (text, similarity) pairs sorted by similarity in descending order.
+    """
+    def search_many(self, query_embeddings, k=1):
+        queries = normalize_vectors(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        with self._lock:
+            if len(self) == 0:
+                return [[] for _ in range(len(queries))]
+            scores = self._exclude_deleted(queries @ self.matrix.T)
+            indices = top_k_indices(scores, k)
+            return [
+                [(self.texts[i], float(scores[row, i])) for i in indices[row] if scores[row, i] > -np.inf]
+                for row in range(len(queries))
+            ]
+
+    """
+    Returns the normalized embedding of a row.
+    Args:
+        row (int): The row.
+    Returns:
+        numpy.ndarray: The (dim,) float32 vector.
+    """
+    def row_vector(self, row):
+        return self.matrix[row]
+
+    """
+    Returns the BM25 index of the texts, building it the first time (it is rebuilt after rows are added or the
+    index is compacted).
+    Returns:
+        BM25Index: The lexical index.
+    """
+    def lexical_index(self):
+        with self._lock:
+            if self.lexical is None:
+                self.lexical = BM25Index(self.texts)
+            return self.lexical
+
+    """
+    Returns the lock held while the index is searched or updated. Holding it keeps the row numbers stable across
+    several searches (they change when the index is compacted).
+    Returns:
+        threading.RLock: The lock of the index.
+    """
+    def locked(self):
+        return self._lock
+
+    """
+    Returns the rows (not deleted) whose metadata field has the given value.
+    Args:
+        field (str): The metadata field, e.g. 'file_hash'.
+        value: The value to look for.
+    Returns:
+        list of int: The matching rows.
+    """
+    def find_rows(self, field, value):
+        with self._lock:
+            return [i for i, entry in enumerate(self.metadata) if not self.deleted[i] and entry.get(field) == value]
+
+    """
+    Appends entries to the index in place. The matrix lives in a buffer that doubles its capacity when it is
+    full, so appending does not copy the existing rows every time (a memory-mapped matrix is copied once).
+    Args:
+        entries (list of dict): The entries with 'text' and 'embeddings' keys.
+    Returns:
+        range: The rows of the new entries.
+    """
+    def add_entries(self, entries):
+        texts, metadata, matrix = split_entries(entries)
+        if not texts:
+            return range(len(self), len(self))
+        matrix = normalize_vectors(matrix)
+
+        with self._lock:
+            start = len(self)
+            end = start + len(texts)
+            self._append_matrix(start, matrix)
+            self.texts.extend(texts)
+            self.metadata.extend(metadata)
+            self.deleted = np.concatenate((self.deleted, np.zeros(len(texts), dtype=bool)))
+            self.lexical = None
+            self._rows_added(start, end)
+
+        return range(start, end)
+
+    def _append_matrix(self, start, rows):
+        end = start + len(rows)
+        if start == 0:
+            self._buffer = np.empty((max(end, 16), rows.shape[1]), dtype=np.float32)
+        elif self._buffer is None or len(self._buffer) < end:
+            buffer = np.empty((max(end, 2 * start), self.matrix.shape[1]), dtype=np.float32)
+            buffer[:start] = self.matrix
+            self._buffer = buffer
+        self._buffer[start:end] = rows
+        self.matrix = self._buffer[:end]
+
+    def _rows_added(self, start, end):
+        pass
+
+    """
+    Marks rows as deleted. They are excluded from the results immediately and dropped on the next compaction.
+    Args:
+        rows (list of int): The rows to remove.
+    """
+    def remove_rows(self, rows):
+        with self._lock:
+            self.deleted[list(rows)] = True
+
+    def needs_compaction(self):
+        return len(self) > 0 and (len(self) - self.live_count) / len(self) > COMPACT_DELETED_RATIO
+
+    """
+    Drops the deleted rows, rebuilding the matrix and the parallel lists. The row numbers change, so an index
+    saved on disk has to be saved again (see save) after compacting it.
+    """
+    def compact(self):
+        with self._lock:
+            keep = np.flatnonzero(~self.deleted)
+            self.matrix = np.ascontiguousarray(self.matrix[keep])
+            self.texts = [self.texts[i] for i in keep]
+            self.metadata = [self.metadata[i] for i in keep]
+            self.deleted = np.zeros(len(keep), dtype=bool)
+            self._buffer = None
+            self.lexical = None
+            self.saved_rows = {}
+
+    """
+    Saves the index to a directory: the normalized matrix as a raw float32 .npy file (with room in its header
+    for appending rows later), the texts and metadata as one JSON line per row, and the deleted rows. The files
+    are written under temporary names and then renamed, so a reader never sees a half-written index.
+    Args:
+        directory (str): The directory to save the index to. It is created if it does not exist.
+    """
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            matrix_path = os.path.join(directory, MATRIX_FILE_NAME)
+            metadata_path = os.path.join(directory, METADATA_FILE_NAME)
+            with open(metadata_path + ".tmp", "w", encoding="utf-8") as metadata_file:
+                write_metadata_lines(metadata_file, self.texts, self.metadata)
+            with open(matrix_path + ".tmp", "wb") as matrix_file:
+                write_npy_header(matrix_file, self.matrix.shape if len(self) else (0, 0))
+                matrix_file.write(np.ascontiguousarray(self.matrix, dtype=np.float32).tobytes())
+            os.replace(metadata_path + ".tmp", metadata_path)
+            os.replace(matrix_path + ".tmp", matrix_path)
+            self.save_deletions(directory)
+            self.saved_rows[os.path.abspath(directory)] = len(self)
+
+    """
+    Updates an index saved on disk in place with the rows appended since it was saved (rows from `start` on):
+    the rows are written at the end of the .npy file, its header is rewritten with the new shape and the
+    metadata lines are appended. The deleted rows are saved too.
+    Args:
+        directory (str): The directory the index was saved to.
+        start (int): The first row not yet saved.
+    """
+    def append_to_disk(self, directory, start):
+        with self._lock:
+            if start < len(self):
+                append_saved_rows(directory, self.texts[start:], self.metadata[start:], self.matrix[start:], start)
+            self.save_deletions(directory)
+            self.saved_rows[os.path.abspath(directory)] = len(self)
+
+    def save_deletions(self, directory):
+        save_deleted_rows(directory, np.flatnonzero(self.deleted).tolist())
+
+    """
+    Opens an index saved with save(). The matrix is memory-mapped read-only, so opening it does not copy the
+    embeddings into memory or into Python objects.
+    Args:
+        directory (str): The directory the index was saved to.
+        mmap (bool): Whether to memory-map the matrix instead of reading it. Defaults to True.
+    Returns:
+        VectorIndex: The loaded index.
+    """
+    @classmethod
+    def load(cls, directory, mmap=True, **kwargs):
+        matrix = np.load(os.path.join(directory, MATRIX_FILE_NAME), mmap_mode="r" if mmap else None)
+        texts = []
+        rows = []
+        with open(os.path.join(directory, METADATA_FILE_NAME), encoding="utf-8") as metadata_file:
+            for line in metadata_file:
+                entry = json.loads(line)
+                texts.append(entry.pop("text"))
+                rows.append(entry)
+
+        # Si una escritura se interrumpió, solo son válidas las filas presentes en ambos ficheros
+        count = min(len(matrix), len(texts))
+        deleted = np.zeros(count, dtype=bool)
+        deleted_path = os.path.join(directory, DELETED_FILE_NAME)
+        if os.path.isfile(deleted_path):
+            with open(deleted_path, encoding="utf-8") as deleted_file:
+                deleted[[row for row in json.load(deleted_file) if row < count]] = True
+
+        index = cls(matrix[:count], texts[:count], rows[:count], normalized=True, deleted=deleted, **kwargs)
+        # Tras una escritura interrumpida el índice no se puede ampliar en el sitio: habrá que guardarlo entero
+        if len(matrix) == len(texts):
+            index.saved_rows[os.path.abspath(directory)] = count
+        return index
+
+"""
+Splits the entries used across the project into texts, metadata and a float32 matrix.
+Args:
+    entries (list of dict): The entries with 'text' and 'embeddings' keys.
+Returns:
+    tuple: The texts, the metadata dictionaries and the (n, dim) matrix.
+"""
+def split_entries(entries):
+    entries = list(entries)
+    texts = [entry["text"] for entry in entries]
+    metadata = [{key: value for key, value in entry.items() if key not in ("text", "embeddings")} for entry in entries]
+    if entries:
+        matrix = np.vstack([np.asarray(entry["embeddings"], dtype=np.float32) for entry in entries])
+    else:
+        matrix = np.empty((0, 0), dtype=np.float32)
+    return texts, metadata, matrix
+
+def write_metadata_lines(metadata_file, texts, metadata):
+    for text, entry in zip(texts, metadata):
+        metadata_file.write(json.dumps({"text": text, **entry}, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+"""
+Appends rows at the end of an index saved on disk: the metadata lines are appended, the rows are written at the end
+of the .npy file and its header is rewritten with the new shape.
+Args:
+    directory (str): The directory the index was saved to.
+    texts (list of str): The texts of the new rows.
+    metadata (list of dict): The metadata of the new rows.
+    matrix (numpy.ndarray): The (m, dim) normalized embeddings of the new rows.
+    start (int): The number of rows already saved.
+"""
+def append_saved_rows(directory, texts, metadata, matrix, start):
+    with open(os.path.join(directory, METADATA_FILE_NAME), "a", encoding="utf-8") as metadata_file:
+        write_metadata_lines(metadata_file, texts, metadata)
+    with open(os.path.join(directory, MATRIX_FILE_NAME), "r+b") as matrix_file:
+        matrix_file.seek(0, os.SEEK_END)
+        matrix_file.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        # La cabecera se actualiza al final: si algo falla antes, las filas nuevas se ignoran al cargar
+        matrix_file.seek(0)
+        write_npy_header(matrix_file, (start + len(matrix), matrix.shape[1]))
+
+def save_deleted_rows(directory, rows):
+    deleted_path = os.path.join(directory, DELETED_FILE_NAME)
+    with open(deleted_path + ".tmp", "w", encoding="utf-8") as deleted_file:
+        json.dump(list(rows), deleted_file)
+    os.replace(deleted_path + ".tmp", deleted_path)
+
+"""
+Writes a version 1.0 .npy header for a float32 C-ordered matrix, padded to NPY_HEADER_SIZE bytes so it can be
+rewritten in place when rows are appended to the file.
+Args:
+    matrix_file (file): The file, positioned at its start.
+    shape (tuple): The shape of the matrix.
+"""
+def write_npy_header(matrix_file, shape):
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % tuple(shape)
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    matrix_file.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+
+"""
+Lists the indexes saved in a directory.
+Args:
+    directory (str): The directory that contains one subdirectory per saved index.
+Returns:
+    list of str: The names of the saved indexes, sorted alphabetically.
+"""
+def list_saved_indexes(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        name for name in os.listdir(directory)
+        if os.path.isfile(os.path.join(directory, name, MATRIX_FILE_NAME))
+        and os.path.isfile(os.path.join(directory, name, METADATA_FILE_NAME))
+    )